@@ -0,0 +1,223 @@
+"""Search tree stored in parallel arrays instead of `solver.Node` objects.
+
+Each node of the tree is an index in the columns of an `ArrayTree`. The
+columns hold the value, the index of the parent node, the index of the
+operation used to reach the node, the memory and the number of remaining
+moves, using a few bytes per node instead of a Python object, its
+`__dict__` and its list of children.
+"""
+
+# pylint: disable=C0111
+# pylint: disable=W0212
+
+import unittest
+from array import array
+import operations as op
+import solver
+
+# Value used in the memory column when nothing was stored yet
+NO_MEMORY = -2**63
+
+
+class ArrayTree:
+    """The whole tree of moves from a root node.
+
+    The nodes are stored in depth first order (each node comes before its
+    children), so the first node that is a solution is the same one
+    `solver.find_solution_node_in_tree` returns.
+
+    Values that don't fit in 64 bits are not stored (the move producing
+    them is considered invalid).
+
+    Parameters
+    ----------
+    root : solver.Node
+        The root node. Its tree does not need to be created.
+    """
+    def __init__(self, root):
+        self._warp = root._warp
+
+        self.values = array("q")
+        self.parents = array("q")
+        self.op_indices = array("h")
+        self.memory = array("q")
+        self.remaining_moves = array("h")
+        # Index in `_parameters_table` of the values of the operations in
+        # each node. This only changes after a `op.ModifyButtons_AddValue`.
+        self.parameters_indices = array("i")
+        # Index in `_orders_table` of the order of the buttons in each node
+        # (see `solver.Node.order_after_operation`), which also only changes
+        # after a `op.ModifyButtons_AddValue`
+        self.orders_indices = array("i")
+
+        self._operations = root._available_ops
+        self._parameters_table = []
+        self._parameters_keys = {}
+        self._orders_table = []
+        self._orders_keys = {}
+
+        self._append(root.value, -1, -1, root._memory,
+                     root.num_remaining_moves,
+                     self._parameters_index(root._parameters),
+                     self._order_index(root._order))
+
+    def __len__(self):
+        return len(self.values)
+
+    def _parameters_index(self, parameters):
+        """Index of `parameters` in the table of distinct parameters"""
+        if parameters not in self._parameters_keys:
+            self._parameters_keys[parameters] = len(self._parameters_table)
+            self._parameters_table.append(parameters)
+        return self._parameters_keys[parameters]
+
+    def _order_index(self, order):
+        """Index of `order` in the table of distinct orders"""
+        if order not in self._orders_keys:
+            self._orders_keys[order] = len(self._orders_table)
+            self._orders_table.append(order)
+        return self._orders_keys[order]
+
+    def _append(self, value, parent, op_idx, memory, remaining_moves,
+                parameters_idx, order_idx):
+        # The value goes first: if it doesn't fit nothing was appended yet
+        # (the memory is always a value that was already stored)
+        self.values.append(value)
+        self.parents.append(parent)
+        self.op_indices.append(op_idx)
+        self.memory.append(NO_MEMORY if memory is None else memory)
+        self.remaining_moves.append(remaining_moves)
+        self.parameters_indices.append(parameters_idx)
+        self.orders_indices.append(order_idx)
+
+    def parameters(self, idx):
+        """The values of the operations in the node `idx`"""
+        return self._parameters_table[self.parameters_indices[idx]]
+
+    def _apply(self, idx, op_idx):
+        """Create the child of node `idx` obtained with operation `op_idx`.
+
+        Returns True if the child was created.
+        """
+        parameters = self.parameters(idx)
+        memory = self.memory[idx]
+        try:
+            value, memory, new_parameters, num_used_moves = \
+                solver.Node.apply_operation(
+                    self.values[idx], None if memory == NO_MEMORY else memory,
+                    parameters, self._operations, op_idx, self._warp)
+            if new_parameters is parameters:
+                parameters_idx = self.parameters_indices[idx]
+            else:
+                parameters_idx = self._parameters_index(new_parameters)
+            order = self._orders_table[self.orders_indices[idx]]
+            new_order = solver.Node.order_after_operation(
+                order, self._operations, op_idx)
+            if new_order is order:
+                order_idx = self.orders_indices[idx]
+            else:
+                order_idx = self._order_index(new_order)
+            self._append(value, idx, op_idx, memory,
+                         self.remaining_moves[idx] - num_used_moves,
+                         parameters_idx, order_idx)
+        except (ValueError, OverflowError):
+            return False
+        return True
+
+    def create_children(self):
+        """Create every node of the tree (see `solver.Node.create_children`)
+        """
+        # Each element is a node index, the indices of the operations in
+        # the order they are tried and the position of the next one
+        num_operations = len(self._operations)
+        stack = [[0, self._ordered_indices(0), 0]]
+        while stack:
+            frame = stack[-1]
+            idx, op_indices, position = frame
+            if self.remaining_moves[idx] == 0 or position == num_operations:
+                stack.pop()
+                continue
+            frame[2] += 1
+            if self._apply(idx, op_indices[position]):
+                child = len(self.values) - 1
+                stack.append([child, self._ordered_indices(child), 0])
+
+    def _ordered_indices(self, idx):
+        return solver.Node.ordered_indices(
+            self._orders_table[self.orders_indices[idx]],
+            len(self._operations))
+
+    def find_solution(self, target_value):
+        """Index of the first node reaching `target_value` with all the moves,
+        or None"""
+        for idx, (value, remaining_moves) in enumerate(
+                zip(self.values, self.remaining_moves)):
+            if remaining_moves == 0 and value == target_value:
+                return idx
+        return None
+
+    def parse_operations_until_node(self, idx):
+        """Names of the operations used to reach node `idx` (see
+        `solver.parse_operations_until_node`)"""
+        operations = []
+        while idx is not None and self.parents[idx] >= 0:
+            parent = self.parents[idx]
+            op_idx = self.op_indices[idx]
+            operations.append(self._operations[op_idx].name_with(
+                self.parameters(parent)[op_idx]))
+            idx = parent
+        return list(reversed(operations))
+
+
+# xxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxx
+
+class TestArrayTree(solver.TestSolver):
+    @staticmethod
+    def solve(start_value, target_value, num_moves, operations, warp=None):
+        root = solver.Node(value=start_value, current_op=None,
+                           available_ops=operations,
+                           num_remaining_moves=num_moves, warp=warp)
+        tree = ArrayTree(root)
+        tree.create_children()
+        return tree.parse_operations_until_node(tree.find_solution(
+            target_value))
+
+    def test_same_tree(self):
+        operations = [op.SumX(3), op.MultiplyX(2), op.Reverse(),
+                      op.StorageAction(), op.RetrieveAction()]
+        # The modifier moves to the end when it is pressed
+        operations.insert(1, op.ModifyButtons_AddValue(operations, 1))
+        root = solver.Node(value=2, current_op=None,
+                           available_ops=operations, num_remaining_moves=4)
+        tree = ArrayTree(root)
+        tree.create_children()
+
+        def iter_nodes(node):
+            yield node
+            for child in node.iter_children():
+                yield from iter_nodes(child)
+
+        nodes = list(iter_nodes(root))
+        self.assertEqual(list(tree.values), [n.value for n in nodes])
+        self.assertEqual(list(tree.remaining_moves),
+                         [n.num_remaining_moves for n in nodes])
+        self.assertEqual(
+            [tree.parse_operations_until_node(i) for i in range(len(tree))],
+            [solver.parse_operations_until_node(n) for n in nodes])
+
+    def test_overflow(self):
+        root = solver.Node(value=10**9, current_op=None,
+                           available_ops=[op.MultiplyX(10**9), op.SumX(1)],
+                           num_remaining_moves=2)
+        tree = ArrayTree(root)
+        tree.create_children()
+        self.assertEqual(list(tree.values),
+                         [10**9, 10**18, 10**18 + 1, 10**9 + 1,
+                          10**18 + 10**9, 10**9 + 2])
+        self.assertEqual(tree.find_solution(10**9 + 2), 5)
+        self.assertEqual(tree.parse_operations_until_node(5),
+                         ['sum with 1', 'sum with 1'])
+
+
+if __name__ == '__main__':
+    unittest.main()
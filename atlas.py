@@ -0,0 +1,400 @@
+"""Precomputed transition tables of a set of buttons, stored on disk.
+
+Many levels use the same buttons with different start and target values. An
+atlas stores, for each button and each value of a bounded domain (by default
+-999999 to 999999), the value obtained pressing the button (including the
+warp). The tables are written as arrays of 32 bits integers and opened with
+`mmap`, so opening an atlas is immediate and only the pages that are used are
+read. A query is then a depth first search (in the same order as
+`solver.find_solution_node`) where applying a button is a table lookup.
+
+Only levels whose state is just the value (no memory or button modifiers)
+can use an atlas. Run `python atlas.py --help` to build one, and use
+`find_solution_node` to solve levels with the atlases of a directory.
+"""
+
+# pylint: disable=C0111
+
+import argparse
+import array
+import functools
+import hashlib
+import json
+import mmap
+import os
+import struct
+import sys
+import tempfile
+import unittest
+import operations as op
+import solver
+from compiled import CompiledLevel
+from levels import buttons_key
+from pruning import Pruner
+
+_MAGIC = b"CGATLAS1"
+
+# Entries of the tables for the buttons that can't be pressed and for the
+# values outside of the domain of the atlas
+INVALID = -2**31
+OUTSIDE = -2**31 + 1
+
+
+class OutsideAtlas(Exception):
+    """Raised when a query needs values outside of the domain of the atlas"""
+
+
+# String identifying the buttons (in order) and warp of an atlas
+atlas_key = buttons_key
+
+
+def atlas_path(directory, operations, warp=None):
+    """Path of the atlas of `operations` and `warp` in `directory`"""
+    digest = hashlib.sha1(atlas_key(operations, warp).encode()).hexdigest()
+    return os.path.join(directory, f"atlas_{digest[:16]}.bin")
+
+
+def supports(operations):
+    """Return True if the state of a level with `operations` is its value"""
+    return not any(isinstance(i, (op.StorageAction, op.RetrieveAction,
+                                  op.ModifyButtons_AddValue))
+                   for i in operations)
+
+
+def build_atlas(path, operations, warp=None, max_digits=6):
+    """Compute the tables of `operations` and write them to `path`.
+
+    Parameters
+    ----------
+    path : str
+        The file where the atlas is written.
+    operations : list[op.Operation]
+        The buttons, in the order of the level.
+    warp : op.WarpAction
+        The warp action of the level, if any.
+    max_digits : int
+        The domain of the atlas are the values with at most `max_digits`
+        digits.
+    """
+    if not supports(operations):
+        raise ValueError("Only levels without memory and button modifiers "
+                         "are supported")
+    if max_digits > 9:
+        raise ValueError("The values must fit in 32 bits")
+    low = -(10**max_digits - 1)
+    size = 2 * 10**max_digits - 1
+    tables = [array.array("i", [INVALID]) * size for _ in operations]
+
+    successors = CompiledLevel(operations, warp).successors
+    parameters = op.parameters_of(operations)
+    for offset in range(size):
+        for new_value, i in successors(low + offset, None, parameters):
+            tables[i][offset] = (new_value if -low >= abs(new_value)
+                                 else OUTSIDE)
+
+    header = json.dumps({"key": atlas_key(operations, warp),
+                         "max_digits": max_digits,
+                         "byteorder": sys.byteorder}).encode()
+    # The tables start at a multiple of 4 bytes
+    header += b" " * (-(len(_MAGIC) + 4 + len(header)) % 4)
+    with open(path, "wb") as f:
+        f.write(_MAGIC + struct.pack("<I", len(header)) + header)
+        for table in tables:
+            table.tofile(f)
+
+
+class Atlas:
+    """An atlas opened with `mmap` (see `load_atlas`).
+
+    Parameters
+    ----------
+    path : str
+        The file written by `build_atlas`.
+    """
+    def __init__(self, path):
+        with open(path, "rb") as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if self._mmap[:len(_MAGIC)] != _MAGIC:
+            raise ValueError(f"{path} is not an atlas")
+        start = len(_MAGIC) + 4
+        header_size = struct.unpack("<I", self._mmap[len(_MAGIC):start])[0]
+        header = json.loads(self._mmap[start:start + header_size])
+        if header["byteorder"] != sys.byteorder:
+            raise ValueError(f"{path} was built with another byte order")
+
+        self.key = header["key"]
+        self.max_digits = header["max_digits"]
+        self._low = -(10**self.max_digits - 1)
+        self._size = 2 * 10**self.max_digits - 1
+        data = memoryview(self._mmap)[start + header_size:].cast("i")
+        self.num_operations = len(data) // self._size
+        self._tables = [data[i * self._size:(i + 1) * self._size]
+                        for i in range(self.num_operations)]
+
+    def close(self):
+        self._tables = []
+        self._mmap.close()
+
+    def contains(self, value):
+        return abs(value) <= -self._low
+
+    def lookup(self, op_index, value):
+        """Value after pressing the button `op_index`, `INVALID` if it can't
+        be pressed or `OUTSIDE` if the result is outside of the domain"""
+        return self._tables[op_index][value - self._low]
+
+    def find_solution_indices(self, start_value, target_value, num_moves):
+        """Operation indices of the first solution, or None.
+
+        The search has the same order as `solver.find_solution_node` and
+        skips the (value, remaining moves) states already proven to be dead.
+
+        Raises
+        ------
+        OutsideAtlas
+            If the answer depends on values outside of the domain.
+        """
+        if not (self.contains(start_value) and self.contains(target_value)):
+            raise OutsideAtlas()
+        if num_moves == 0:
+            return [] if start_value == target_value else None
+
+        tables = self._tables
+        low = self._low
+        num_operations = self.num_operations
+        dead_states = set()
+        path = []
+        # Each frame holds the offset of a value and the index of the next
+        # button to press
+        stack = [[start_value - low, 0]]
+        while stack:
+            frame = stack[-1]
+            remaining = num_moves - len(path)
+            if frame[1] == num_operations:
+                stack.pop()
+                dead_states.add((frame[0], remaining))
+                if path:
+                    path.pop()
+                continue
+            i = frame[1]
+            frame[1] += 1
+            new_value = tables[i][frame[0]]
+            if new_value == INVALID:
+                continue
+            if remaining == 1:
+                if new_value == target_value:
+                    return path + [i]
+                continue
+            if new_value == OUTSIDE:
+                # The first solution could be below this node
+                raise OutsideAtlas()
+            offset = new_value - low
+            if (offset, remaining - 1) not in dead_states:
+                path.append(i)
+                stack.append([offset, 0])
+        return None
+
+
+@functools.lru_cache(maxsize=16)
+def load_atlas(path):
+    """Open the atlas in `path`, reusing the already opened ones.
+
+    Returns None if the file does not exist.
+    """
+    if not os.path.exists(path):
+        return None
+    return Atlas(path)
+
+
+def find_solution_node_in_atlas(root, target_value, directory):
+    """Solve the level of `root` with its atlas in `directory`, if any.
+
+    Returns
+    -------
+    tuple[bool, solver.Node]
+        Whether the atlas answered the query, and the solution node (None
+        if there is no solution).
+    """
+    operations = root._available_ops
+    if root._memory is not None or not supports(operations):
+        return False, None
+    atlas = load_atlas(atlas_path(directory, operations, root._warp))
+    if atlas is None or atlas.key != atlas_key(operations, root._warp):
+        return False, None
+    try:
+        indices = atlas.find_solution_indices(
+            root.value, target_value, root.num_remaining_moves)
+    except OutsideAtlas:
+        return False, None
+    if indices is None:
+        return True, None
+    return True, solver.replay_operation_indices(root, indices)
+
+
+def find_solution_node(root, target_value, directory, deduplicate=False,
+                       pruner=None, stats=None, canonical_order=False,
+                       budget=None):
+    """Same as `solver.find_solution_node`, but using the atlas of the level
+    in `directory` if there is one.
+
+    The atlas is only used when no `pruner`, `stats` or `budget` are given
+    and `canonical_order` is False, since it can't apply them (see the
+    `atlas` argument of `solver.find_solution_node`).
+    """
+    return solver.find_solution_node(
+        root, target_value, deduplicate, pruner=pruner, stats=stats,
+        canonical_order=canonical_order, budget=budget,
+        atlas=functools.partial(find_solution_node_in_atlas,
+                                directory=directory))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("buttons",
+                        help='JSON list of buttons, as in the levels of '
+                        'batch.py (for instance \'[["SumX", 2], '
+                        '["Reverse"]]\')')
+    parser.add_argument("-w", "--warp", default=None,
+                        help="JSON list with the warp portals")
+    parser.add_argument("-d", "--directory", default=".",
+                        help="Where to write the atlas")
+    parser.add_argument("--max-digits", type=int, default=6,
+                        help="Maximum number of digits of the values")
+    args = parser.parse_args(argv)
+
+    operations = [op.operation_from_spec(i) for i in json.loads(args.buttons)]
+    warp = None if args.warp is None else op.WarpAction(
+        *json.loads(args.warp))
+    path = atlas_path(args.directory, operations, warp)
+    build_atlas(path, operations, warp, args.max_digits)
+    print(path)
+
+
+# xxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxx
+
+class TestAtlasSolver(solver.TestSolver):
+    directory = None
+
+    @classmethod
+    def setUpClass(cls):
+        cls.directory = tempfile.TemporaryDirectory()
+
+    @classmethod
+    def tearDownClass(cls):
+        load_atlas.cache_clear()
+        cls.directory.cleanup()
+
+    @classmethod
+    def solve(cls, start_value, target_value, num_moves, operations,
+              warp=None):
+        if supports(operations):
+            path = atlas_path(cls.directory.name, operations, warp)
+            if not os.path.exists(path):
+                build_atlas(path, operations, warp, max_digits=4)
+        root = solver.Node(value=start_value, current_op=None,
+                           available_ops=operations,
+                           num_remaining_moves=num_moves, warp=warp)
+        n = find_solution_node(root, target_value, cls.directory.name)
+        return solver.parse_operations_until_node(n)
+
+
+class TestAtlas(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.operations = [op.SumX(7), op.MultiplyX(3), op.Reverse(),
+                           op.DivideX(2)]
+        self.path = atlas_path(self.directory.name, self.operations)
+        build_atlas(self.path, self.operations, max_digits=3)
+
+    def tearDown(self):
+        load_atlas.cache_clear()
+        self.directory.cleanup()
+
+    def test_tables(self):
+        atlas = load_atlas(self.path)
+        self.assertIs(load_atlas(self.path), atlas)
+        self.assertEqual(atlas.num_operations, 4)
+        self.assertEqual(atlas.lookup(0, 5), 12)
+        self.assertEqual(atlas.lookup(1, 500), OUTSIDE)
+        self.assertEqual(atlas.lookup(2, 11), INVALID)
+        self.assertEqual(atlas.lookup(3, -8), -4)
+        self.assertEqual(atlas.lookup(3, 7), INVALID)
+        self.assertIsNone(load_atlas(self.path + ".missing"))
+
+        with self.assertRaises(ValueError):
+            build_atlas(self.path, [op.StorageAction(), op.RetrieveAction()])
+
+    def test_same_solutions(self):
+        for start_value in (-3, 0, 2):
+            root = solver.Node(value=start_value, current_op=None,
+                               available_ops=self.operations,
+                               num_remaining_moves=4)
+            for target_value in range(-50, 200):
+                expected = solver.find_solution_node(root, target_value)
+                answered, n = find_solution_node_in_atlas(
+                    root, target_value, self.directory.name)
+                if answered:
+                    self.assertEqual(
+                        solver.parse_operations_until_node(n),
+                        solver.parse_operations_until_node(expected))
+
+    def test_outside(self):
+        atlas = load_atlas(self.path)
+        with self.assertRaises(OutsideAtlas):
+            atlas.find_solution_indices(5000, 1, 3)
+        # 350 * 3 is outside of the domain, before the solution
+        # reverse(350) + 7
+        with self.assertRaises(OutsideAtlas):
+            atlas.find_solution_indices(350, 60, 2)
+        # But the last move can leave the domain
+        self.assertEqual(atlas.find_solution_indices(350, 53, 1), [2])
+
+        root = solver.Node(value=350, current_op=None,
+                           available_ops=self.operations,
+                           num_remaining_moves=2)
+        self.assertEqual(find_solution_node_in_atlas(
+            root, 60, self.directory.name), (False, None))
+        self.assertEqual(solver.parse_operations_until_node(
+            solver.find_solution_node(root, 60)), ["reverse", "sum with 7"])
+
+    def test_find_solution_node(self):
+        root = solver.Node(value=2, current_op=None,
+                           available_ops=self.operations,
+                           num_remaining_moves=3)
+        n = find_solution_node(root, 34, self.directory.name)
+        self.assertEqual(load_atlas.cache_info().misses, 1)
+        self.assertEqual(solver.parse_operations_until_node(n),
+                         ["sum with 7", "multiply by 3", "sum with 7"])
+        lookup = functools.partial(find_solution_node_in_atlas,
+                                   directory=self.directory.name)
+        n = solver.find_solution_node(root, 34, atlas=lookup)
+        self.assertEqual(load_atlas.cache_info().hits, 1)
+        self.assertEqual(solver.parse_operations_until_node(n),
+                         ["sum with 7", "multiply by 3", "sum with 7"])
+
+        # The atlas can't apply the rules of a pruner: with a 2 digits
+        # display the first solution does not go through 120
+        load_atlas.cache_clear()
+        root = solver.Node(value=40, current_op=None,
+                           available_ops=self.operations,
+                           num_remaining_moves=3)
+        pruner = Pruner(6, self.operations, max_digits=2)
+        n = find_solution_node(root, 6, self.directory.name, pruner=pruner)
+        self.assertEqual(load_atlas.cache_info().misses, 0)
+        self.assertEqual(solver.parse_operations_until_node(n),
+                         ["reverse", "multiply by 3", "divide by 2"])
+        n = find_solution_node(root, 6, self.directory.name)
+        self.assertEqual(solver.parse_operations_until_node(n),
+                         ["multiply by 3", "divide by 2", "reverse"])
+
+    def test_main(self):
+        with tempfile.TemporaryDirectory() as directory:
+            main(['[["SumX", 2], ["Reverse"]]', "-w", "[2, 0]", "-d",
+                  directory, "--max-digits", "2"])
+            path = atlas_path(directory, [op.SumX(2), op.Reverse()],
+                              op.WarpAction(2, 0))
+            self.assertTrue(os.path.exists(path))
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,197 @@
+"""Solve many levels described in a JSON lines stream.
+
+Each input line is a level as described by `levels.Level.to_spec`. The
+levels are solved by a pool of worker processes and one JSON line is written
+for each level as soon as it is solved, so the results are not in the same
+order as the input. Run `python batch.py --help` for the options.
+"""
+
+# pylint: disable=C0111
+
+import argparse
+import concurrent.futures
+import io
+import json
+import os
+import sys
+import time
+import unittest
+import solver
+from levels import Level
+
+
+def solve_level_spec(index, spec, deduplicate=False):
+    """Solve the level described by `spec` (runs in a worker process).
+
+    Returns
+    -------
+    dict
+        The result, with the `index` of the level in the input, its name
+        (if any), the solution (list of button names, or None if there is no
+        solution) and the time spent solving it. If the level can't be
+        parsed or solving it raises an exception, there is an `error`
+        instead of the solution.
+    """
+    result = {"index": index}
+    try:
+        if isinstance(spec, str):
+            spec = json.loads(spec)
+        level = Level.from_spec(spec)
+    except ValueError as e:
+        result["error"] = str(e)
+        return result
+
+    if level.name is not None:
+        result["name"] = level.name
+    start = time.perf_counter()
+    try:
+        n = solver.find_solution_node(level.create_root(),
+                                      level.target_value,
+                                      deduplicate=deduplicate)
+    except Exception as e:  # pylint: disable=W0703
+        result["error"] = f"{type(e).__name__}: {e}"
+        return result
+    result["time"] = time.perf_counter() - start
+    result["solution"] = (None if n is None
+                          else solver.parse_operations_until_node(n))
+    return result
+
+
+def solve_batch(lines, max_workers=None, deduplicate=False):
+    """Solve the levels in `lines` concurrently.
+
+    Parameters
+    ----------
+    lines : iterable[str]
+        One JSON level description per line. Empty lines are ignored.
+    max_workers : int, optional
+        Number of worker processes. Default is the number of CPUs.
+    deduplicate : bool
+        Passed to `solver.find_solution_node`.
+
+    Yields
+    ------
+    dict
+        The result of `solve_level_spec` for each level, as soon as it is
+        available.
+    """
+    if max_workers is None:
+        max_workers = os.cpu_count() or 1
+    with concurrent.futures.ProcessPoolExecutor(max_workers) as executor:
+        # Keep a bounded number of levels in flight, so that the input is
+        # also consumed as a stream
+        max_pending = 2 * max_workers
+        pending = set()
+        for index, line in enumerate(lines):
+            if not line.strip():
+                continue
+            pending.add(executor.submit(solve_level_spec, index, line,
+                                        deduplicate))
+            if len(pending) >= max_pending:
+                done, pending = concurrent.futures.wait(
+                    pending, return_when=concurrent.futures.FIRST_COMPLETED)
+                for future in done:
+                    yield future.result()
+
+        for future in concurrent.futures.as_completed(pending):
+            yield future.result()
+
+
+def main(argv=None, stdin=None, stdout=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("input", nargs="?", default="-",
+                        help="JSON lines file with the levels (default stdin)")
+    parser.add_argument("-o", "--output", default="-",
+                        help="Where to write the results (default stdout)")
+    parser.add_argument("-j", "--workers", type=int, default=None,
+                        help="Number of worker processes")
+    parser.add_argument("--deduplicate", action="store_true",
+                        help="Skip states already proven to be dead")
+    args = parser.parse_args(argv)
+
+    stdin = sys.stdin if stdin is None else stdin
+    stdout = sys.stdout if stdout is None else stdout
+    # pylint: disable=R1732
+    input_file = (stdin if args.input == "-"
+                  else open(args.input, encoding="utf-8"))
+    output_file = (stdout if args.output == "-"
+                   else open(args.output, "w", encoding="utf-8"))
+    try:
+        for result in solve_batch(input_file, args.workers, args.deduplicate):
+            output_file.write(json.dumps(result) + "\n")
+            output_file.flush()
+    finally:
+        if input_file is not stdin:
+            input_file.close()
+        if output_file is not stdout:
+            output_file.close()
+
+
+# xxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxx
+
+class TestBatch(unittest.TestCase):
+    LEVELS = [
+        {"name": "127", "start": -1, "target": 2020, "moves": 8,
+         "buttons": [["MultiplyX", 3], ["SumX", 2], ["SumX", 8], ["Mirror"],
+                     ["Reverse"]]},
+        {"name": "139", "start": 5, "target": 41, "moves": 4,
+         "buttons": [["MultiplyX", 3], ["SumX", 4], ["SumX", 8],
+                     ["ModifyButtons_AddValue", 2]]},
+        {"name": "142", "start": 1, "target": 1111, "moves": 2,
+         "buttons": [["StorageAction"], ["RetrieveAction"]]},
+        {"name": "180", "start": 99, "target": 10, "moves": 3,
+         "buttons": [["AddDigits", 1], ["SumX", -1]], "warp": [2, 0]},
+        {"name": "unsolvable", "start": 1, "target": 15, "moves": 4,
+         "buttons": [["MultiplyX", 2]]},
+    ]
+
+    def check_results(self, results):
+        results = sorted(results, key=lambda r: r["index"])
+        self.assertEqual([r["name"] for r in results],
+                         ["127", "139", "142", "180", "unsolvable"])
+        self.assertEqual(results[1]["solution"],
+                         ['[+]2', 'multiply by 5', 'sum with 6',
+                          'sum with 10'])
+        self.assertEqual(results[2]["solution"],
+                         ['Store', 'Retrieve', 'Store', 'Retrieve'])
+        self.assertEqual(results[3]["solution"],
+                         ['Add digit 1', 'Add digit 1', 'sum with -1'])
+        self.assertIsNone(results[4]["solution"])
+        for result in results:
+            self.assertGreaterEqual(result["time"], 0)
+
+    def test_solve_batch(self):
+        lines = [json.dumps(i) for i in self.LEVELS]
+        self.check_results(list(solve_batch(lines, max_workers=2)))
+
+    def test_main(self):
+        stdin = io.StringIO(
+            "\n".join(json.dumps(i) for i in self.LEVELS) + "\n\n")
+        stdout = io.StringIO()
+        main(["-j", "2"], stdin=stdin, stdout=stdout)
+        results = [json.loads(i) for i in stdout.getvalue().splitlines()]
+        self.check_results(results)
+
+    def test_invalid_level(self):
+        result = solve_level_spec(3, '{"start": 1}')
+        self.assertEqual(result["index"], 3)
+        self.assertIn("error", result)
+        result = solve_level_spec(4, 'not json')
+        self.assertIn("error", result)
+
+    def test_solve_error(self):
+        # The other levels are still solved
+        level = {"name": "text", "start": 5, "target": 1, "moves": 2,
+                 "buttons": [["SumX", "a"]]}
+        lines = [json.dumps(i) for i in [level] + self.LEVELS]
+        results = sorted(solve_batch(lines, max_workers=2),
+                         key=lambda r: r["index"])
+        self.assertIn("TypeError", results[0]["error"])
+        self.assertEqual(results[0]["name"], "text")
+        for result in results[1:]:
+            result["index"] -= 1
+        self.check_results(results[1:])
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,387 @@
+"""Measure the performance of the solvers.
+
+The benchmark solves the levels of the tests and a set of generated levels
+(with 8 to 14 moves, warp portals, memory and modifier buttons) with each
+solver. Every run is done in a new process, so that its peak memory usage
+can be measured. Run `python benchmark.py run -o results.json` to write the
+results and `python benchmark.py compare old.json new.json` to compare two
+runs.
+"""
+
+# pylint: disable=C0111
+# pylint: disable=W0212
+
+import argparse
+import json
+import math
+import platform
+import random
+import resource
+import subprocess
+import sys
+import time
+import unittest
+import compiled
+import operations as op
+import solver
+import stats
+from levels import Level
+
+def canonical_levels():
+    """The levels of the tests of `solver.TestSolver`, described by
+    `Level.to_spec`.
+
+    The tests are run with a `solve` method that only records the level, so
+    the levels are not copied here.
+    """
+    specs = []
+
+    class Recorder(solver.TestSolver):
+        @staticmethod
+        def solve(start_value, target_value, num_moves, operations,
+                  warp=None):
+            specs.append(Level(start_value, target_value, num_moves,
+                               operations, warp).to_spec())
+
+    for name in unittest.TestLoader().getTestCaseNames(Recorder):
+        num_specs = len(specs)
+        try:
+            getattr(Recorder(name), name)()
+        except AssertionError:
+            # The solution is not computed
+            pass
+        if len(specs) > num_specs:
+            specs[-1]["name"] = name.rsplit("_", 1)[-1]
+    return specs
+
+
+CANONICAL_LEVELS = canonical_levels()
+
+
+def canonical_level(name):
+    """The level of `CANONICAL_LEVELS` with this name"""
+    return next(i for i in CANONICAL_LEVELS if i["name"] == name)
+
+
+def _solve_tree(root, target_value):
+    root.create_children()
+    n = solver.find_solution_node_in_tree(root, target_value)
+
+    def count():
+        num_nodes = 0
+        stack = [root]
+        while stack:
+            node = stack.pop()
+            if node.num_remaining_moves > 0:
+                num_nodes += 1
+            stack.extend(node._children)
+        return num_nodes
+    return n, count
+
+
+def _solve_lazy(root, target_value):
+    search_stats = stats.SearchStats()
+    n = solver.find_solution_node(root, target_value, stats=search_stats)
+    return n, lambda: search_stats.expanded
+
+
+def _solve_compiled(root, target_value):
+    level = compiled.CompiledLevel.from_node(root)
+    successors = level.successors
+    num_nodes = [0]
+
+    def counting_successors(*args):
+        num_nodes[0] += 1
+        return successors(*args)
+    level.successors = counting_successors
+    indices = level.find_solution_indices(
+        root.value, target_value, root.num_remaining_moves, root._memory,
+        root._parameters, root._order)
+    n = None if indices is None else solver.replay_operation_indices(
+        root, indices)
+    return n, lambda: num_nodes[0]
+
+
+# Each solver returns the solution node and a function counting the nodes
+# that were expanded (called after the time is measured)
+SOLVERS = {
+    "tree": _solve_tree,
+    "lazy": _solve_lazy,
+    "compiled": _solve_compiled,
+}
+
+
+def run_one(spec, solver_name):
+    """Solve a level with one of the `SOLVERS` in the current process.
+
+    Returns
+    -------
+    dict
+        The wall time, number of expanded nodes, nodes per second, peak
+        resident memory of the process (in KiB) and the solution.
+    """
+    level = Level.from_spec(spec)
+    root = level.create_root()
+    start = time.perf_counter()
+    n, count = SOLVERS[solver_name](root, level.target_value)
+    elapsed = time.perf_counter() - start
+    num_nodes = count()
+    return {"time": elapsed,
+            "nodes": num_nodes,
+            "nodes_per_second": num_nodes / elapsed if elapsed > 0 else None,
+            "peak_rss_kb": resource.getrusage(
+                resource.RUSAGE_SELF).ru_maxrss,
+            "solution": (None if n is None
+                         else solver.parse_operations_until_node(n))}
+
+
+def run_in_subprocess(spec, solver_name, timeout=None):
+    """Same as `run_one`, but in a new Python process.
+
+    If it takes more than `timeout` seconds the result only has
+    `"timeout": True`.
+    """
+    try:
+        process = subprocess.run(
+            [sys.executable, __file__, "run-one", json.dumps(spec),
+             solver_name],
+            capture_output=True, text=True, check=True, timeout=timeout)
+    except subprocess.TimeoutExpired:
+        return {"timeout": True}
+    return json.loads(process.stdout)
+
+
+def _random_button(rng):
+    choices = [
+        lambda: op.SumX(rng.choice([i for i in range(-9, 10) if i != 0])),
+        lambda: op.MultiplyX(rng.choice([-3, -2, 2, 3, 4, 5])),
+        lambda: op.DivideX(rng.choice([2, 3, 5])),
+        lambda: op.AddDigits(rng.randint(0, 9)),
+        lambda: op.Replace(rng.randint(1, 9), str(rng.randint(0, 9))),
+        op.Reverse, op.Mirror, op.CircularShiftRight, op.CircularShiftLeft,
+        op.ShiftLeft, op.SumDigits, op.InvertSign, op.Inv10EachDigit,
+    ]
+    return rng.choice(choices)()
+
+
+def _random_walk(level, rng):
+    """Value reached by random moves, or None if the walk got stuck"""
+    node = level.create_root()
+    while node.num_remaining_moves > 0:
+        children = list(node.iter_children())
+        if not children:
+            return None
+        node = rng.choice(children)
+    return node.value
+
+
+def generate_levels(count=8, seed=0, min_moves=8, max_moves=14,
+                    max_tree_size=10**6):
+    """Generate random solvable levels.
+
+    Each level has 2 or 3 buttons, plus the memory buttons, a modifier
+    button and warp portals, each with some probability. The target is
+    reached from the start with a random sequence of moves, and the number
+    of moves is reduced until the tree has at most about `max_tree_size`
+    nodes.
+
+    Returns
+    -------
+    list[Level]
+    """
+    rng = random.Random(seed)
+    levels = []
+    while len(levels) < count:
+        operations = [_random_button(rng) for _ in range(rng.randint(2, 3))]
+        if rng.random() < 0.4:
+            operations.append(op.ModifyButtons_AddValue(
+                operations, rng.randint(1, 3)))
+        if rng.random() < 0.4:
+            operations.extend([op.StorageAction(), op.RetrieveAction()])
+        warp = None
+        if rng.random() < 0.4:
+            warp = op.WarpAction(rng.randint(3, 4), rng.randint(0, 1))
+
+        branching = len(operations)
+        num_moves = min(rng.randint(min_moves, max_moves),
+                        int(math.log(max_tree_size) / math.log(branching)))
+        if num_moves < min_moves:
+            continue
+        level = Level(rng.randint(1, 99), None, num_moves, operations, warp,
+                      f"generated-{len(levels)}")
+        level.target_value = _random_walk(level, rng)
+        if level.target_value is not None:
+            levels.append(level)
+    return levels
+
+
+def run_benchmark(specs, solver_names=tuple(SOLVERS), timeout=None,
+                  output=None):
+    """Run every solver on every level (each in a new process).
+
+    Returns
+    -------
+    dict
+        Description of the machine and the list of results, one for each
+        level and solver.
+    """
+    results = []
+    for spec in specs:
+        for solver_name in solver_names:
+            result = {"level": spec.get("name"), "solver": solver_name,
+                      "moves": spec["moves"]}
+            result.update(run_in_subprocess(spec, solver_name, timeout))
+            results.append(result)
+            if output is not None:
+                output.write(f"{result['level']:>14} {solver_name:>9} "
+                             f"{_format_result(result)}\n")
+                output.flush()
+    return {"python": platform.python_version(),
+            "machine": platform.machine(),
+            "timestamp": time.time(),
+            "results": results}
+
+
+def _format_result(result):
+    if result.get("timeout"):
+        return "timeout"
+    return (f"{result['time']:9.4f} s {result['nodes']:>10} nodes "
+            f"{result['nodes_per_second'] or 0:>12.0f} nodes/s "
+            f"{result['peak_rss_kb']:>8} KiB")
+
+
+def compare(old, new, threshold=0.1):
+    """Compare the times of two runs of `run_benchmark`.
+
+    Returns
+    -------
+    list[tuple]
+        For each level and solver in both runs, the tuple `(level, solver,
+        old_time, new_time, ratio, regression)`, where `regression` is True
+        if the new time is more than `threshold` (relative) slower or if
+        the new run timed out.
+    """
+    old_results = {(r["level"], r["solver"]): r for r in old["results"]}
+    out = []
+    for result in new["results"]:
+        key = (result["level"], result["solver"])
+        if key not in old_results:
+            continue
+        old_time = old_results[key].get("time")
+        new_time = result.get("time")
+        if new_time is None:
+            out.append(key + (old_time, None, None, old_time is not None))
+        elif old_time is None:
+            out.append(key + (None, new_time, None, False))
+        else:
+            ratio = new_time / old_time if old_time > 0 else math.inf
+            out.append(key + (old_time, new_time, ratio,
+                              ratio > 1 + threshold))
+    return out
+
+
+def main(argv=None, stdout=None):
+    stdout = sys.stdout if stdout is None else stdout
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    run = commands.add_parser("run", help="Run the benchmark")
+    run.add_argument("-o", "--output", default="benchmark.json",
+                     help="JSON file for the results")
+    run.add_argument("-s", "--solvers", default=",".join(SOLVERS),
+                     help="Comma separated solvers to run")
+    run.add_argument("-n", "--generated", type=int, default=8,
+                     help="Number of generated levels")
+    run.add_argument("--seed", type=int, default=0,
+                     help="Seed used to generate the levels")
+    run.add_argument("--timeout", type=float, default=None,
+                     help="Maximum time (in seconds) to solve each level")
+
+    cmp = commands.add_parser("compare", help="Compare two runs")
+    cmp.add_argument("old")
+    cmp.add_argument("new")
+    cmp.add_argument("--threshold", type=float, default=0.1,
+                     help="Relative slowdown reported as a regression")
+
+    one = commands.add_parser("run-one", help=argparse.SUPPRESS)
+    one.add_argument("spec")
+    one.add_argument("solver", choices=SOLVERS)
+
+    args = parser.parse_args(argv)
+    if args.command == "run-one":
+        stdout.write(json.dumps(run_one(json.loads(args.spec), args.solver)))
+        return 0
+
+    if args.command == "compare":
+        with open(args.old, encoding="utf-8") as f:
+            old = json.load(f)
+        with open(args.new, encoding="utf-8") as f:
+            new = json.load(f)
+        rows = compare(old, new, args.threshold)
+        for level, solver_name, old_time, new_time, ratio, regression in rows:
+            ratio = "-" if ratio is None else f"{ratio:.2f}x"
+            stdout.write(f"{level:>14} {solver_name:>9} {old_time} -> "
+                         f"{new_time} {ratio}"
+                         f"{'  REGRESSION' if regression else ''}\n")
+        return 1 if any(row[-1] for row in rows) else 0
+
+    specs = CANONICAL_LEVELS + [
+        i.to_spec() for i in generate_levels(args.generated, args.seed)]
+    results = run_benchmark(specs, args.solvers.split(","), args.timeout,
+                            stdout)
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(results, f, indent=1)
+    return 0
+
+
+# xxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxx
+
+class TestBenchmark(unittest.TestCase):
+    def test_generate_levels(self):
+        levels = generate_levels(4, seed=3, max_tree_size=10**4)
+        self.assertEqual([i.to_spec() for i in levels],
+                         [i.to_spec() for i in generate_levels(
+                             4, seed=3, max_tree_size=10**4)])
+        for level in levels:
+            self.assertTrue(8 <= level.num_moves <= 14)
+            n = solver.find_solution_node(level.create_root(),
+                                          level.target_value)
+            self.assertIsNotNone(n)
+
+    def test_canonical_levels(self):
+        self.assertEqual([i["name"] for i in CANONICAL_LEVELS],
+                         ["zero", "127", "139", "142", "149", "first", "159",
+                          "180"])
+        self.assertEqual(canonical_level("139")["buttons"],
+                         [["MultiplyX", 3], ["SumX", 4], ["SumX", 8],
+                          ["ModifyButtons_AddValue", 2]])
+        self.assertEqual(canonical_level("180")["warp"], [2, 0])
+
+    def test_run_one(self):
+        for solver_name in SOLVERS:
+            result = run_one(canonical_level("127"), solver_name)
+            self.assertEqual(result["solution"],
+                             ['sum with 8', 'multiply by 3', 'reverse',
+                              'sum with 8', 'mirror', 'sum with 2',
+                              'sum with 8', 'sum with 8'])
+            self.assertGreater(result["nodes"], 0)
+            self.assertGreater(result["peak_rss_kb"], 0)
+
+    def test_subprocess(self):
+        result = run_in_subprocess(canonical_level("180"), "lazy")
+        self.assertEqual(result["solution"],
+                         ['Add digit 1', 'Add digit 1', 'sum with -1'])
+
+    def test_compare(self):
+        old = {"results": [{"level": "a", "solver": "lazy", "time": 1.0},
+                           {"level": "b", "solver": "lazy", "time": 1.0}]}
+        new = {"results": [{"level": "a", "solver": "lazy", "time": 1.05},
+                           {"level": "b", "solver": "lazy", "time": 2.0},
+                           {"level": "c", "solver": "lazy", "time": 2.0}]}
+        self.assertEqual(compare(old, new),
+                         [("a", "lazy", 1.0, 1.05, 1.05, False),
+                          ("b", "lazy", 1.0, 2.0, 2.0, True)])
+
+
+if __name__ == '__main__':
+    sys.exit(main())
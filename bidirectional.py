@@ -0,0 +1,138 @@
+"""Meet-in-the-middle solver for levels whose buttons have preimages"""
+
+# pylint: disable=C0111
+# pylint: disable=W0212
+
+import unittest
+import operations as op
+import solver
+
+
+def _is_invertible(root):
+    """Return True if every button of `root` can enumerate its preimages"""
+    if root._warp is not None:
+        return False
+    return all(i.has_preimages for i in root._available_ops)
+
+
+def _forward_layer(root, num_moves):
+    """Values reachable from `root` with exactly `num_moves` moves.
+
+    Returns a list of dictionaries (one per move) mapping each value to the
+    value in the previous layer and the index of the operation used to reach
+    it. Values are inserted in the order the depth first search of
+    `solver.find_solution_node` would first reach them.
+    """
+    layers = [{root.value: (None, None)}]
+    for _ in range(num_moves):
+        layer = {}
+        for value in layers[-1]:
+            for i, operation in enumerate(root._available_ops):
+                try:
+                    new_value = operation.apply(value)
+                except ValueError:
+                    continue
+                if new_value not in layer:
+                    layer[new_value] = (value, i)
+        layers.append(layer)
+    return layers
+
+
+def _backward_layer(operations, target_value, num_moves, max_digits):
+    """Values that reach `target_value` with exactly `num_moves` moves"""
+    layer = {target_value}
+    for _ in range(num_moves):
+        layer = {x for value in layer for operation in operations
+                 for x in operation.preimages(value, max_digits)}
+    return layer
+
+
+def find_solution_node_bidirectional(root, target_value, max_digits=6):
+    """Find a solution searching from both `root` and `target_value`.
+
+    The values reachable from `root` in the first half of the moves are
+    joined with the values that reach `target_value` in the second half,
+    computed from the preimages of each button. This needs about
+    2*b^(n/2) operations instead of b^n. If some button has no preimage
+    generator (or the level has warp portals) this falls back to
+    `solver.find_solution_node`.
+
+    Parameters
+    ----------
+    root : Node
+        The root node. Its tree does not need to be created.
+    target_value : int
+        The value we want to reach.
+    max_digits : int
+        Maximum number of digits of the values in the backward search.
+        Solutions going through larger values (in the second half of the
+        moves) are not found by the backward search.
+
+    Returns
+    -------
+    Node | None
+        The solution node, or None if no solution was found. When the
+        backward search is not limited by `max_digits` this is the same
+        solution returned by `solver.find_solution_node`.
+    """
+    if not _is_invertible(root):
+        return solver.find_solution_node(root, target_value)
+
+    num_backward = root.num_remaining_moves // 2
+    num_forward = root.num_remaining_moves - num_backward
+    try:
+        backward = _backward_layer(root._available_ops, target_value,
+                                   num_backward, max_digits)
+    except NotImplementedError:
+        return solver.find_solution_node(root, target_value)
+    layers = _forward_layer(root, num_forward)
+
+    # The first value in the last forward layer that is also in the backward
+    # layer is reached by the smallest prefix of any solution
+    for value in layers[-1]:
+        if value in backward:
+            break
+    else:
+        return None
+
+    indices = []
+    for layer in reversed(layers[1:]):
+        value, i = layer[value]
+        indices.append(i)
+    middle = solver.replay_operation_indices(root, reversed(indices))
+    return solver.find_solution_node(middle, target_value)
+
+
+# xxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxx
+
+class TestBidirectionalSolver(solver.TestSolver):
+    @staticmethod
+    def solve(start_value, target_value, num_moves, operations, warp=None):
+        root = solver.Node(value=start_value, current_op=None,
+                           available_ops=operations,
+                           num_remaining_moves=num_moves, warp=warp)
+        n = find_solution_node_bidirectional(root, target_value)
+        return solver.parse_operations_until_node(n)
+
+    def test_same_solution_as_forward_search(self):
+        operations = [op.SumX(2), op.MultiplyX(3), op.Reverse(),
+                      op.ShiftLeft(), op.InvertSign()]
+        for target_value in (17, 3, 126, -135, -153, 42):
+            root = solver.Node(value=7, current_op=None,
+                               available_ops=operations,
+                               num_remaining_moves=5)
+            self.assertEqual(
+                solver.parse_operations_until_node(
+                    find_solution_node_bidirectional(root, target_value)),
+                solver.parse_operations_until_node(
+                    solver.find_solution_node(root, target_value)))
+
+    def test_unsolvable(self):
+        root = solver.Node(value=1, current_op=None,
+                           available_ops=[op.MultiplyX(2)],
+                           num_remaining_moves=4)
+        self.assertIsNone(find_solution_node_bidirectional(root, 15))
+
+
+if __name__ == '__main__':
+    unittest.main()
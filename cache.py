@@ -0,0 +1,287 @@
+"""Persistent cache of solutions stored in a SQLite database"""
+
+# pylint: disable=C0111
+
+import collections
+import json
+import os
+import sqlite3
+import tempfile
+import time
+import unittest
+import operations as op
+import solver
+from levels import Level
+
+DEFAULT_PATH = ".solver_cache.sqlite"
+
+
+def level_key(level):
+    """Return a canonical string describing `level`.
+
+    The buttons are sorted, so levels with the same buttons in a different
+    order have the same key. The solution stored for one of them is a valid
+    solution for the others (although not necessarily the first one the
+    solver would find).
+    """
+    buttons = sorted(json.dumps(i.spec()) for i in level.operations)
+    warp = None if level.warp is None else level.warp.spec()[1:]
+    return json.dumps([level.start_value, level.target_value,
+                       level.num_moves, buttons, warp])
+
+
+class SolutionCache:
+    """Cache mapping levels to their solutions.
+
+    Unsolvable levels are also stored. When there are more than
+    `max_entries` levels, the least recently used ones are removed.
+
+    The most recently used levels are also kept in memory, so that a hit does
+    not need to query the database. Changes done to the database by other
+    processes are not seen for those levels, and the number of levels
+    compared with `max_entries` is only counted when the cache is opened.
+
+    Parameters
+    ----------
+    path : str
+        The SQLite database file. Use ":memory:" for a cache that is not
+        persisted.
+    max_entries : int
+        Maximum number of levels in the cache.
+    max_memory_entries : int
+        Maximum number of levels also kept in memory.
+    """
+    # Number of hits after which the use time of the levels is written
+    FLUSH_INTERVAL = 256
+
+    def __init__(self, path=DEFAULT_PATH, max_entries=100000,
+                 max_memory_entries=1024):
+        self._connection = sqlite3.connect(path, timeout=30)
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS solutions ("
+            "key TEXT PRIMARY KEY, solution TEXT, last_used REAL)")
+        self._connection.execute(
+            "CREATE INDEX IF NOT EXISTS solutions_last_used "
+            "ON solutions (last_used)")
+        self._connection.commit()
+        self.max_entries = max_entries
+        self.max_memory_entries = max_memory_entries
+        self._recent = collections.OrderedDict()
+        self._used = {}
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        # Kept up to date by `put` and `invalidate`, so that inserting a
+        # level does not need to count the rows
+        self._num_entries = self._connection.execute(
+            "SELECT COUNT(*) FROM solutions").fetchone()[0]
+
+    def __len__(self):
+        return self._num_entries
+
+    def close(self):
+        self._flush()
+        self._connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def get(self, level):
+        """Return a tuple `(found, solution)`.
+
+        `found` is False if the level is not in the cache. Otherwise
+        `solution` is the list of button names, or None if the level has no
+        solution.
+        """
+        key = level_key(level)
+        if key in self._recent:
+            self._recent.move_to_end(key)
+            solution = self._recent[key]
+        else:
+            row = self._connection.execute(
+                "SELECT solution FROM solutions WHERE key = ?",
+                (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return False, None
+            solution = json.loads(row[0])
+            self._remember(key, solution)
+
+        self.hits += 1
+        self._used[key] = time.time()
+        if len(self._used) >= self.FLUSH_INTERVAL:
+            self._flush()
+        # A copy, so the caller can't change the solution in memory
+        return True, None if solution is None else list(solution)
+
+    def _remember(self, key, solution):
+        self._recent[key] = solution
+        self._recent.move_to_end(key)
+        if len(self._recent) > self.max_memory_entries:
+            self._recent.popitem(last=False)
+
+    def _flush(self):
+        """Write the use time of the levels found since the last flush"""
+        if self._used:
+            self._connection.executemany(
+                "UPDATE solutions SET last_used = ? WHERE key = ?",
+                [(t, key) for key, t in self._used.items()])
+            self._connection.commit()
+            self._used = {}
+
+    def put(self, level, solution):
+        """Store the solution (None if there is no solution) of a level"""
+        self._flush()
+        key = level_key(level)
+        exists = self._connection.execute(
+            "SELECT 1 FROM solutions WHERE key = ?", (key,)).fetchone()
+        self._connection.execute(
+            "INSERT OR REPLACE INTO solutions VALUES (?, ?, ?)",
+            (key, json.dumps(solution), time.time()))
+        if exists is None:
+            self._num_entries += 1
+        self._remember(key, None if solution is None else list(solution))
+        num_extra = self._num_entries - self.max_entries
+        if num_extra > 0:
+            evicted = self._connection.execute(
+                "SELECT key FROM solutions ORDER BY last_used, rowid "
+                "LIMIT ?", (num_extra,)).fetchall()
+            self._connection.executemany(
+                "DELETE FROM solutions WHERE key = ?", evicted)
+            for (evicted_key,) in evicted:
+                self._recent.pop(evicted_key, None)
+            self._num_entries -= len(evicted)
+            self.evictions += len(evicted)
+        self._connection.commit()
+
+    def invalidate(self, level=None):
+        """Remove `level` from the cache (or every level if it is None)"""
+        if level is None:
+            self._connection.execute("DELETE FROM solutions")
+            self._num_entries = 0
+            self._recent.clear()
+            self._used = {}
+        else:
+            key = level_key(level)
+            self._num_entries -= self._connection.execute(
+                "DELETE FROM solutions WHERE key = ?", (key,)).rowcount
+            self._recent.pop(key, None)
+            self._used.pop(key, None)
+        self._connection.commit()
+
+
+def solve_cached(level, cache=None, refresh=False):
+    """Solve `level` using the solutions in `cache` when possible.
+
+    Parameters
+    ----------
+    level : levels.Level
+        The level to solve.
+    cache : SolutionCache, optional
+        The cache. If it is None the level is always solved.
+    refresh : bool
+        If True, the level is solved even if it is in the cache and the
+        cached solution is replaced.
+
+    Returns
+    -------
+    list[str] | None
+        The button names of the solution, or None if there is no solution.
+    """
+    if cache is not None and not refresh:
+        found, solution = cache.get(level)
+        if found:
+            return solution
+
+    n = solver.find_solution_node(level.create_root(), level.target_value)
+    solution = None if n is None else solver.parse_operations_until_node(n)
+    if cache is not None:
+        cache.put(level, solution)
+    return solution
+
+
+# xxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxx
+
+class TestSolutionCache(unittest.TestCase):
+    def setUp(self):
+        self.level = Level(21, 12, 3, [op.SumX(-7), op.MultiplyX(5),
+                                       op.Inv10EachDigit()])
+        self.solution = ['multiply by 5', 'sum with -7', 'Inv10']
+
+    def test_hit_and_miss(self):
+        with SolutionCache(":memory:") as cache:
+            self.assertEqual(solve_cached(self.level, cache), self.solution)
+            self.assertEqual((cache.hits, cache.misses), (0, 1))
+            self.assertEqual(solve_cached(self.level, cache), self.solution)
+            self.assertEqual((cache.hits, cache.misses), (1, 1))
+
+            # Changing a returned solution does not change the cache
+            cache.get(self.level)[1].append("reverse")
+            self.assertEqual(cache.get(self.level), (True, self.solution))
+
+            # The order of the buttons is not part of the key
+            level = Level(21, 12, 3, list(reversed(self.level.operations)))
+            self.assertEqual(cache.get(level), (True, self.solution))
+
+            # But their values are
+            level = Level(21, 12, 3, [op.SumX(-6), op.MultiplyX(5),
+                                      op.Inv10EachDigit()])
+            self.assertEqual(cache.get(level), (False, None))
+
+    def test_unsolvable(self):
+        level = Level(1, 15, 4, [op.MultiplyX(2)])
+        with SolutionCache(":memory:") as cache:
+            self.assertIsNone(solve_cached(level, cache))
+            self.assertEqual(cache.get(level), (True, None))
+
+    def test_eviction(self):
+        with SolutionCache(":memory:", max_entries=2) as cache:
+            for target_value in range(3):
+                cache.put(Level(1, target_value, 1, [op.SumX(1)]), None)
+            self.assertEqual(len(cache), 2)
+            self.assertEqual(cache.evictions, 1)
+            self.assertEqual(
+                cache.get(Level(1, 0, 1, [op.SumX(1)])), (False, None))
+
+            # Using a level makes it the most recently used one
+            self.assertEqual(
+                cache.get(Level(1, 1, 1, [op.SumX(1)])), (True, None))
+            cache._flush()  # pylint: disable=W0212
+            cache.put(Level(1, 3, 1, [op.SumX(1)]), None)
+            self.assertEqual(
+                cache.get(Level(1, 1, 1, [op.SumX(1)])), (True, None))
+            self.assertEqual(
+                cache.get(Level(1, 2, 1, [op.SumX(1)])), (False, None))
+
+    def test_invalidate_and_refresh(self):
+        with SolutionCache(":memory:") as cache:
+            cache.put(self.level, ["wrong"])
+            self.assertEqual(solve_cached(self.level, cache), ["wrong"])
+            self.assertEqual(solve_cached(self.level, cache, refresh=True),
+                             self.solution)
+            cache.invalidate(self.level)
+            self.assertEqual(cache.get(self.level), (False, None))
+            cache.put(self.level, self.solution)
+            # Replacing a solution does not add a level
+            cache.put(self.level, self.solution)
+            self.assertEqual(len(cache), 1)
+            cache.invalidate(Level(1, 2, 3, [op.SumX(1)]))
+            self.assertEqual(len(cache), 1)
+            cache.invalidate()
+            self.assertEqual(len(cache), 0)
+
+    def test_persistent(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "cache.sqlite")
+            with SolutionCache(path) as cache:
+                solve_cached(self.level, cache)
+            with SolutionCache(path) as cache:
+                self.assertEqual(len(cache), 1)
+                self.assertEqual(cache.get(self.level), (True, self.solution))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,325 @@
+"""Compile the buttons of a level into a single successor function.
+
+`solver.Node` applies each button through `Operation.apply`, checks the
+special buttons with `isinstance` and signals invalid and useless moves with
+a `ValueError`. A `CompiledLevel` generates (and compiles with `exec`) the
+source of a function that applies every button of a level inline, with the
+values of the buttons as constants when they can't be modified, and filters
+invalid moves with conditions instead of exceptions. The `op.Operation`
+objects are still the description of the level.
+"""
+
+# pylint: disable=C0111
+# pylint: disable=W0212
+
+import unittest
+import digits as dg
+import operations as op
+import solver
+
+# Value of the button (or call of its kernel) for the buttons that never
+# raise, given the expressions of the current value and the button value
+_EXPRESSIONS = {
+    op.SumX: "{x} + {p}",
+    op.MultiplyX: "{x} * {p}",
+    op.Reverse: "reverse({x})",
+    op.CircularShiftRight: "circular_shift_right({x})",
+    op.CircularShiftLeft: "circular_shift_left({x})",
+    op.SumDigits: "sum_digits({x})",
+    op.InvertSign: "-{x}",
+    op.Inv10EachDigit: "inv10_each_digit({x})",
+}
+
+# Condition for the buttons that are only valid for some values
+_GUARDED_EXPRESSIONS = {
+    op.DivideX: ("{p} != 0 and {x} % {p} == 0", "{x} // {p}"),
+    op.Mirror: ("-1000 < {x} < 1000", "mirror({x})"),
+    op.ShiftLeft: ("{x} >= 10 or {x} <= -10", "shift_left({x})"),
+    op.AddDigits: ("{p} >= 0", "add_digits({x}, {p})"),
+}
+
+_NAMESPACE = {
+    "reverse": dg.reverse,
+    "mirror": dg.mirror,
+    "shift_left": dg.shift_left,
+    "circular_shift_right": dg.circular_shift_right,
+    "circular_shift_left": dg.circular_shift_left,
+    "sum_digits": dg.sum_digits,
+    "inv10_each_digit": dg.inv10_each_digit,
+    "add_digits": dg.add_digits,
+    "warp": dg.warp,
+}
+
+
+class CompiledLevel:
+    """The buttons (and warp) of a level compiled into one function.
+
+    `successors(value, memory, parameters)` returns a list of tuples
+    `(new_value, op_index)` with the valid moves from a state, in the order
+    of the buttons, as `solver.Node.iter_children` would create them. The
+    memory and the parameters (see `op.parameters_of`) only change with the
+    store and modifier buttons, whose indices are in `store_indices` and
+    `modifier_indices` (`expand` applies them).
+
+    Parameters
+    ----------
+    operations : list[op.Operation]
+        The buttons of the level.
+    warp : op.WarpAction
+        The warp action of the level, if any.
+    """
+    def __init__(self, operations, warp=None):
+        self.operations = operations
+        self.warp = warp
+        self.store_indices = frozenset(
+            i for i, o in enumerate(operations)
+            if isinstance(o, op.StorageAction))
+        self.modifier_indices = frozenset(
+            i for i, o in enumerate(operations)
+            if isinstance(o, op.ModifyButtons_AddValue))
+        self.has_state = bool(self.store_indices or self.modifier_indices)
+
+        self.source = self._generate_source()
+        namespace = dict(_NAMESPACE, operations=operations)
+        code = compile(self.source, "<compiled level>", "exec")
+        exec(code, namespace)  # pylint: disable=W0122
+        self.successors = namespace["successors"]
+
+    @staticmethod
+    def from_node(node):
+        """Compile the operations and warp of `node`"""
+        return CompiledLevel(node._available_ops, node._warp)
+
+    def _generate_source(self):
+        lines = ["def successors(value, memory, parameters):",
+                 "    out = []"]
+        for i, operation in enumerate(self.operations):
+            lines.append(f"    # {operation.name}")
+            lines.extend("    " + line
+                         for line in self._generate_button(i, operation))
+        lines.append("    return out")
+        return "\n".join(lines) + "\n"
+
+    def _parameter(self, i, operation):
+        """Expression with the value of the button `i`"""
+        if self.modifier_indices:
+            return f"parameters[{i}]"
+        return repr(operation.parameter)
+
+    def _generate_append(self, i):
+        """Lines appending the move to `out` (after applying the warp)"""
+        if self.warp is None or self.warp._enter_idx == 0:
+            return [f"out.append((x, {i}))"]
+        enter_idx = self.warp._enter_idx
+        exit_idx = self.warp._exit_idx
+        # A negative number can only be warped if it fits before the portal
+        return [f"if x > {-10**(enter_idx - 1)}:",
+                f"    out.append((warp(x, {enter_idx}, {exit_idx})"
+                f" if x >= {10**enter_idx} else x, {i}))"]
+
+    def _generate_button(self, i, operation):
+        """Lines of `successors` for the button `i`"""
+        append = self._generate_append(i)
+        kind = type(operation)
+        p = self._parameter(i, operation)
+
+        if kind is op.ModifyButtons_AddValue:
+            return ["x = value"] + append
+
+        if kind is op.StorageAction:
+            return (["if value != memory:", "    x = value"]
+                    + ["    " + line for line in append])
+
+        if kind is op.RetrieveAction:
+            return (["if memory is not None and memory >= 0:",
+                     "    x = add_digits(value, memory)"]
+                    + ["    " + line for line in append])
+
+        if kind in _EXPRESSIONS:
+            condition = "True"
+            expression = _EXPRESSIONS[kind]
+        elif kind in _GUARDED_EXPRESSIONS:
+            condition, expression = _GUARDED_EXPRESSIONS[kind]
+            condition = condition.format(x="value", p=p)
+            if kind is op.AddDigits and not self.modifier_indices:
+                # The condition only depends on the constant button value
+                if operation.parameter < 0:
+                    return []
+                condition = "True"
+        else:
+            # Other buttons are applied through the operation object
+            return (["try:",
+                     f"    x = operations[{i}].apply_with(value, {p})",
+                     "except ValueError:",
+                     "    pass",
+                     "else:"]
+                    + ["    " + line for line in append])
+
+        lines = [f"x = {expression.format(x='value', p=p)}",
+                 "if x != value:"] + ["    " + line for line in append]
+        if condition != "True":
+            lines = [f"if {condition}:"] + ["    " + line for line in lines]
+        return lines
+
+    def expand(self, value, memory, parameters):
+        """Children of a state.
+
+        Returns
+        -------
+        list[tuple]
+            For each valid move, the tuple `(value, memory, parameters,
+            op_index, num_used_moves)` of the child.
+        """
+        children = []
+        for new_value, i in self.successors(value, memory, parameters):
+            if i in self.store_indices:
+                children.append((new_value, value, parameters, i, 0))
+            elif i in self.modifier_indices:
+                children.append((new_value, memory,
+                                 self.operations[i].modify(parameters,
+                                                           self.operations),
+                                 i, 1))
+            else:
+                children.append((new_value, memory, parameters, i, 1))
+        return children
+
+    def _ordered(self, children, order):
+        """`children` (see `expand`) in the order of the buttons (see
+        `solver.Node.order_after_operation`)"""
+        if order is None:
+            return children
+        position = {j: k for k, j in enumerate(order)}
+        return sorted(children, key=lambda child: position[child[3]])
+
+    def find_solution_indices(self, value, target_value, num_moves,
+                              memory=None, parameters=None, order=None):
+        """Operation indices of the first solution, or None.
+
+        The search has the same order as `solver.find_solution_node`,
+        starting with the order of the buttons `order`.
+        """
+        if parameters is None:
+            parameters = op.parameters_of(self.operations)
+        if not self.has_state:
+            return self._find_stateless(value, target_value, num_moves,
+                                        memory, parameters)
+
+        if num_moves == 0:
+            return [] if value == target_value else None
+        path = []
+        stack = [(iter(self._ordered(self.expand(value, memory, parameters),
+                                     order)), num_moves, order)]
+        while stack:
+            children, remaining, order = stack[-1]
+            for value, memory, parameters, i, used in children:
+                if remaining == used:
+                    if value == target_value:
+                        return path + [i]
+                    continue
+                path.append(i)
+                child_order = solver.Node.order_after_operation(
+                    order, self.operations, i)
+                stack.append((iter(self._ordered(
+                    self.expand(value, memory, parameters), child_order)),
+                              remaining - used, child_order))
+                break
+            else:
+                stack.pop()
+                if path:
+                    path.pop()
+        return None
+
+    def _find_stateless(self, value, target_value, num_moves, memory,
+                        parameters):
+        """`find_solution_indices` when the memory and parameters can't
+        change, so the state is only the value"""
+        if num_moves == 0:
+            return [] if value == target_value else None
+        successors = self.successors
+        path = []
+        stack = [iter(successors(value, memory, parameters))]
+        while stack:
+            for value, i in stack[-1]:
+                if len(stack) == num_moves:
+                    if value == target_value:
+                        return path + [i]
+                    continue
+                path.append(i)
+                stack.append(iter(successors(value, memory, parameters)))
+                break
+            else:
+                stack.pop()
+                if path:
+                    path.pop()
+        return None
+
+
+def find_solution_node_compiled(root, target_value):
+    """Same as `solver.find_solution_node`, but using a `CompiledLevel`"""
+    indices = CompiledLevel.from_node(root).find_solution_indices(
+        root.value, target_value, root.num_remaining_moves, root._memory,
+        root._parameters, root._order)
+    if indices is None:
+        return None
+    return solver.replay_operation_indices(root, indices)
+
+
+# xxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxx
+
+class TestCompiledSolver(solver.TestSolver):
+    @staticmethod
+    def solve(start_value, target_value, num_moves, operations, warp=None):
+        root = solver.Node(value=start_value, current_op=None,
+                           available_ops=operations,
+                           num_remaining_moves=num_moves, warp=warp)
+        n = find_solution_node_compiled(root, target_value)
+        return solver.parse_operations_until_node(n)
+
+    def check_same_children(self, operations, warp=None, memory=None):
+        compiled = CompiledLevel(operations, warp)
+        parameters = op.parameters_of(operations)
+        for value in range(-1200, 1200):
+            node = solver.Node(value, None, operations, 1, memory=memory,
+                               warp=warp)
+            expected = [(c.value, c._memory, c._parameters, c._op_index,
+                         1 - c.num_remaining_moves)
+                        for c in node.iter_children()]
+            self.assertEqual(compiled.expand(value, memory, parameters),
+                             expected, value)
+
+    def test_same_children(self):
+        operations = [op.SumX(3), op.MultiplyX(-2), op.DivideX(3),
+                      op.Reverse(), op.Mirror(), op.CircularShiftRight(),
+                      op.CircularShiftLeft(), op.ShiftLeft(), op.SumDigits(),
+                      op.InvertSign(), op.AddDigits(1), op.AddDigits(-1),
+                      op.Inv10EachDigit(), op.Replace(1, "00"),
+                      op.StorageAction(), op.RetrieveAction()]
+        self.check_same_children(operations)
+        self.check_same_children(operations, memory=12)
+        self.check_same_children(operations, op.WarpAction(3, 0), memory=-7)
+        operations.append(op.ModifyButtons_AddValue(operations, 2))
+        self.check_same_children(operations, op.WarpAction(2, 1), memory=5)
+
+    def test_source(self):
+        compiled = CompiledLevel([op.SumX(3), op.DivideX(2), op.AddDigits(1)])
+        self.assertNotIn("try", compiled.source)
+        self.assertNotIn("parameters[", compiled.source)
+        self.assertEqual(compiled.successors(4, None, None),
+                         [(7, 0), (2, 1), (41, 2)])
+        self.assertEqual(compiled.successors(-3, None, None),
+                         [(0, 0), (-31, 2)])
+
+    def test_same_solutions(self):
+        operations = [op.SumX(2), op.MultiplyX(3), op.Reverse(),
+                      op.StorageAction(), op.RetrieveAction()]
+        root = solver.Node(value=1, current_op=None,
+                           available_ops=operations, num_remaining_moves=4)
+        for target_value in range(150):
+            n = solver.find_solution_node(root, target_value)
+            m = find_solution_node_compiled(root, target_value)
+            self.assertEqual(solver.parse_operations_until_node(n),
+                             solver.parse_operations_until_node(m))
+
+
+if __name__ == '__main__':
+    unittest.main()
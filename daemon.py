@@ -0,0 +1,424 @@
+"""Solver service that keeps its caches warm between requests.
+
+The daemon listens on a Unix domain socket (or a localhost TCP port) and
+reads one JSON level per line, as described by `levels.Level.to_spec`,
+answering each one with a JSON line like the results of `batch.py`. Each
+connection is handled by an asyncio task and the searches run in a pool of
+worker processes, so many clients can be served concurrently.
+
+Between requests the daemon keeps the results of the levels already solved,
+and each worker keeps the `compiled.CompiledLevel` of the button sets it has
+seen and, when deduplicating, the states already proven to be dead for each
+button set and target. `Client` is a small blocking client for tools that
+talk to the daemon. Run `python daemon.py --help` for the options.
+"""
+
+# pylint: disable=C0111
+
+import argparse
+import asyncio
+import collections
+import concurrent.futures
+import json
+import os
+import signal
+import socket
+import tempfile
+import threading
+import time
+import unittest
+from unittest import mock
+import solver
+from compiled import CompiledLevel
+from levels import Level, buttons_key
+
+# Maximum number of entries of each cache of the workers
+MAX_WORKER_ENTRIES = 64
+
+# Maximum number of dead states kept for a level between requests
+MAX_DEAD_STATES = 2**20
+
+# Caches of each worker process
+_compiled_levels = collections.OrderedDict()
+_dead_states = collections.OrderedDict()
+
+
+def _get_cached(cache, key, create):
+    """Return `(value, warm)` with the value of `key` in the LRU `cache`,
+    calling `create()` if it is not there"""
+    if key in cache:
+        cache.move_to_end(key)
+        return cache[key], True
+    value = cache[key] = create()
+    if len(cache) > MAX_WORKER_ENTRIES:
+        cache.popitem(last=False)
+    return value, False
+
+
+def solve_spec(spec, deduplicate=False):
+    """Solve the level described by `spec` (runs in a worker process).
+
+    Without `deduplicate` the level is solved with the cached
+    `CompiledLevel` of its buttons. Otherwise `solver.iter_solution_nodes`
+    is used with the cached dead states of its buttons and target, which
+    are valid for any start value. They are forgotten when there are more
+    than `MAX_DEAD_STATES`.
+
+    Returns
+    -------
+    dict
+        The solution (list of button names, or None if there is no
+        solution), the time spent solving it and whether the caches of the
+        worker already had the buttons of the level (`warm`). If the level
+        can't be parsed, there is an `error` instead.
+    """
+    try:
+        level = Level.from_spec(spec)
+    except ValueError as e:
+        return {"error": str(e)}
+
+    start = time.perf_counter()
+    root = level.create_root()
+    key = buttons_key(level.operations, level.warp)
+    if deduplicate:
+        dead_states, warm = _get_cached(
+            _dead_states, (key, level.target_value), set)
+        n = next(solver.iter_solution_nodes(root, level.target_value,
+                                            dead_states), None)
+        if len(dead_states) > MAX_DEAD_STATES:
+            dead_states.clear()
+    else:
+        compiled, warm = _get_cached(_compiled_levels, key,
+                                     lambda: CompiledLevel.from_node(root))
+        indices = compiled.find_solution_indices(
+            root.value, level.target_value, root.num_remaining_moves)
+        n = (None if indices is None
+             else solver.replay_operation_indices(root, indices))
+    return {"solution": (None if n is None
+                         else solver.parse_operations_until_node(n)),
+            "time": time.perf_counter() - start,
+            "warm": warm}
+
+
+class SolverDaemon:
+    """The service (see `serve`).
+
+    Parameters
+    ----------
+    executor : concurrent.futures.Executor, optional
+        Where the levels are solved. Default is a process pool with
+        `max_workers` processes.
+    max_workers : int, optional
+        Number of worker processes of the default executor.
+    deduplicate : bool
+        Passed to `solve_spec`.
+    max_results : int
+        Maximum number of results kept by the daemon.
+    """
+    def __init__(self, executor=None, max_workers=None, deduplicate=False,
+                 max_results=4096):
+        if executor is None:
+            executor = concurrent.futures.ProcessPoolExecutor(max_workers)
+        self._executor = executor
+        self.deduplicate = deduplicate
+        self.max_results = max_results
+        self._results = collections.OrderedDict()
+        self.num_requests = 0
+        self.num_cached = 0
+        self.server = None
+        self._connections = set()
+
+    async def solve(self, spec):
+        """Result of the level described by `spec` (a dictionary).
+
+        The `id` and `name` of the request, if any, are copied to the result.
+        If solving the level raises an exception, the result has an `error`
+        instead of a solution.
+        """
+        self.num_requests += 1
+        result = {i: spec[i] for i in ("id", "name") if i in spec}
+        key = json.dumps({i: j for i, j in spec.items()
+                          if i not in ("id", "name")}, sort_keys=True)
+        if key in self._results:
+            self._results.move_to_end(key)
+            self.num_cached += 1
+            result.update(self._results[key], cached=True)
+            return result
+
+        loop = asyncio.get_running_loop()
+        try:
+            solved = await loop.run_in_executor(self._executor, solve_spec,
+                                                spec, self.deduplicate)
+        except Exception as e:  # pylint: disable=W0703
+            solved = {"error": f"{type(e).__name__}: {e}"}
+        if "error" not in solved:
+            self._results[key] = solved
+            if len(self._results) > self.max_results:
+                self._results.popitem(last=False)
+        result.update(solved, cached=False)
+        return result
+
+    def stats(self):
+        return {"requests": self.num_requests, "cached": self.num_cached,
+                "results": len(self._results)}
+
+    async def _handle_line(self, line):
+        try:
+            request = json.loads(line)
+            if not isinstance(request, dict):
+                raise ValueError(f"Invalid request: {request}")
+        except ValueError as e:
+            return {"error": str(e)}
+        if request.get("command") == "stats":
+            return self.stats()
+        return await self.solve(request)
+
+    async def _handle_connection(self, reader, writer):
+        task = asyncio.current_task()
+        self._connections.add(task)
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                if not line.strip():
+                    continue
+                result = await self._handle_line(line)
+                writer.write(json.dumps(result).encode() + b"\n")
+                await writer.drain()
+        except (ConnectionError, asyncio.CancelledError):
+            pass
+        finally:
+            self._connections.discard(task)
+            writer.close()
+            try:
+                await writer.wait_closed()
+            except ConnectionError:
+                pass
+
+    async def start(self, path=None, port=None):
+        """Start listening on the Unix socket `path` or, if it is None, on
+        the localhost TCP `port`"""
+        if path is not None:
+            self.server = await asyncio.start_unix_server(
+                self._handle_connection, path)
+        else:
+            self.server = await asyncio.start_server(
+                self._handle_connection, "127.0.0.1", port)
+        return self.server
+
+    async def serve(self, path=None, port=None):
+        """Start listening (see `start`) and serve until cancelled"""
+        await self.start(path, port)
+        async with self.server:
+            await self.server.serve_forever()
+
+    async def shutdown(self):
+        """Stop listening, close the connections and the worker pool"""
+        if self.server is not None:
+            self.server.close()
+            for task in list(self._connections):
+                task.cancel()
+            await asyncio.gather(*self._connections, return_exceptions=True)
+            await self.server.wait_closed()
+        self._executor.shutdown(cancel_futures=True)
+
+
+class Client:
+    """Blocking client of a `SolverDaemon`.
+
+    Parameters
+    ----------
+    path : str, optional
+        The Unix socket of the daemon.
+    port : int, optional
+        The localhost TCP port of the daemon, if `path` is None.
+    timeout : float, optional
+        Timeout (in seconds) of the socket operations.
+    """
+    def __init__(self, path=None, port=None, timeout=None):
+        if path is not None:
+            self._socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            self._socket.settimeout(timeout)
+            self._socket.connect(path)
+        else:
+            self._socket = socket.create_connection(("127.0.0.1", port),
+                                                    timeout)
+        self._file = self._socket.makefile("rwb")
+
+    def close(self):
+        self._file.close()
+        self._socket.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def request(self, request):
+        """Send a request (a dictionary) and return the response"""
+        self._file.write(json.dumps(request).encode() + b"\n")
+        self._file.flush()
+        line = self._file.readline()
+        if not line:
+            raise ConnectionError("The daemon closed the connection")
+        return json.loads(line)
+
+    def solve(self, level):
+        """Solve a `levels.Level` (or the dictionary describing it)"""
+        if isinstance(level, Level):
+            level = level.to_spec()
+        return self.request(level)
+
+    def stats(self):
+        return self.request({"command": "stats"})
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("-s", "--socket", default=None,
+                        help="Unix socket where the daemon listens")
+    parser.add_argument("-p", "--port", type=int, default=None,
+                        help="Localhost TCP port, if there is no socket")
+    parser.add_argument("-j", "--workers", type=int, default=None,
+                        help="Number of worker processes")
+    parser.add_argument("--deduplicate", action="store_true",
+                        help="Skip states already proven to be dead")
+    args = parser.parse_args(argv)
+    if args.socket is None and args.port is None:
+        parser.error("Either --socket or --port is required")
+
+    daemon = SolverDaemon(max_workers=args.workers,
+                          deduplicate=args.deduplicate)
+
+    async def run():
+        # Stop cleanly with SIGTERM too
+        asyncio.get_running_loop().add_signal_handler(
+            signal.SIGTERM, asyncio.current_task().cancel)
+        try:
+            await daemon.serve(args.socket, args.port)
+        finally:
+            await daemon.shutdown()
+
+    try:
+        asyncio.run(run())
+    except (KeyboardInterrupt, asyncio.CancelledError):
+        pass
+    finally:
+        if args.socket is not None and os.path.exists(args.socket):
+            os.remove(args.socket)
+
+
+# xxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxx
+
+class TestDaemon(unittest.TestCase):
+    LEVEL = {"name": "139", "start": 5, "target": 41, "moves": 4,
+             "buttons": [["MultiplyX", 3], ["SumX", 4], ["SumX", 8],
+                         ["ModifyButtons_AddValue", 2]]}
+    SOLUTION = ['[+]2', 'multiply by 5', 'sum with 6', 'sum with 10']
+
+    def start_daemon(self, deduplicate=False, port=None):
+        """Run a daemon with one worker process in another thread"""
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        path = None if port is not None else os.path.join(directory.name,
+                                                          "solver.sock")
+        daemon = SolverDaemon(max_workers=1, deduplicate=deduplicate)
+        loop = asyncio.new_event_loop()
+        server = loop.run_until_complete(daemon.start(path, port))
+        thread = threading.Thread(target=loop.run_forever)
+        thread.start()
+
+        def stop():
+            asyncio.run_coroutine_threadsafe(daemon.shutdown(),
+                                             loop).result()
+            loop.call_soon_threadsafe(loop.stop)
+            thread.join()
+            loop.close()
+        self.addCleanup(stop)
+        if path is None:
+            return daemon, server.sockets[0].getsockname()[1]
+        return daemon, path
+
+    def test_solve(self):
+        for deduplicate in (False, True):
+            daemon, path = self.start_daemon(deduplicate)
+            with Client(path, timeout=60) as client:
+                result = client.solve(dict(self.LEVEL, id=1))
+                self.assertEqual(result["solution"], self.SOLUTION)
+                self.assertEqual((result["id"], result["name"]), (1, "139"))
+                self.assertFalse(result["cached"])
+                self.assertFalse(result["warm"])
+
+                # Same buttons with another target
+                level = dict(self.LEVEL, target=42, name=None)
+                result = client.solve(level)
+                self.assertFalse(result["cached"])
+                self.assertEqual(result["warm"], not deduplicate)
+                # Same target with another start value
+                level = Level.from_spec(dict(self.LEVEL, start=6))
+                self.assertEqual(client.solve(level)["warm"], True)
+
+                result = client.solve(self.LEVEL)
+                self.assertTrue(result["cached"])
+                self.assertEqual(result["solution"], self.SOLUTION)
+                self.assertEqual(client.stats(), {"requests": 4, "cached": 1,
+                                                  "results": 3})
+            self.assertEqual(daemon.num_requests, 4)
+
+    def test_dead_states(self):
+        self.addCleanup(_dead_states.clear)
+        _dead_states.clear()
+        self.assertEqual(solve_spec(self.LEVEL, True)["solution"],
+                         self.SOLUTION)
+        (dead_states,) = _dead_states.values()
+        self.assertGreater(len(dead_states), 0)
+        with mock.patch(f"{__name__}.MAX_DEAD_STATES", 0):
+            self.assertEqual(solve_spec(self.LEVEL, True)["solution"],
+                             self.SOLUTION)
+        self.assertEqual(len(dead_states), 0)
+
+    def test_concurrent_clients(self):
+        _, port = self.start_daemon(port=0)
+        results = [None] * 4
+
+        def run(i):
+            with Client(port=port, timeout=60) as client:
+                results[i] = client.solve(dict(self.LEVEL, target=41 + i))
+
+        threads = [threading.Thread(target=run, args=(i,)) for i in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        for i, result in enumerate(results):
+            root = Level.from_spec(self.LEVEL).create_root()
+            n = solver.find_solution_node(root, 41 + i)
+            self.assertEqual(result["solution"], None if n is None
+                             else solver.parse_operations_until_node(n))
+
+    def test_errors(self):
+        _, path = self.start_daemon()
+        with Client(path, timeout=60) as client:
+            self.assertIn("error", client.request({"start": 1}))
+            client._file.write(b"not json\n\n[1]\n")  # pylint: disable=W0212
+            client._file.flush()  # pylint: disable=W0212
+            self.assertIn("error", json.loads(client._file.readline()))
+            self.assertIn("error", json.loads(client._file.readline()))
+            self.assertEqual(client.solve(self.LEVEL)["solution"],
+                             self.SOLUTION)
+
+        # An exception raised while solving is answered as an error
+        _, path = self.start_daemon(deduplicate=True)
+        with Client(path, timeout=60) as client:
+            result = client.solve({"id": 2, "start": 5, "target": 1,
+                                   "moves": 2, "buttons": [["SumX", "a"]]})
+            self.assertIn("TypeError", result["error"])
+            self.assertEqual(result["id"], 2)
+            self.assertEqual(client.solve(self.LEVEL)["solution"],
+                             self.SOLUTION)
+
+
+if __name__ == '__main__':
+    main()
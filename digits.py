@@ -0,0 +1,152 @@
+"""Digit kernel doing the digit buttons with integer arithmetic.
+
+The functions here give exactly the same results as the functions with the
+same name in `operations` (including the `ValueError` for useless or invalid
+moves), but avoid the `str`/`int` round trips. Numbers are processed in
+chunks of `CHUNK_DIGITS` digits using tables precomputed at import time.
+"""
+
+# pylint: disable=C0111
+
+CHUNK_DIGITS = 4
+CHUNK = 10**CHUNK_DIGITS
+
+# Number of digits of each value in [0, CHUNK)
+_NUM_DIGITS = [len(str(i)) for i in range(CHUNK)]
+
+# Digits of each value in [0, CHUNK) reversed (leading zeros are dropped)
+_REVERSED = [int(str(i)[::-1]) for i in range(CHUNK)]
+
+# Same as _REVERSED, but as if the value had exactly CHUNK_DIGITS digits
+_REVERSED_PADDED = [int(str(i).zfill(CHUNK_DIGITS)[::-1])
+                    for i in range(CHUNK)]
+
+_SUM_DIGITS = [sum(int(d) for d in str(i)) for i in range(CHUNK)]
+
+# Each digit d replaced by 10 - d (zeros are kept)
+_INV10 = [int("".join(str((10 - int(d)) % 10) for d in str(i)))
+          for i in range(CHUNK)]
+
+POWERS_OF_TEN = [10**i for i in range(32)]
+
+
+def num_digits(number):
+    """Number of digits of a non negative number"""
+    count = 0
+    while number >= CHUNK:
+        number //= CHUNK
+        count += CHUNK_DIGITS
+    return count + _NUM_DIGITS[number]
+
+
+def _power_of_ten(exponent):
+    if exponent < len(POWERS_OF_TEN):
+        return POWERS_OF_TEN[exponent]
+    return 10**exponent
+
+
+def _reverse_abs(number):
+    out = 0
+    while number >= CHUNK:
+        number, low = divmod(number, CHUNK)
+        out = out * CHUNK + _REVERSED_PADDED[low]
+    return out * POWERS_OF_TEN[_NUM_DIGITS[number]] + _REVERSED[number]
+
+
+def _sum_digits_abs(number):
+    out = 0
+    while number >= CHUNK:
+        number, low = divmod(number, CHUNK)
+        out += _SUM_DIGITS[low]
+    return out + _SUM_DIGITS[number]
+
+
+def reverse(number):
+    if number < 0:
+        return -_reverse_abs(-number)
+    return _reverse_abs(number)
+
+
+def mirror(number):
+    value = -number if number < 0 else number
+    if value > 999:
+        raise ValueError("Too large")
+    out = value * POWERS_OF_TEN[_NUM_DIGITS[value]] + _REVERSED[value]
+    return -out if number < 0 else out
+
+
+def shift_left(number):
+    value = -number if number < 0 else number
+    if value < 10:
+        raise ValueError("Can only shift numbers with at least two digits")
+    return -(value // 10) if number < 0 else value // 10
+
+
+def circular_shift_right(number):
+    value = -number if number < 0 else number
+    rest, last = divmod(value, 10)
+    out = last * _power_of_ten(num_digits(value) - 1) + rest
+    return -out if number < 0 else out
+
+
+def circular_shift_left(number):
+    value = -number if number < 0 else number
+    first, rest = divmod(value, _power_of_ten(num_digits(value) - 1))
+    out = rest * 10 + first
+    return -out if number < 0 else out
+
+
+def sum_digits(number):
+    if number < 0:
+        return -_sum_digits_abs(-number)
+    return _sum_digits_abs(number)
+
+
+def inv10_each_digit(number):
+    value = -number if number < 0 else number
+    out = 0
+    factor = 1
+    while value >= CHUNK:
+        value, low = divmod(value, CHUNK)
+        out += _INV10[low] * factor
+        factor *= CHUNK
+    out += _INV10[value] * factor
+    return -out if number < 0 else out
+
+
+def add_digits(number, digits):
+    if not isinstance(digits, int) or digits < 0:
+        # Not a sequence of digits (e.g. None or a negative value). Let the
+        # conversion produce the same result (or error) as in `operations`.
+        return int(str(number) + str(digits))
+    factor = _power_of_ten(num_digits(digits))
+    if number < 0:
+        return number * factor - digits
+    return number * factor + digits
+
+
+def replace(value, old, new):
+    # Searching for a sub-sequence of digits is done much faster by
+    # `str.replace` than by any loop over the digits, so a single round trip
+    # is kept here
+    return int(str(value).replace(str(old), str(new)))
+
+
+def warp(number, enter_idx, exit_idx=0):
+    if enter_idx == 0:
+        return number
+    if number < 0:
+        # The minus sign can't be warped
+        if num_digits(-number) + 1 <= enter_idx:
+            return number
+        raise ValueError("Can't warp a negative number")
+
+    enter_factor = _power_of_ten(enter_idx)
+    exit_factor = _power_of_ten(exit_idx)
+    while number >= enter_factor:
+        warped, non_warped = divmod(number, enter_factor)
+        out = non_warped + exit_factor * _sum_digits_abs(warped)
+        if out == number:
+            break
+        number = out
+    return number
@@ -0,0 +1,429 @@
+"""Breadth first search keeping the frontiers on disk.
+
+Each depth of the search (the states reached using a given number of moves)
+is stored in a file of fixed size binary records `(value, memory,
+parameters, parent, move)`, sorted by state and without duplicates. The
+next depth is computed streaming the records of the current one (which is
+memory mapped): the children are collected in chunks of at most
+`chunk_size` records, each chunk is sorted and written to a file, and the
+chunk files are merged (at most `fan_in` at a time) removing the duplicated
+states. The memory used is then bounded by `chunk_size` and `fan_in`,
+whatever the size of the frontiers. The solution is reconstructed following
+the parent of each record in the files of the previous depths.
+
+The moves are the same as in `solver.Node.apply_operation_and_create_child`
+(the memory, button modifiers and warp are part of the state). Since the
+store button does not use a move, storing a value (maybe several times, if
+the warp changes it) and pressing another button is considered a single
+move of the search.
+"""
+
+# pylint: disable=C0111
+# pylint: disable=W0212
+
+import heapq
+import mmap
+import os
+import shutil
+import struct
+import tempfile
+import unittest
+import operations as op
+import solver
+
+# Value of the memory and the parameters when they are None
+_NONE = -2**63
+
+
+class IncompleteSearch(Exception):
+    """Raised when no solution was found but some states were not stored
+    because their values do not fit in 64 bits"""
+
+
+class ExternalBFS:
+    """Breadth first search of a level with the frontiers on disk.
+
+    Parameters
+    ----------
+    root : solver.Node
+        The node where the search starts.
+    directory : str, optional
+        Where the files are written. Default is a temporary directory that
+        is removed by `close`.
+    chunk_size : int
+        Maximum number of records kept in memory while sorting.
+    fan_in : int
+        Maximum number of files merged at once.
+
+    Attributes
+    ----------
+    states_per_depth : list[int]
+        Number of distinct states reached with each number of moves.
+    num_overflows : int
+        Number of states not stored because a value does not fit in 64 bits.
+
+    Raises
+    ------
+    ValueError
+        If the state of `root` does not fit in 64 bits.
+    """
+    def __init__(self, root, directory=None, chunk_size=2**16, fan_in=64):
+        self.root = root
+        self._temporary = directory is None
+        self.directory = (tempfile.mkdtemp(prefix="extbfs_")
+                          if directory is None else directory)
+        self.chunk_size = chunk_size
+        self.fan_in = max(fan_in, 2)
+        self.num_overflows = 0
+        self._operations = root._available_ops
+        self._warp = root._warp
+        # The parameters are only stored if they can change
+        self._has_parameters = any(
+            isinstance(i, op.ModifyButtons_AddValue) for i in self._operations)
+        num_parameters = len(self._operations) if self._has_parameters else 0
+        # Number of fields of a state, which are followed by the parent and
+        # the move in each record
+        self._state_size = 2 + num_parameters
+        self._record = struct.Struct("<" + "q" * self._state_size + "qq")
+        self._num_chunks = 0
+
+        root_record = self._pack_state(root.value, root._memory,
+                                       root._parameters)
+        if root_record is None:
+            self.close()
+            raise ValueError("The state of the root does not fit in 64 bits")
+        self.states_per_depth = []
+        self._write_depth([root_record + (-1, -1)])
+
+    def close(self):
+        if self._temporary:
+            shutil.rmtree(self.directory, ignore_errors=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    @property
+    def num_moves(self):
+        """Number of moves of the last depth computed"""
+        return len(self.states_per_depth) - 1
+
+    def _depth_path(self, depth):
+        return os.path.join(self.directory, f"depth_{depth}.bin")
+
+    def _pack_state(self, value, memory, parameters):
+        """State as a tuple of 64 bits integers, or None if it does not fit"""
+        state = (value, _NONE if memory is None else memory)
+        if self._has_parameters:
+            state += tuple(_NONE if i is None else i for i in parameters)
+        if any(not _NONE < i < -_NONE for i in state[:1]) or \
+                any(not _NONE <= i < -_NONE for i in state[1:]):
+            return None
+        return state
+
+    def _unpack_state(self, state):
+        memory = None if state[1] == _NONE else state[1]
+        if self._has_parameters:
+            parameters = tuple(None if i == _NONE else i for i in state[2:])
+        else:
+            parameters = self.root._parameters
+        return state[0], memory, parameters
+
+    def _write_records(self, path, records):
+        with open(path, "wb") as f:
+            pack = self._record.pack
+            count = 0
+            for record in records:
+                f.write(pack(*record))
+                count += 1
+        return count
+
+    def _iter_file(self, path):
+        """Iterate the records of a file, without loading it"""
+        if os.path.getsize(path) == 0:
+            return
+        with open(path, "rb") as f:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                yield from self._record.iter_unpack(data)
+
+    def _write_chunk(self, records):
+        records.sort()
+        path = os.path.join(self.directory, f"chunk_{self._num_chunks}.bin")
+        self._num_chunks += 1
+        self._write_records(path, records)
+        return path
+
+    def _merge(self, paths):
+        """Sorted records of the sorted files in `paths`, without duplicated
+        states"""
+        merged = heapq.merge(*[self._iter_file(i) for i in paths])
+        size = self._state_size
+        previous = None
+        for record in merged:
+            # Keep the first record of each state (the one with the smallest
+            # parent)
+            state = record[:size]
+            if state != previous:
+                previous = state
+                yield record
+
+    def _write_depth(self, records):
+        """Sort and deduplicate the records of the next depth and write them
+        to its file"""
+        chunks = []
+        buffer = []
+        for record in records:
+            buffer.append(record)
+            if len(buffer) >= self.chunk_size:
+                chunks.append(self._write_chunk(buffer))
+                buffer = []
+        if buffer or not chunks:
+            chunks.append(self._write_chunk(buffer))
+
+        # Merge the chunks until they can be merged at once
+        while len(chunks) > self.fan_in:
+            merged = []
+            for i in range(0, len(chunks), self.fan_in):
+                group = chunks[i:i + self.fan_in]
+                path = os.path.join(self.directory,
+                                    f"chunk_{self._num_chunks}.bin")
+                self._num_chunks += 1
+                self._write_records(path, self._merge(group))
+                for j in group:
+                    os.remove(j)
+                merged.append(path)
+            chunks = merged
+
+        depth = len(self.states_per_depth)
+        count = self._write_records(self._depth_path(depth),
+                                    self._merge(chunks))
+        for i in chunks:
+            os.remove(i)
+        self.states_per_depth.append(count)
+
+    def _iter_children(self, state):
+        """Children of a state as tuples `(state, move)`, where the move is
+        the tuple of the indices of the buttons pressed: the free buttons
+        followed by one using a move"""
+        yield from self._iter_moves(*self._unpack_state(state), ())
+
+    def _iter_moves(self, value, memory, parameters, prefix):
+        operations = self._operations
+        for i in range(len(operations)):
+            try:
+                new_value, new_memory, new_parameters, used = \
+                    solver.Node.apply_operation(value, memory, parameters,
+                                                operations, i, self._warp)
+            except ValueError:
+                continue
+            if used:
+                yield (new_value, new_memory, new_parameters), prefix + (i,)
+            else:
+                # The store button is free, so it is pressed with the next
+                # buttons
+                yield from self._iter_moves(new_value, new_memory,
+                                            new_parameters, prefix + (i,))
+
+    def _encode_move(self, move):
+        """The indices of the buttons as the digits of a number in base
+        `len(operations) + 1`, or None if it does not fit in 64 bits"""
+        base = len(self._operations) + 1
+        code = 0
+        for i in move:
+            code = code * base + i + 1
+        return code if code < -_NONE else None
+
+    def _decode_move(self, code):
+        base = len(self._operations) + 1
+        move = []
+        while code:
+            code, digit = divmod(code, base)
+            move.append(digit - 1)
+        return move[::-1]
+
+    def _next_records(self):
+        size = self._state_size
+        path = self._depth_path(self.num_moves)
+        for index, record in enumerate(self._iter_file(path)):
+            for child, move in self._iter_children(record[:size]):
+                state = self._pack_state(*child)
+                code = self._encode_move(move)
+                if state is None or code is None:
+                    self.num_overflows += 1
+                    continue
+                yield state + (index, code)
+
+    def extend(self, num_moves):
+        """Compute the depths up to `num_moves` moves"""
+        while self.num_moves < num_moves:
+            self._write_depth(self._next_records())
+
+    def _read_record(self, depth, index):
+        with open(self._depth_path(depth), "rb") as f:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                return self._record.unpack_from(data,
+                                                index * self._record.size)
+
+    def find_solution_indices(self, target_value, num_moves):
+        """Operation indices of a solution using exactly `num_moves` moves,
+        or None.
+
+        The solution is not necessarily the first one in the order of
+        `solver.find_solution_node`.
+
+        Raises
+        ------
+        IncompleteSearch
+            If there is no solution among the stored states, but some
+            states were not stored (see `num_overflows`).
+        """
+        self.extend(num_moves)
+        found = None
+        for index, record in enumerate(self._iter_file(
+                self._depth_path(num_moves))):
+            if record[0] == target_value:
+                found = index, record
+                break
+        if found is None:
+            if self.num_overflows:
+                raise IncompleteSearch(
+                    f"{self.num_overflows} states do not fit in 64 bits")
+            return None
+
+        index, record = found
+        indices = []
+        for depth in range(num_moves, 0, -1):
+            indices[:0] = self._decode_move(record[-1])
+            record = self._read_record(depth - 1, record[-2])
+        return indices
+
+
+def find_solution_node_external(root, target_value, directory=None,
+                                chunk_size=2**16, fan_in=64):
+    """Solve the level of `root` with `ExternalBFS`.
+
+    The solution uses all the moves of `root` (as `solver.find_solution_node`
+    but not necessarily the same one).
+
+    Raises
+    ------
+    IncompleteSearch
+        If no solution was found but some states could not be stored.
+    ValueError
+        If the state of `root` does not fit in 64 bits.
+    """
+    with ExternalBFS(root, directory, chunk_size, fan_in) as search:
+        indices = search.find_solution_indices(target_value,
+                                               root.num_remaining_moves)
+    if indices is None:
+        return None
+    return solver.replay_operation_indices(root, indices)
+
+
+# xxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxx
+
+class TestExternalBFS(unittest.TestCase):
+    @staticmethod
+    def states_in_memory(root):
+        """States reached with each number of moves, computed in memory"""
+        layer = {root.state_key()[:-1]: root}
+        out = [len(layer)]
+        for _ in range(root.num_remaining_moves):
+            nodes = list(layer.values())
+            layer = {}
+            while nodes:
+                for child in nodes.pop().iter_children():
+                    if child.num_remaining_moves == \
+                            root.num_remaining_moves - len(out):
+                        layer[child.state_key()[:-1]] = child
+                    else:
+                        nodes.append(child)
+            out.append(len(layer))
+        return out
+
+    def check_level(self, root, targets, **kwargs):
+        with ExternalBFS(root, **kwargs) as search:
+            search.extend(root.num_remaining_moves)
+            self.assertEqual(search.states_per_depth,
+                             self.states_in_memory(root))
+            for target_value in targets:
+                indices = search.find_solution_indices(
+                    target_value, root.num_remaining_moves)
+                expected = solver.find_solution_node(root, target_value)
+                if expected is None:
+                    self.assertIsNone(indices, target_value)
+                    continue
+                n = solver.replay_operation_indices(root, indices)
+                self.assertEqual(n.value, target_value)
+                self.assertEqual(n.num_remaining_moves, 0)
+
+    def test_levels(self):
+        operations = [op.SumX(2), op.MultiplyX(3), op.Reverse(),
+                      op.StorageAction(), op.RetrieveAction()]
+        root = solver.Node(value=1, current_op=None, available_ops=operations,
+                           num_remaining_moves=4)
+        self.check_level(root, range(-5, 150))
+        # Many small chunks, merged in several passes
+        self.check_level(root, range(0, 150, 7), chunk_size=3, fan_in=2)
+
+        operations = [op.MultiplyX(3), op.SumX(4), op.SumX(8)]
+        operations.append(op.ModifyButtons_AddValue(operations, 2))
+        root = solver.Node(value=5, current_op=None, available_ops=operations,
+                           num_remaining_moves=4)
+        self.check_level(root, range(100), chunk_size=10)
+
+        root = solver.Node(value=99, current_op=None,
+                           available_ops=[op.AddDigits(1), op.SumX(-1)],
+                           num_remaining_moves=3, warp=op.WarpAction(2, 0))
+        self.check_level(root, range(100))
+
+        # The warp changes the stored value, so the store button can be
+        # pressed several times before another button
+        root = solver.Node(value=991, current_op=None,
+                           available_ops=[op.SumX(1), op.StorageAction(),
+                                          op.RetrieveAction()],
+                           num_remaining_moves=2, warp=op.WarpAction(2, 0))
+        self.check_level(root, range(-5, 1000))
+        with ExternalBFS(root) as search:
+            search.extend(2)
+            self.assertEqual(search.states_per_depth, [1, 4, 9])
+
+    def test_find_solution_node(self):
+        root = solver.Node(value=1, current_op=None,
+                           available_ops=[op.StorageAction(),
+                                          op.RetrieveAction()],
+                           num_remaining_moves=2)
+        n = find_solution_node_external(root, 1111)
+        self.assertEqual(solver.parse_operations_until_node(n),
+                         ['Store', 'Retrieve', 'Store', 'Retrieve'])
+        self.assertIsNone(find_solution_node_external(root, 11))
+
+        root = solver.Node(value=7, current_op=None,
+                           available_ops=[op.SumX(1)], num_remaining_moves=0)
+        self.assertIsNotNone(find_solution_node_external(root, 7))
+
+    def test_root_overflow(self):
+        root = solver.Node(value=2**63, current_op=None,
+                           available_ops=[op.SumX(1)], num_remaining_moves=1)
+        with self.assertRaisesRegex(ValueError, "64 bits"):
+            ExternalBFS(root)
+
+    def test_files(self):
+        with tempfile.TemporaryDirectory() as directory:
+            root = solver.Node(value=1, current_op=None,
+                               available_ops=[op.MultiplyX(10)],
+                               num_remaining_moves=25)
+            with ExternalBFS(root, directory) as search:
+                with self.assertRaises(IncompleteSearch):
+                    search.find_solution_indices(-1, 25)
+                # 10^19 does not fit in 64 bits
+                self.assertEqual(search.states_per_depth[17:20], [1, 1, 0])
+                self.assertEqual(search.num_overflows, 1)
+            self.assertEqual(sorted(os.listdir(directory)),
+                             sorted(f"depth_{i}.bin" for i in range(26)))
+
+
+if __name__ == '__main__':
+    unittest.main()
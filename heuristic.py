@@ -0,0 +1,319 @@
+"""Best first search guided by how close each value is to the target.
+
+The search does not explore the whole tree, so it can solve levels with
+many moves where `solver.find_solution_node` would never finish, but it can
+miss solutions (it is not guaranteed to find one when it exists) and the
+solution it finds is not necessarily the first one in the depth first order.
+"""
+
+# pylint: disable=C0111
+# pylint: disable=W0212
+
+import heapq
+import itertools
+import math
+import unittest
+from unittest import mock
+import operations as op
+import solver
+from compiled import CompiledLevel
+
+# Weights of the difference in the number of digits, of the number of digits
+# shared with the target at the start and at the end and of the logarithm of
+# the distance to the target
+DEFAULT_WEIGHTS = (1.0, 0.5, 1.0)
+
+
+def _common_prefix_length(a, b):
+    n = 0
+    for x, y in zip(a, b):
+        if x != y:
+            break
+        n += 1
+    return n
+
+
+def heuristic(value, target_value, weights=DEFAULT_WEIGHTS):
+    """Estimate of how far `value` is from `target_value` (0 if equal).
+
+    Parameters
+    ----------
+    value : int
+        The current value.
+    target_value : int
+        The value we want to reach.
+    weights : tuple[float, float, float]
+        Weights of the difference in the number of digits, of the number of
+        digits shared with the target (as a prefix or a suffix) and of the
+        base 10 logarithm of the numeric distance.
+
+    Returns
+    -------
+    float
+        Smaller values are considered closer to the target.
+    """
+    if value == target_value:
+        return 0.0
+    digits = str(abs(value))
+    target_digits = str(abs(target_value))
+    shared = (_common_prefix_length(digits, target_digits)
+              + _common_prefix_length(digits[::-1], target_digits[::-1]))
+    sign = 0 if (value < 0) == (target_value < 0) else 1
+    return (weights[0] * (abs(len(digits) - len(target_digits)) + sign)
+            - weights[1] * shared
+            + weights[2] * math.log10(abs(value - target_value) + 1))
+
+
+def _is_solution(node, target_value, exact_moves):
+    return node.value == target_value and (
+        not exact_moves or node.num_remaining_moves == 0)
+
+
+def verify_solution(root, node, target_value, exact_moves=True):
+    """Check a solution by replaying its operations from `root`.
+
+    The operations are applied again with `compiled.CompiledLevel`, which
+    does not share the code creating the children of the nodes, so a bug in
+    `solver.Node` can't make an invalid solution pass the check.
+    """
+    indices = []
+    solution = node
+    while node is not root:
+        if node is None:
+            return False
+        indices.append(node.current_op_index)
+        node = node.parent
+
+    level = CompiledLevel.from_node(root)
+    value, memory, parameters = root.value, root._memory, root._parameters
+    remaining = root.num_remaining_moves
+    for i in reversed(indices):
+        if remaining == 0:
+            return False
+        child = next((j for j in level.expand(value, memory, parameters)
+                      if j[3] == i), None)
+        if child is None:
+            return False
+        value, memory, parameters, _, used = child
+        remaining -= used
+    return value == solution.value == target_value and (
+        not exact_moves or remaining == 0)
+
+
+def _finish(node, target_value, dead_states):
+    """First solution below `node` found by the exhaustive search, or None.
+
+    `dead_states` is shared by all the calls, so each state near the end of
+    the moves is only searched once.
+    """
+    return next(solver.iter_solution_nodes(node, target_value, dead_states),
+                None)
+
+
+def _search_key(node, exact_moves):
+    key = node.state_key()
+    return key if exact_moves else key[:-1]
+
+
+def _best_first(root, target_value, exact_moves, tail_moves, max_expansions,
+                depth_weight, weights):
+    counter = itertools.count()
+    heap = [(heuristic(root.value, target_value, weights), next(counter),
+             root)]
+    # When a solution does not need to use all the moves, a state is only
+    # searched again if it is reached with more remaining moves
+    seen = {_search_key(root, exact_moves): root.num_remaining_moves}
+    dead_states = set()
+    num_expansions = 0
+    while heap:
+        node = heapq.heappop(heap)[2]
+        if _is_solution(node, target_value, exact_moves):
+            return node
+        if max_expansions is not None and num_expansions >= max_expansions:
+            return None
+        num_expansions += 1
+        if exact_moves and node.num_remaining_moves <= tail_moves:
+            solution = _finish(node, target_value, dead_states)
+            if solution is not None:
+                return solution
+            continue
+        for child in node.iter_children():
+            key = _search_key(child, exact_moves)
+            if seen.get(key, -1) < child.num_remaining_moves:
+                seen[key] = child.num_remaining_moves
+                num_moves = root.num_remaining_moves - \
+                    child.num_remaining_moves
+                heapq.heappush(heap, (
+                    heuristic(child.value, target_value, weights)
+                    + depth_weight * num_moves, next(counter), child))
+    return None
+
+
+def _beam(root, target_value, beam_width, exact_moves, tail_moves, weights):
+    layer = [root]
+    while layer:
+        if any(_is_solution(i, target_value, exact_moves) for i in layer):
+            return next(i for i in layer
+                        if _is_solution(i, target_value, exact_moves))
+        if exact_moves and layer[0].num_remaining_moves <= tail_moves:
+            dead_states = set()
+            for node in layer:
+                solution = _finish(node, target_value, dead_states)
+                if solution is not None:
+                    return solution
+            return None
+
+        # The children using a move form the next layer. The ones that
+        # don't (the store button) are expanded with this layer.
+        next_layer = {}
+        pending = list(layer)
+        seen = {i.state_key() for i in layer}
+        while pending:
+            node = pending.pop()
+            for child in node.iter_children():
+                key = child.state_key()
+                if child.num_remaining_moves == node.num_remaining_moves:
+                    if key not in seen:
+                        seen.add(key)
+                        if _is_solution(child, target_value, exact_moves):
+                            return child
+                        pending.append(child)
+                elif key not in next_layer:
+                    next_layer[key] = child
+
+        layer = heapq.nsmallest(
+            beam_width, next_layer.values(),
+            key=lambda n: heuristic(n.value, target_value, weights))
+    return None
+
+
+def find_solution_node_best_first(root, target_value, beam_width=None,
+                                  exact_moves=True, tail_moves=4,
+                                  max_expansions=None, depth_weight=0.3,
+                                  weights=DEFAULT_WEIGHTS):
+    """Search a solution expanding first the nodes closest to the target.
+
+    Parameters
+    ----------
+    root : solver.Node
+        The node where the search starts.
+    target_value : int
+        The value we want to reach.
+    beam_width : int, optional
+        If provided, the search goes one move at a time and only the
+        `beam_width` nodes closest to the target are kept after each move,
+        so memory usage is bounded. Otherwise all the nodes are kept in a
+        priority queue.
+    exact_moves : bool
+        If True (as in the game) a solution must use all the moves.
+        Otherwise any node reaching the target is a solution.
+    tail_moves : int
+        When a solution must use all the moves, the heuristic can bring the
+        value close to the target but rarely lands on it with the last
+        move. The nodes with at most `tail_moves` remaining moves are
+        searched exhaustively instead (with a transposition table shared
+        by all of them).
+    max_expansions : int, optional
+        Maximum number of nodes expanded by the priority queue search.
+    depth_weight : float
+        Added to the priority of the nodes for each move used, so that the
+        priority queue search does not follow a single path until it runs
+        out of moves.
+    weights : tuple[float, float, float]
+        Passed to `heuristic`.
+
+    Returns
+    -------
+    solver.Node | None
+        The solution node, which was verified with `verify_solution`, or
+        None if no solution was found.
+    """
+    if beam_width is None:
+        node = _best_first(root, target_value, exact_moves, tail_moves,
+                           max_expansions, depth_weight, weights)
+    else:
+        node = _beam(root, target_value, beam_width, exact_moves, tail_moves,
+                     weights)
+    if node is None or not verify_solution(root, node, target_value,
+                                           exact_moves):
+        return None
+    return node
+
+
+# xxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxx
+
+class TestHeuristic(unittest.TestCase):
+    def test_heuristic(self):
+        self.assertEqual(heuristic(2020, 2020), 0)
+        self.assertLess(heuristic(2021, 2020), heuristic(3021, 2020))
+        self.assertLess(heuristic(2000, 2020), heuristic(20, 2020))
+        self.assertLess(heuristic(20, 2020), heuristic(-20, 2020))
+
+    def check_solution(self, root, target_value, node, exact_moves=True):
+        self.assertIsNotNone(node)
+        self.assertEqual(node.value, target_value)
+        if exact_moves:
+            self.assertEqual(node.num_remaining_moves, 0)
+        self.assertTrue(verify_solution(root, node, target_value,
+                                        exact_moves))
+
+    def test_levels(self):
+        # Level 127 and 139 of the test of the solver
+        root = solver.Node(value=-1, current_op=None, available_ops=[
+            op.MultiplyX(3), op.SumX(2), op.SumX(8), op.Mirror(),
+            op.Reverse()], num_remaining_moves=8)
+        for beam_width in (None, 2000):
+            n = find_solution_node_best_first(root, 2020, beam_width)
+            self.check_solution(root, 2020, n)
+
+        operations = [op.MultiplyX(3), op.SumX(4), op.SumX(8)]
+        operations.append(op.ModifyButtons_AddValue(operations, 2))
+        root = solver.Node(value=5, current_op=None, available_ops=operations,
+                           num_remaining_moves=4)
+        self.check_solution(root, 41,
+                            find_solution_node_best_first(root, 41))
+
+    def test_deep_level(self):
+        # 6^18 nodes, too many for the depth first search
+        operations = [op.SumX(7), op.SumX(-3), op.MultiplyX(2), op.Reverse(),
+                      op.StorageAction(), op.RetrieveAction()]
+        root = solver.Node(value=1, current_op=None, available_ops=operations,
+                           num_remaining_moves=18)
+        n = find_solution_node_best_first(root, 31415, beam_width=300)
+        self.check_solution(root, 31415, n)
+        n = find_solution_node_best_first(root, 5555, exact_moves=False)
+        self.check_solution(root, 5555, n, exact_moves=False)
+        self.assertGreater(n.num_remaining_moves, 0)
+
+    def test_not_found(self):
+        root = solver.Node(value=1, current_op=None,
+                           available_ops=[op.MultiplyX(2)],
+                           num_remaining_moves=10)
+        self.assertIsNone(find_solution_node_best_first(root, 3))
+        self.assertIsNone(find_solution_node_best_first(root, 3,
+                                                        beam_width=10))
+
+    def test_verify(self):
+        root = solver.Node(value=1, current_op=None,
+                           available_ops=[op.SumX(1)], num_remaining_moves=2)
+        child = next(root.iter_children())
+        self.assertTrue(verify_solution(root, child, 2, exact_moves=False))
+        self.assertFalse(verify_solution(root, child, 2))
+        self.assertFalse(verify_solution(root, child, 3, exact_moves=False))
+
+        # A bug in the children of the nodes is detected
+        apply_operation = solver.Node.apply_operation
+
+        def wrong_apply_operation(*args):
+            value, memory, parameters, used = apply_operation(*args)
+            return value + 1, memory, parameters, used
+        with mock.patch.object(solver.Node, "apply_operation",
+                               staticmethod(wrong_apply_operation)):
+            child = next(root.iter_children())
+            self.assertEqual(child.value, 3)
+            self.assertFalse(verify_solution(root, child, 3,
+                                             exact_moves=False))
+
+
+if __name__ == '__main__':
+    unittest.main()
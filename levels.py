@@ -0,0 +1,145 @@
+"""Description of a level that can be read from (and written to) JSON"""
+
+# pylint: disable=C0111
+# pylint: disable=W0212
+
+import json
+import unittest
+import operations as op
+import solver
+
+
+def buttons_key(operations, warp=None):
+    """Return a string identifying the buttons (in order) and warp"""
+    return json.dumps([[i.spec() for i in operations],
+                       None if warp is None else warp.spec()[1:]])
+
+
+class Level:
+    def __init__(self, start_value, target_value, num_moves, operations,
+                 warp=None, name=None):
+        """
+        Parameters
+        ----------
+        start_value : int
+            The initial value.
+        target_value : int
+            The value we want to reach.
+        num_moves : int
+            Number of moves.
+        operations : list[op.Operation]
+            The buttons of the level. For the memory button both an
+            `op.StorageAction` and an `op.RetrieveAction` are needed.
+        warp : op.WarpAction
+            The warp portals, if the level has them.
+        name : str
+            Optional name to identify the level.
+        """
+        self.start_value = start_value
+        self.target_value = target_value
+        self.num_moves = num_moves
+        self.operations = operations
+        self.warp = warp
+        self.name = name
+
+    def __repr__(self):
+        return f"Level({self.to_spec()})"
+
+    def create_root(self):
+        """Return the root `solver.Node` of the level"""
+        return solver.Node(value=self.start_value, current_op=None,
+                           available_ops=self.operations,
+                           num_remaining_moves=self.num_moves,
+                           warp=self.warp)
+
+    def to_spec(self):
+        """Return a JSON serializable dictionary describing the level.
+
+        The buttons are described by `op.Operation.spec`. For instance,
+
+            {"start": 5, "target": 41, "moves": 4,
+             "buttons": [["MultiplyX", 3], ["SumX", 4], ["SumX", 8],
+                         ["ModifyButtons_AddValue", 2]],
+             "warp": null}
+        """
+        spec = {"start": self.start_value,
+                "target": self.target_value,
+                "moves": self.num_moves,
+                "buttons": [i.spec() for i in self.operations],
+                "warp": None if self.warp is None else self.warp.spec()[1:]}
+        if self.name is not None:
+            spec["name"] = self.name
+        return spec
+
+    @staticmethod
+    def from_spec(spec):
+        """Create a level from the dictionary returned by `to_spec`"""
+        try:
+            buttons = spec["buttons"]
+            # The buttons that modify other buttons need the other ones
+            operations = [None if i[0] == "ModifyButtons_AddValue"
+                          else op.operation_from_spec(i) for i in buttons]
+            others = [i for i in operations if i is not None]
+            operations = [
+                op.operation_from_spec(b, others) if o is None else o
+                for b, o in zip(buttons, operations)]
+
+            warp = spec.get("warp")
+            if warp is not None:
+                warp = op.WarpAction(*warp)
+
+            return Level(int(spec["start"]), int(spec["target"]),
+                         int(spec["moves"]), operations, warp,
+                         spec.get("name"))
+        except (KeyError, TypeError, IndexError) as e:
+            raise ValueError(f"Invalid level: {spec}") from e
+
+    @staticmethod
+    def from_json(line):
+        return Level.from_spec(json.loads(line))
+
+
+# xxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxx
+
+class TestLevel(unittest.TestCase):
+    def test_spec(self):
+        operations = [op.MultiplyX(3), op.SumX(4), op.StorageAction(),
+                      op.RetrieveAction()]
+        operations.insert(2, op.ModifyButtons_AddValue(operations, 2))
+        level = Level(5, 41, 4, operations, op.WarpAction(3, 0), "test")
+        spec = json.loads(json.dumps(level.to_spec()))
+        self.assertEqual(spec["buttons"][2], ["ModifyButtons_AddValue", 2])
+        self.assertEqual(spec["warp"], [3, 0])
+
+        new = Level.from_spec(spec)
+        self.assertEqual(new.to_spec(), level.to_spec())
+        self.assertEqual(new.operations[2]._operations,
+                         [new.operations[0], new.operations[1]])
+
+    def test_solve(self):
+        level = Level.from_json(
+            '{"start": 99, "target": 10, "moves": 3,'
+            ' "buttons": [["AddDigits", 1], ["SumX", -1]], "warp": [2, 0]}')
+        n = solver.find_solution_node(level.create_root(), level.target_value)
+        self.assertEqual(solver.parse_operations_until_node(n),
+                         ['Add digit 1', 'Add digit 1', 'sum with -1'])
+
+    def test_buttons_key(self):
+        level = Level.from_json(
+            '{"start": 99, "target": 10, "moves": 3,'
+            ' "buttons": [["AddDigits", 1], ["SumX", -1]], "warp": [2, 0]}')
+        self.assertEqual(buttons_key(level.operations, level.warp),
+                         '[[["AddDigits", 1], ["SumX", -1]], [2, 0]]')
+        self.assertNotEqual(buttons_key(level.operations),
+                            buttons_key(level.operations[::-1]))
+
+    def test_invalid(self):
+        with self.assertRaises(ValueError):
+            Level.from_spec({"start": 1, "target": 2, "moves": 3})
+        with self.assertRaises(ValueError):
+            Level.from_spec({"start": 1, "target": 2, "moves": 3,
+                             "buttons": [["Foo"]]})
+
+
+if __name__ == '__main__':
+    unittest.main()
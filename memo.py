@@ -0,0 +1,435 @@
+"""Opt-in memoisation of the buttons and digit functions.
+
+The same buttons are applied to the same values many times, both in the
+tree of a level and in different levels. While a `MemoLayer` is installed
+(it is a context manager), `Operation.apply` and `Operation.apply_with` of
+the buttons in `operations` and the digit functions in `operations` and
+`digits` remember their results in bounded caches with least recently used
+eviction. Invalid and useless moves are remembered too. The search creates
+the children with `solver.Node.iter_children`, which the layer makes read the
+cache directly (see `solver.Node.try_apply_operation`) to skip the
+remembered rejections without raising an exception, as `MemoLayer.try_apply`
+does.
+`apply` and `apply_with` keep their interface, so when they are called
+directly (for instance by `solver.Node.apply_operation`) a remembered
+rejection raises the `ValueError` again, which costs about as much as a
+lookup.
+
+The buttons that change other buttons or use the memory are not memoised,
+and neither are the functions captured by `compiled.CompiledLevel`.
+
+A lookup costs about as much as the integer functions in `digits` applied
+to values with a few digits, so the layer pays off for the string based
+functions in `operations` (about 5 times faster with a high hit rate) and
+for expensive buttons, but can slow down the search of levels with cheap
+buttons. The counters in `MemoLayer.as_dict` help to decide.
+"""
+
+# pylint: disable=C0111
+# pylint: disable=W0212
+
+import collections
+import functools
+import unittest
+import digits as dg
+import operations as op
+import solver
+
+DEFAULT_MAX_SIZE = 2**16
+
+# Buttons whose result does not only depend on their value and the number
+_NOT_MEMOISED = (op.ModifyButtons_AddValue, op.StorageAction,
+                 op.RetrieveAction)
+
+
+# Marks the attributes that `MemoLayer.install` adds to a class or module
+_INHERITED = object()
+
+
+class _Rejected:
+    """Cached `ValueError`"""
+    __slots__ = ("message",)
+
+    def __init__(self, message):
+        self.message = message
+
+
+class LRUMemo:
+    """Bounded cache of the results of functions.
+
+    Parameters
+    ----------
+    max_size : int
+        Maximum number of results. The least recently used results are
+        removed when there are more.
+    """
+    def __init__(self, max_size=DEFAULT_MAX_SIZE):
+        self.max_size = max_size
+        self._cache = collections.OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self._cache)
+
+    @property
+    def hit_rate(self):
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    def clear(self):
+        self._cache.clear()
+
+    def call(self, key, function, *args):
+        """Return `function(*args)`, or the result stored for `key`.
+
+        A `ValueError` raised by `function` is stored too and returned as a
+        `_Rejected` object.
+        """
+        cache = self._cache
+        if key in cache:
+            cache.move_to_end(key)
+            self.hits += 1
+            return cache[key]
+        self.misses += 1
+        try:
+            result = function(*args)
+        except ValueError as e:
+            result = _Rejected(str(e))
+        cache[key] = result
+        if len(cache) > self.max_size:
+            cache.popitem(last=False)
+            self.evictions += 1
+        return result
+
+    def wrap(self, function):
+        """Return a memoised version of `function`"""
+        def wrapper(*args):
+            result = self.call(args, function, *args)
+            if isinstance(result, _Rejected):
+                raise ValueError(result.message)
+            return result
+        wrapper.__wrapped__ = function
+        return wrapper
+
+    def as_dict(self):
+        return {"size": len(self), "hits": self.hits, "misses": self.misses,
+                "evictions": self.evictions, "hit_rate": self.hit_rate}
+
+
+def _memoised_classes():
+    classes = []
+    pending = [op.Operation]
+    while pending:
+        cls = pending.pop()
+        pending.extend(cls.__subclasses__())
+        if cls.__module__ == op.__name__ and \
+                cls is not op.Operation and not issubclass(cls, _NOT_MEMOISED):
+            classes.append(cls)
+    return classes
+
+
+def _key_function(cls):
+    """Function returning the key of the result of a button of class `cls`
+    given the number and the value of the button"""
+    if hasattr(cls, "_apply_value"):
+        # The result only depends on the value of the button
+        return lambda operation, number, parameter: (cls, parameter, number)
+    # pylint: disable=W0143
+    if cls._spec_args is op.Operation._spec_args:
+        # All the buttons of the class are the same
+        return lambda operation, number, parameter: (cls, number)
+    return lambda operation, number, parameter: (
+        cls, tuple(operation._spec_args()), number)
+
+
+def _key(operation, number, parameter):
+    return _key_function(type(operation))(operation, number, parameter)
+
+
+def _unwrapped(cls, name):
+    function = getattr(cls, name)
+    return getattr(function, "__wrapped__", function)
+
+
+def _apply_unmemoised(operation, number, parameter):
+    cls = type(operation)
+    if hasattr(operation, "_apply_value"):
+        return _unwrapped(cls, "apply_with")(operation, number, parameter)
+    return _unwrapped(cls, "apply")(operation, number)
+
+
+class MemoLayer:
+    """Memoisation of the buttons and digit functions (see the module).
+
+    Parameters
+    ----------
+    max_size : int
+        Maximum number of results stored for the buttons and for each digit
+        function.
+    kernels : bool
+        If True, the digit functions in `op.KERNEL_FUNCTIONS` are also
+        memoised.
+
+    Attributes
+    ----------
+    operations : LRUMemo
+        The cache of the buttons.
+    kernels : dict[str, LRUMemo]
+        The cache of each digit function.
+    """
+    def __init__(self, max_size=DEFAULT_MAX_SIZE, kernels=True):
+        self.operations = LRUMemo(max_size)
+        self.kernels = ({name: LRUMemo(max_size)
+                         for name in op.KERNEL_FUNCTIONS}
+                        if kernels else {})
+        self._originals = []
+
+    def try_apply(self, operation, number, parameter=None):
+        """Same as `operation.apply_with(number, parameter)`, but returning
+        None instead of raising a `ValueError`.
+
+        The value of the button is used if `parameter` is None.
+        """
+        if isinstance(operation, _NOT_MEMOISED):
+            try:
+                return operation.apply_with(number, parameter)
+            except ValueError:
+                return None
+        if parameter is None:
+            parameter = operation.parameter
+        result = self.operations.call(_key(operation, number, parameter),
+                                      _apply_unmemoised, operation, number,
+                                      parameter)
+        return None if isinstance(result, _Rejected) else result
+
+    def _apply(self, operation, number, parameter):
+        result = self.operations.call(_key(operation, number, parameter),
+                                      _apply_unmemoised, operation, number,
+                                      parameter)
+        if isinstance(result, _Rejected):
+            raise ValueError(result.message)
+        return result
+
+    def _patch(self, owner, name, value):
+        self._originals.append((owner, name,
+                                owner.__dict__.get(name, _INHERITED)))
+        setattr(owner, name, value)
+
+    def install(self):
+        """Replace the buttons and digit functions by memoised versions, and
+        set `solver.Node.try_apply_operation`.
+
+        Raises
+        ------
+        RuntimeError
+            If a layer is already installed. The layers replace module and
+            class attributes, so they can't be nested or used by several
+            threads at the same time.
+        """
+        if solver.Node.try_apply_operation is not None:
+            raise RuntimeError("A MemoLayer is already installed")
+        self._patch(solver.Node, "try_apply_operation",
+                    self._try_apply_operation())
+        for cls in _memoised_classes():
+            # Both are created before patching, so they wrap the originals
+            apply_with = self._memoised_apply_with(cls)
+            apply = self._memoised_apply(cls)
+            self._patch(cls, "apply_with", apply_with)
+            self._patch(cls, "apply", apply)
+        for name, kernel_memo in self.kernels.items():
+            for module in (op, dg):
+                self._patch(module, name,
+                            kernel_memo.wrap(getattr(module, name)))
+
+    def _memoised_apply_with(self, cls):
+        memo = self.operations
+        cache = memo._cache
+        make_key = _key_function(cls)
+
+        @functools.wraps(cls.apply_with)
+        def memoised_apply_with(operation, number, parameter):
+            key = make_key(operation, number, parameter)
+            if key in cache:
+                cache.move_to_end(key)
+                memo.hits += 1
+                result = cache[key]
+            else:
+                result = memo.call(key, _apply_unmemoised, operation, number,
+                                   parameter)
+            if result.__class__ is _Rejected:
+                raise ValueError(result.message)
+            return result
+        return memoised_apply_with
+
+    def _memoised_apply(self, cls):
+        apply_with = self._memoised_apply_with(cls)
+
+        @functools.wraps(cls.apply)
+        def memoised_apply(operation, number):
+            return apply_with(operation, number, operation.parameter)
+        return memoised_apply
+
+    def _try_apply_operation(self):
+        memo = self.operations
+        key_functions = {cls: _key_function(cls)
+                         for cls in _memoised_classes()}
+        apply_operation = solver.Node.apply_operation
+
+        def try_apply_operation(value, memory, parameters, operations,
+                                op_index, warp=None):
+            operation = operations[op_index]
+            make_key = key_functions.get(operation.__class__)
+            if make_key is None:
+                try:
+                    return apply_operation(value, memory, parameters,
+                                           operations, op_index, warp)
+                except ValueError:
+                    return None
+            parameter = parameters[op_index]
+            new_value = memo.call(make_key(operation, value, parameter),
+                                  _apply_unmemoised, operation, value,
+                                  parameter)
+            if new_value.__class__ is _Rejected:
+                return None
+            if warp is not None:
+                try:
+                    new_value = warp.apply(new_value)
+                except ValueError:
+                    return None
+            return new_value, memory, parameters, 1
+        return try_apply_operation
+
+    def uninstall(self):
+        """Restore the functions replaced by `install`"""
+        while self._originals:
+            owner, name, original = self._originals.pop()
+            if original is _INHERITED:
+                delattr(owner, name)
+            else:
+                setattr(owner, name, original)
+
+    def __enter__(self):
+        self.install()
+        return self
+
+    def __exit__(self, *args):
+        self.uninstall()
+
+    def as_dict(self):
+        """Counters of the caches, to choose `max_size`"""
+        return {"operations": self.operations.as_dict(),
+                "kernels": {name: memo.as_dict()
+                            for name, memo in self.kernels.items()}}
+
+
+# xxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxx
+
+class TestMemoSolver(solver.TestSolver):
+    @staticmethod
+    def solve(start_value, target_value, num_moves, operations, warp=None):
+        with MemoLayer(max_size=1000):
+            return solver.TestSolver.solve(start_value, target_value,
+                                           num_moves, operations, warp)
+
+
+class TestMemoLayer(unittest.TestCase):
+    def test_operations(self):
+        reverse = op.Reverse.apply
+        sum_x = op.SumX.apply_with
+        with MemoLayer(max_size=3) as memo:
+            self.assertEqual(op.Reverse().apply(12), 21)
+            self.assertEqual(op.Reverse().apply(12), 21)
+            self.assertEqual((memo.operations.hits, memo.operations.misses),
+                             (1, 1))
+
+            # Useless and invalid moves are cached
+            for _ in range(2):
+                with self.assertRaisesRegex(ValueError, "Useless"):
+                    op.SumX(0).apply(5)
+            self.assertIsNone(memo.try_apply(op.SumX(3), 5, 0))
+            self.assertIsNone(memo.try_apply(op.Mirror(), 1234))
+            self.assertEqual(memo.operations.hits, 3)
+
+            # `apply` and `apply_with` share the results
+            self.assertEqual(op.SumX(2).apply_with(5, 3), 8)
+            self.assertEqual(memo.try_apply(op.SumX(3), 5), 8)
+            self.assertEqual(memo.operations.evictions, 1)
+            self.assertEqual(len(memo.operations), 3)
+            self.assertEqual(memo.as_dict()["operations"]["hits"], 4)
+
+            # The value of a button that was modified is used
+            button = op.SumX(1)
+            op.ModifyButtons_AddValue([button], 2).apply(0)
+            self.assertEqual(button.apply(5), 8)
+            self.assertEqual(memo.try_apply(op.Replace(1, 2), 11), 22)
+            self.assertIsNone(memo.try_apply(op.Replace(1, 2), 33))
+        self.assertIs(op.Reverse.apply, reverse)
+        self.assertIs(op.SumX.apply_with, sum_x)
+
+    def test_iter_children(self):
+        operations = [op.SumX(0), op.Mirror(), op.StorageAction(),
+                      op.MultiplyX(2)]
+        root = solver.Node(value=1234, current_op=None,
+                           available_ops=operations, num_remaining_moves=2,
+                           warp=op.WarpAction(4, 0))
+        expected = [(n.value, n.current_op_index, n.num_remaining_moves,
+                     n._memory) for n in root.iter_children()]
+        with MemoLayer(kernels=False) as memo:
+            for _ in range(2):
+                children = [(n.value, n.current_op_index,
+                             n.num_remaining_moves, n._memory)
+                            for n in root.iter_children()]
+                self.assertEqual(children, expected)
+            # The rejections of the first two buttons, the multiplication
+            # and the warp of both children are read from the cache the
+            # second time
+            self.assertEqual((memo.operations.misses, memo.operations.hits),
+                             (5, 5))
+        self.assertIsNone(solver.Node.try_apply_operation)
+
+    def test_nested(self):
+        reverse = op.Reverse.apply
+        with MemoLayer():
+            with self.assertRaises(RuntimeError):
+                MemoLayer().install()
+        self.assertIs(op.Reverse.apply, reverse)
+        with MemoLayer():
+            self.assertIsNotNone(solver.Node.try_apply_operation)
+
+    def test_kernels(self):
+        reverse = dg.reverse
+        with MemoLayer() as memo:
+            self.assertEqual(op.Reverse().apply(-120), -21)
+            self.assertEqual(dg.reverse(-120), -21)
+            self.assertEqual(op.warp(1234, 3, 0), 235)
+            self.assertEqual(op.WarpAction(3, 0).apply(1234), 235)
+            self.assertEqual(op.WarpAction(3, 0).apply(1234), 235)
+            with self.assertRaises(ValueError):
+                op.mirror(1234)
+            with self.assertRaises(ValueError):
+                op.mirror(1234)
+        self.assertIs(dg.reverse, reverse)
+        counters = memo.as_dict()["kernels"]
+        self.assertEqual(counters["reverse"]["misses"], 1)
+        self.assertEqual(counters["reverse"]["hits"], 1)
+        self.assertEqual(counters["mirror"]["hits"], 1)
+        self.assertEqual(memo.operations.hits, 1)
+
+    def test_tree(self):
+        operations = [op.SumX(2), op.MultiplyX(3), op.Reverse(), op.Mirror(),
+                      op.ShiftLeft()]
+        root = solver.Node(value=1, current_op=None, available_ops=operations,
+                           num_remaining_moves=5, warp=op.WarpAction(3, 0))
+        expected = solver.find_solution_node(root, -1)
+        with MemoLayer(kernels=False) as memo:
+            n = solver.find_solution_node(root, -1)
+        self.assertIsNone(expected)
+        self.assertIsNone(n)
+        # The values are bounded by the warp, so most moves are repeated
+        self.assertGreater(memo.operations.hit_rate, 0.5)
+
+
+if __name__ == '__main__':
+    unittest.main()
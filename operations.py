@@ -2,6 +2,8 @@
 # pylint: disable=W0212
 
 import unittest
+from unittest import mock
+import digits as dg
 
 
 def negative_decorator(function):
@@ -15,14 +17,45 @@ def negative_decorator(function):
 
 
 def class_with_value_decorator(cls):
+    """Add the methods of a button whose value can be modified.
+
+    The class must implement the static method `_apply_value(x, value)`,
+    which applies the button with the given value. The value in the object is
+    only the initial one: the solver keeps the current value of each button
+    in an immutable tuple (see `parameters_of`) and uses `apply_with` and
+    `name_with`.
+    """
     def increment_value_by(obj, extra):
         obj._value = obj._value + extra
 
     def _compute_name(obj):
         return obj._name.format(obj._value)
 
+    def _spec_args(obj):
+        return [obj._value]
+
+    def _apply_imp(obj, x):
+        return obj._apply_value(x, obj._value)
+
+    def parameter(obj):
+        return obj._value
+
+    def apply_with(obj, number, value):
+        new_value = obj._apply_value(number, value)
+        if new_value == number:
+            raise ValueError("Useless operation")
+        return new_value
+
+    def name_with(obj, value):
+        return obj._name.format(value)
+
     cls.increment_value_by = increment_value_by
     cls._compute_name = _compute_name
+    cls._spec_args = _spec_args
+    cls._apply_imp = _apply_imp
+    cls.parameter = property(parameter)
+    cls.apply_with = apply_with
+    cls.name_with = name_with
     return cls
 
 
@@ -68,7 +101,7 @@ def replace(value, old, new):
 
 
 def divideby(numerator, denominator):
-    if numerator % denominator != 0:
+    if denominator == 0 or numerator % denominator != 0:
         raise ValueError("Invalid int division")
     return numerator // denominator
 
@@ -111,6 +144,25 @@ def inv10_each_digit(number):
     return "".join([str(inv10_each_digit(int(i))) for i in digits])
 
 
+# Functions of this module with an integer version of the same name in
+# `digits` (see `DigitKernelTests`)
+KERNEL_FUNCTIONS = ["reverse", "mirror", "replace", "shift_left",
+                    "circular_shift_right", "circular_shift_left",
+                    "sum_digits", "add_digits", "inv10_each_digit", "warp"]
+
+
+def _rotation_candidates(number, max_digits):
+    """All rotations of the digits of `number` padded with leading zeros"""
+    sign = -1 if number < 0 else 1
+    digits = str(abs(number))
+    out = []
+    for num_zeros in range(max(max_digits - len(digits), 0) + 1):
+        padded = "0" * num_zeros + digits
+        for i in range(len(padded)):
+            out.append(sign * int(padded[i:] + padded[:i]))
+    return out
+
+
 class Operation:
     def __init__(self, name):
         """
@@ -136,9 +188,106 @@ class Operation:
     def _apply_imp(self, number):
         raise NotImplementedError("Implement-me")
 
+    @property
+    def parameter(self):
+        """The value of the button, if it can be modified, or None"""
+        return None
+
+    def apply_with(self, number, parameter):
+        """Same as `apply`, but using `parameter` as the value of the button
+        (it is ignored by buttons without a value)"""
+        return self.apply(number)
+
+    def name_with(self, parameter):
+        """Same as `name`, but using `parameter` as the value of the button
+        """
+        return self.name
+
+    def digit_count_bounds(self, parameter=None):
+        """Bounds of the change in the number of digits caused by the button.
+
+        Parameters
+        ----------
+        parameter : int
+            The value of the button (default is its initial value). It is
+            ignored by buttons without a value.
+
+        Returns
+        -------
+        tuple[int | None, int | None]
+            The minimum and maximum of `num_digits(y) - num_digits(x)`,
+            where `y` is the result of applying the button to `x` (the minus
+            sign is not a digit). None means there is no (known) bound.
+        """
+        return None, None
+
+    def sign_changes(self, parameter=None):
+        """Tell if the button can change the sign of a value.
+
+        Returns
+        -------
+        tuple[bool, bool]
+            If the button can turn a non negative value into a negative one
+            and if it can turn a negative value into a non negative one.
+        """
+        return True, True
+
+    @property
+    def has_preimages(self):
+        """True if the operation can enumerate its preimages"""
+        # pylint: disable=W0143
+        return (type(self)._preimage_candidates
+                is not Operation._preimage_candidates)
+
+    def preimages(self, number, max_digits=6):
+        """Return the values `x` such that `self.apply(x) == number`.
+
+        Parameters
+        ----------
+        number : int
+            The value obtained after applying the operation.
+        max_digits : int
+            Only preimages with at most this number of digits are returned
+            (some operations, such as `Reverse`, have infinitely many).
+
+        Returns
+        -------
+        list[int]
+            The preimages, without duplicates.
+        """
+        out = []
+        for x in self._preimage_candidates(number, max_digits):
+            if abs(x) >= 10**max_digits or x in out:
+                continue
+            try:
+                if self.apply(x) == number:
+                    out.append(x)
+            except ValueError:
+                pass
+        return out
+
+    def _preimage_candidates(self, number, max_digits):
+        """Return values that might be preimages of `number`.
+
+        It does not need to be exact, since `preimages` check each candidate
+        by applying the operation.
+        """
+        raise NotImplementedError("Operation without preimages")
+
     def _compute_name(self):
         return self._name
 
+    def spec(self):
+        """Return a JSON serializable description of the button.
+
+        It is a list with the class name followed by the arguments of the
+        constructor (see `operation_from_spec`).
+        """
+        return [type(self).__name__] + self._spec_args()
+
+    def _spec_args(self):
+        return []
+
     def __repr__(self):
         return self._compute_name()
 
@@ -149,8 +298,26 @@ class MultiplyX(Operation):
         self._value = value
         super().__init__("multiply by {}")
 
-    def _apply_imp(self, x):
-        return self._value * x
+    @staticmethod
+    def _apply_value(x, value):
+        return value * x
+
+    def _preimage_candidates(self, number, max_digits):
+        if self._value == 0:
+            raise NotImplementedError("Every value is a preimage of zero")
+        if number % self._value == 0:
+            return [number // self._value]
+        return []
+
+    def digit_count_bounds(self, parameter=None):
+        value = self._value if parameter is None else parameter
+        if value == 0:
+            return None, 0
+        return 0, dg.num_digits(abs(value))
+
+    def sign_changes(self, parameter=None):
+        value = self._value if parameter is None else parameter
+        return value < 0, value <= 0
 
 
 @class_with_value_decorator
@@ -159,8 +326,20 @@ class DivideX(Operation):
         self._value = value
         super().__init__("divide by {}")
 
-    def _apply_imp(self, x):
-        return divideby(x, self._value)
+    @staticmethod
+    def _apply_value(x, value):
+        return divideby(x, value)
+
+    def _preimage_candidates(self, number, max_digits):
+        return [number * self._value]
+
+    def digit_count_bounds(self, parameter=None):
+        value = self._value if parameter is None else parameter
+        return -dg.num_digits(abs(value)), 0
+
+    def sign_changes(self, parameter=None):
+        value = self._value if parameter is None else parameter
+        return value < 0, value < 0
 
 
 @class_with_value_decorator
@@ -169,8 +348,21 @@ class SumX(Operation):
         self._value = value
         super().__init__("sum with {}")
 
-    def _apply_imp(self, x):
-        return self._value + x
+    @staticmethod
+    def _apply_value(x, value):
+        return value + x
+
+    def _preimage_candidates(self, number, max_digits):
+        return [number - self._value]
+
+    def digit_count_bounds(self, parameter=None):
+        value = self._value if parameter is None else parameter
+        num_digits = dg.num_digits(abs(value))
+        return -num_digits, num_digits
+
+    def sign_changes(self, parameter=None):
+        value = self._value if parameter is None else parameter
+        return value < 0, value > 0
 
 
 class Reverse(Operation):
@@ -178,7 +370,19 @@ class Reverse(Operation):
         super().__init__("reverse")
 
     def _apply_imp(self, number):
-        return reverse(number)
+        return dg.reverse(number)
+
+    def _preimage_candidates(self, number, max_digits):
+        # Trailing zeros are lost when reversing
+        candidate = dg.reverse(number)
+        return [candidate * 10**i for i in range(max_digits)]
+
+    def digit_count_bounds(self, parameter=None):
+        # Trailing zeros are lost
+        return None, 0
+
+    def sign_changes(self, parameter=None):
+        return False, False
 
 
 class Mirror(Operation):
@@ -186,7 +390,21 @@ class Mirror(Operation):
         super().__init__("mirror")
 
     def _apply_imp(self, number):
-        return mirror(number)
+        return dg.mirror(number)
+
+    def _preimage_candidates(self, number, max_digits):
+        digits = str(abs(number))
+        if len(digits) % 2 != 0:
+            return []
+        half = int(digits[:len(digits) // 2])
+        return [-half if number < 0 else half]
+
+    def digit_count_bounds(self, parameter=None):
+        # Only numbers with up to 3 digits can be mirrored
+        return 0, 3
+
+    def sign_changes(self, parameter=None):
+        return False, False
 
 
 class Replace(Operation):
@@ -196,7 +414,10 @@ class Replace(Operation):
         super().__init__(f"Replace {old} with {new}")
 
     def _apply_imp(self, x):
-        return replace(x, self._old, self._new)
+        return dg.replace(x, self._old, self._new)
+
+    def _spec_args(self):
+        return [self._old, self._new]
 
 
 class CircularShiftRight(Operation):
@@ -204,7 +425,16 @@ class CircularShiftRight(Operation):
         super().__init__("shift right")
 
     def _apply_imp(self, value):
-        return circular_shift_right(value)
+        return dg.circular_shift_right(value)
+
+    def _preimage_candidates(self, number, max_digits):
+        return _rotation_candidates(number, max_digits)
+
+    def digit_count_bounds(self, parameter=None):
+        return None, 0
+
+    def sign_changes(self, parameter=None):
+        return False, False
 
 
 class CircularShiftLeft(Operation):
@@ -212,7 +442,16 @@ class CircularShiftLeft(Operation):
         super().__init__("shift left")
 
     def _apply_imp(self, number):
-        return circular_shift_left(number)
+        return dg.circular_shift_left(number)
+
+    def _preimage_candidates(self, number, max_digits):
+        return _rotation_candidates(number, max_digits)
+
+    def digit_count_bounds(self, parameter=None):
+        return None, 0
+
+    def sign_changes(self, parameter=None):
+        return False, False
 
 
 class ShiftLeft(Operation):
@@ -220,7 +459,17 @@ class ShiftLeft(Operation):
         super().__init__("<<")
 
     def _apply_imp(self, number):
-        return shift_left(number)
+        return dg.shift_left(number)
+
+    def _preimage_candidates(self, number, max_digits):
+        sign = -1 if number < 0 else 1
+        return [sign * (abs(number) * 10 + i) for i in range(10)]
+
+    def digit_count_bounds(self, parameter=None):
+        return -1, -1
+
+    def sign_changes(self, parameter=None):
+        return False, False
 
 
 class SumDigits(Operation):
@@ -228,7 +477,13 @@ class SumDigits(Operation):
         super().__init__("Sum")
 
     def _apply_imp(self, number):
-        return sum_digits(number)
+        return dg.sum_digits(number)
+
+    def digit_count_bounds(self, parameter=None):
+        return None, 0
+
+    def sign_changes(self, parameter=None):
+        return False, False
 
 
 class InvertSign(Operation):
@@ -238,6 +493,12 @@ class InvertSign(Operation):
     def _apply_imp(self, value):
         return -value
 
+    def _preimage_candidates(self, number, max_digits):
+        return [-number]
+
+    def digit_count_bounds(self, parameter=None):
+        return 0, 0
+
 
 class ModifyButtons_AddValue(Operation):
     def __init__(self, operations, value):
@@ -253,20 +514,58 @@ class ModifyButtons_AddValue(Operation):
     def _compute_name(self):
         return self._name.format(self._value)
 
+    def _spec_args(self):
+        return [self._value]
+
     def apply(self, number):
         self._apply_imp(number)
         return number
 
+    def modified_indices(self, operations):
+        """Indices in `operations` of the buttons modified by this one"""
+        return [i for i, o in enumerate(operations)
+                if any(o is j for j in self._operations)]
+
+    def modify(self, parameters, operations):
+        """Return the parameters (see `parameters_of`) of `operations` after
+        pressing this button.
+
+        Only the values of the buttons given to the constructor change.
+        """
+        parameters = list(parameters)
+        for i in self.modified_indices(operations):
+            parameters[i] += self._value
+        return tuple(parameters)
+
+    def digit_count_bounds(self, parameter=None):
+        return 0, 0
+
+    def sign_changes(self, parameter=None):
+        return False, False
+
 
 class StorageAction(Operation):
     def __init__(self):
         super().__init__("Store")
 
+    def digit_count_bounds(self, parameter=None):
+        return 0, 0
+
+    def sign_changes(self, parameter=None):
+        return False, False
+
 
 class RetrieveAction(Operation):
     def __init__(self):
         super().__init__("Retrieve")
 
+    def digit_count_bounds(self, parameter=None):
+        # It depends on the number of digits in the memory
+        return 0, None
+
+    def sign_changes(self, parameter=None):
+        return False, False
+
 
 @class_with_value_decorator
 class AddDigits(Operation):
@@ -274,8 +573,29 @@ class AddDigits(Operation):
         self._value = value
         super().__init__("Add digit {}")
 
-    def _apply_imp(self, x):
-        return add_digits(x, self._value)
+    @staticmethod
+    def _apply_value(x, value):
+        return dg.add_digits(x, value)
+
+    def _preimage_candidates(self, number, max_digits):
+        digits = str(number)
+        added = str(self._value)
+        if not digits.endswith(added):
+            return []
+        prefix = digits[:-len(added)]
+        if prefix in ("", "-"):
+            # Adding digits to zero just replaces it
+            return [0]
+        return [int(prefix)]
+
+    def digit_count_bounds(self, parameter=None):
+        value = self._value if parameter is None else parameter
+        num_digits = dg.num_digits(abs(value))
+        # Adding digits to zero replaces it
+        return num_digits - 1, num_digits
+
+    def sign_changes(self, parameter=None):
+        return False, False
 
 
 class Inv10EachDigit(Operation):
@@ -283,7 +603,17 @@ class Inv10EachDigit(Operation):
         super().__init__("Inv10")
 
     def _apply_imp(self, number):
-        return inv10_each_digit(number)
+        return dg.inv10_each_digit(number)
+
+    def _preimage_candidates(self, number, max_digits):
+        # Inverting each digit is an involution
+        return [dg.inv10_each_digit(number)]
+
+    def digit_count_bounds(self, parameter=None):
+        return 0, 0
+
+    def sign_changes(self, parameter=None):
+        return False, False
 
 
 class WarpAction(Operation):
@@ -297,7 +627,46 @@ class WarpAction(Operation):
         super().__init__("Warp")
 
     def apply(self, number):
-        return warp(number, self._enter_idx, self._exit_idx)
+        return dg.warp(number, self._enter_idx, self._exit_idx)
+
+    def _spec_args(self):
+        return [self._enter_idx, self._exit_idx]
+
+
+def parameters_of(operations):
+    """Return the values of the buttons in `operations` as a tuple.
+
+    The tuple has the `parameter` of each button (None for the buttons
+    without a value) and is the only state modified by
+    `ModifyButtons_AddValue.modify`.
+    """
+    return tuple(i.parameter for i in operations)
+
+
+def operation_from_spec(spec, operations=()):
+    """Create a button from the description returned by `Operation.spec`.
+
+    Parameters
+    ----------
+    spec : list
+        The class name followed by the arguments of the constructor.
+    operations : list[Operation]
+        The other buttons of the level. Only used by
+        `ModifyButtons_AddValue`.
+
+    Returns
+    -------
+    Operation
+        The new button.
+    """
+    name, *args = spec
+    cls = globals().get(name)
+    if not isinstance(cls, type) or not issubclass(cls, Operation) \
+            or cls is Operation:
+        raise ValueError(f"Unknown operation: {name}")
+    if cls is ModifyButtons_AddValue:
+        return cls(operations, *args)
+    return cls(*args)
 
 
 class Tests(unittest.TestCase):
@@ -322,6 +691,8 @@ class Tests(unittest.TestCase):
         self.assertEqual(divideby(-15, -3), 5)
         with self.assertRaises(ValueError):
             divideby(10, 3)
+        with self.assertRaises(ValueError):
+            divideby(10, 0)
 
     def test_circular_shift_right(self):
         self.assertEqual(circular_shift_right(351), 135)
@@ -365,6 +736,103 @@ class Tests(unittest.TestCase):
         self.assertEqual(warp(991, 2, 0), 1)
         self.assertEqual(warp(255255, 3, 1), 375)
 
+    def test_preimages(self):
+        operations = [MultiplyX(3), DivideX(2), SumX(-7), Reverse(),
+                      Mirror(), CircularShiftRight(), CircularShiftLeft(),
+                      ShiftLeft(), InvertSign(), AddDigits(1),
+                      Inv10EachDigit()]
+        for operation in operations:
+            self.assertTrue(operation.has_preimages)
+            for number in range(-1200, 1200):
+                for x in operation.preimages(number, max_digits=4):
+                    self.assertEqual(operation.apply(x), number)
+
+            # Every value with at most 3 digits must be found as a preimage
+            for x in range(-999, 1000):
+                try:
+                    number = operation.apply(x)
+                except ValueError:
+                    continue
+                self.assertIn(x, operation.preimages(number, max_digits=3))
+
+        self.assertEqual(Reverse().preimages(21, max_digits=3),
+                         [12, 120])
+        self.assertEqual(ShiftLeft().preimages(-3, max_digits=2),
+                         [-30, -31, -32, -33, -34, -35, -36, -37, -38, -39])
+        self.assertEqual(CircularShiftRight().preimages(50, max_digits=3),
+                         [500])
+        self.assertFalse(SumDigits().has_preimages)
+        self.assertFalse(Replace(1, 2).has_preimages)
+
+    def test_spec(self):
+        operations = [MultiplyX(3), Replace(11, "33"), Reverse(),
+                      StorageAction(), AddDigits(1), WarpAction(3, 1)]
+        for operation in operations:
+            new = operation_from_spec(operation.spec())
+            self.assertIs(type(new), type(operation))
+            self.assertEqual(new.spec(), operation.spec())
+            self.assertEqual(new.name, operation.name)
+        self.assertEqual(Replace(11, "33").spec(), ["Replace", 11, "33"])
+
+        mb = operation_from_spec(["ModifyButtons_AddValue", 2], operations)
+        self.assertEqual(mb.spec(), ["ModifyButtons_AddValue", 2])
+        self.assertEqual(mb._operations, [operations[0], operations[4]])
+
+        with self.assertRaises(ValueError):
+            operation_from_spec(["unittest"])
+        with self.assertRaises(ValueError):
+            operation_from_spec(["Operation", "x"])
+
+    def test_parameters(self):
+        s = SumX(4)
+        m = MultiplyX(3)
+        r = Reverse()
+        mb = ModifyButtons_AddValue([s, m], 2)
+        parameters = parameters_of([s, r, m, mb])
+        self.assertEqual(parameters, (4, None, 3, None))
+
+        parameters = mb.modify(parameters, [s, r, m, mb])
+        self.assertEqual(parameters, (6, None, 5, None))
+        # Only the buttons given to the modifier change
+        s2 = SumX(1)
+        self.assertEqual(mb.modify((4, 1, None), [s, s2, mb]),
+                         (6, 1, None))
+        self.assertEqual(s.apply_with(10, parameters[0]), 16)
+        self.assertEqual(m.name_with(parameters[2]), "multiply by 5")
+        self.assertEqual(r.apply_with(12, parameters[1]), 21)
+        with self.assertRaises(ValueError):
+            s.apply_with(10, 0)
+
+        # The buttons were not modified
+        self.assertEqual((s.apply(10), m.name), (14, "multiply by 3"))
+
+    def test_digit_count_bounds(self):
+        operations = [MultiplyX(3), MultiplyX(-12), MultiplyX(0),
+                      DivideX(2), DivideX(-25), SumX(7), SumX(-150),
+                      Reverse(), Mirror(), CircularShiftRight(),
+                      CircularShiftLeft(), ShiftLeft(), SumDigits(),
+                      InvertSign(), AddDigits(1), AddDigits(12),
+                      Inv10EachDigit(), Replace(1, "00")]
+        for operation in operations:
+            low, high = operation.digit_count_bounds()
+            to_negative, to_non_negative = operation.sign_changes()
+            for x in range(-2000, 2000):
+                try:
+                    y = operation.apply(x)
+                except ValueError:
+                    continue
+                change = (dg.num_digits(abs(y)) - dg.num_digits(abs(x)))
+                self.assertTrue(low is None or change >= low, operation)
+                self.assertTrue(high is None or change <= high, operation)
+                if x >= 0 > y:
+                    self.assertTrue(to_negative, operation)
+                if x < 0 <= y:
+                    self.assertTrue(to_non_negative, operation)
+
+        # The bounds depend on the value of the button
+        self.assertEqual(SumX(7).digit_count_bounds(150), (-3, 3))
+        self.assertEqual(SumX(7).sign_changes(-1), (True, False))
+
     def test_ModifyButtons_AddValue(self):
         s = SumX(4)
         self.assertEqual(s._value, 4)
@@ -376,6 +844,49 @@ class Tests(unittest.TestCase):
         self.assertEqual(s.apply(20), 20+13)
 
 
+class DigitKernelTests(Tests):
+    """Run the tests above with the functions in `digits` and compare them
+    with the string based functions in this module"""
+    def setUp(self):
+        patcher = mock.patch.multiple(
+            __name__,
+            **{name: getattr(dg, name) for name in KERNEL_FUNCTIONS})
+        self.reference = {name: globals()[name] for name in KERNEL_FUNCTIONS}
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def assertSameResult(self, name, *args):
+        try:
+            expected = self.reference[name](*args)
+        except ValueError:
+            with self.assertRaises(ValueError, msg=f"{name}{args}"):
+                getattr(dg, name)(*args)
+            return
+        self.assertEqual(getattr(dg, name)(*args), expected,
+                         msg=f"{name}{args}")
+
+    def test_exhaustive(self):
+        names = ["reverse", "mirror", "shift_left", "circular_shift_right",
+                 "circular_shift_left", "sum_digits", "inv10_each_digit"]
+        numbers = list(range(-99999, 100000))
+        numbers += list(range(-999999, 999999, 997)) + [10**12 + 3]
+        for name in names:
+            for number in numbers:
+                self.assertSameResult(name, number)
+
+    def test_exhaustive_warp(self):
+        numbers = list(range(-1000, 20000)) + list(range(20000, 999999, 991))
+        for enter_idx in range(5):
+            for exit_idx in range(enter_idx):
+                for number in numbers:
+                    self.assertSameResult("warp", number, enter_idx, exit_idx)
+
+    def test_exhaustive_add_digits(self):
+        for added in [0, 1, 7, 10, 25, 100, 123456, -3, None]:
+            for number in range(-2000, 2000):
+                self.assertSameResult("add_digits", number, added)
+
+
 # xxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxx
 if __name__ == "__main__":
     unittest.main()
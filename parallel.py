@@ -0,0 +1,194 @@
+"""Search the tree in several processes, one subtree per move prefix"""
+
+# pylint: disable=C0111
+# pylint: disable=W0212
+
+import concurrent.futures
+import multiprocessing
+import os
+import unittest
+import operations as op
+import solver
+
+# Number of nodes a worker expands between checks of the shared stop flag
+CHECK_INTERVAL = 1024
+
+# Index of the first task that found a solution (shared by the workers)
+_best_task = None
+
+
+def _init_worker(best_task):
+    global _best_task  # pylint: disable=W0603
+    _best_task = best_task
+
+
+def _search_subtree(task_idx, root, target_value):
+    """Search the subtree of `root` in a worker process.
+
+    The search stops early when a task with a smaller index finds a
+    solution, since its solution comes first in the depth first order.
+
+    Returns
+    -------
+    list[int] | None
+        The operation indices from `root` to the first solution, or None.
+    """
+    num_nodes = 0
+    stack = [root.iter_children()]
+    while stack:
+        node = next(stack[-1], None)
+        if node is None:
+            stack.pop()
+            continue
+
+        num_nodes += 1
+        if num_nodes % CHECK_INTERVAL == 0 and _best_task.value < task_idx:
+            return None
+
+        if node.num_remaining_moves == 0:
+            if node.value == target_value:
+                with _best_task.get_lock():
+                    _best_task.value = min(_best_task.value, task_idx)
+                return solver._operation_indices(node, root)
+            continue
+        stack.append(node.iter_children())
+    return None
+
+
+def _detach(node):
+    """Copy of `node` without its parent, to be sent to a worker"""
+    return solver.Node(node.value, None, node._available_ops,
+                       node.num_remaining_moves, memory=node._memory,
+                       warp=node._warp, parameters=node._parameters,
+                       order=node._order)
+
+
+def iter_prefix_nodes(root, prefix_depth):
+    """Nodes reached from `root` with `prefix_depth` operations.
+
+    Nodes without remaining moves found before that depth are also yielded.
+    The nodes are yielded in depth first order.
+    """
+    if prefix_depth == 0 or root.num_remaining_moves == 0:
+        yield root
+        return
+    for child in root.iter_children():
+        yield from iter_prefix_nodes(child, prefix_depth - 1)
+
+
+def _choose_prefix_depth(root, num_workers):
+    """Smallest depth with enough prefixes to keep every worker busy"""
+    prefix_depth = 1
+    while prefix_depth < root.num_remaining_moves:
+        num_prefixes = sum(1 for _ in iter_prefix_nodes(root, prefix_depth))
+        if num_prefixes >= 4 * num_workers:
+            break
+        prefix_depth += 1
+    return prefix_depth
+
+
+def find_solution_node_parallel(root, target_value, max_workers=None,
+                                prefix_depth=None):
+    """Find the first solution using a pool of processes.
+
+    The nodes after the first `prefix_depth` moves are enumerated in the main
+    process and the subtree of each one is searched in a worker. When a
+    worker finds a solution, the workers searching subtrees that come later
+    in the depth first order stop. The returned node is always the same one
+    returned by `solver.find_solution_node`.
+
+    Parameters
+    ----------
+    root : Node
+        The root node. Its tree does not need to be created.
+    target_value : int
+        The value we want to reach.
+    max_workers : int, optional
+        Number of worker processes. Default is the number of CPUs.
+    prefix_depth : int, optional
+        Number of moves done in the main process. By default the smallest
+        depth with at least 4 prefixes per worker is used.
+
+    Returns
+    -------
+    Node | None
+        The solution node, or None if there is no solution.
+    """
+    if max_workers is None:
+        max_workers = os.cpu_count() or 1
+    if prefix_depth is None:
+        prefix_depth = _choose_prefix_depth(root, max_workers)
+
+    prefixes = list(iter_prefix_nodes(root, prefix_depth))
+    best_task = multiprocessing.Value("q", len(prefixes))
+    with concurrent.futures.ProcessPoolExecutor(
+            max_workers, initializer=_init_worker,
+            initargs=(best_task,)) as executor:
+        futures = [
+            None if node.num_remaining_moves == 0 else
+            executor.submit(_search_subtree, i, _detach(node), target_value)
+            for i, node in enumerate(prefixes)]
+
+        # Tasks are checked in order, so the first solution found is the
+        # first one in the depth first order
+        for node, future in zip(prefixes, futures):
+            if future is None:
+                if node.value == target_value:
+                    break
+                continue
+            indices = future.result()
+            if indices is not None:
+                node = solver.replay_operation_indices(node, indices)
+                break
+        else:
+            return None
+
+        with best_task.get_lock():
+            best_task.value = -1
+        for future in futures:
+            if future is not None:
+                future.cancel()
+    return node
+
+
+# xxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxx
+
+class TestParallelSolver(solver.TestSolver):
+    @staticmethod
+    def solve(start_value, target_value, num_moves, operations, warp=None):
+        root = solver.Node(value=start_value, current_op=None,
+                           available_ops=operations,
+                           num_remaining_moves=num_moves, warp=warp)
+        n = find_solution_node_parallel(root, target_value, max_workers=2)
+        return solver.parse_operations_until_node(n)
+
+    def test_same_solution_as_serial_search(self):
+        operations = [op.SumX(3), op.MultiplyX(2), op.Reverse(),
+                      op.ShiftLeft(), op.StorageAction(), op.RetrieveAction()]
+        for target_value in (21, 105, 4, 1212, 33, 7):
+            root = solver.Node(value=2, current_op=None,
+                               available_ops=operations,
+                               num_remaining_moves=6)
+            self.assertEqual(
+                solver.parse_operations_until_node(
+                    find_solution_node_parallel(root, target_value,
+                                                max_workers=3,
+                                                prefix_depth=2)),
+                solver.parse_operations_until_node(
+                    solver.find_solution_node(root, target_value)))
+
+    def test_prefixes(self):
+        root = solver.Node(value=1, current_op=None,
+                           available_ops=[op.SumX(1), op.MultiplyX(2)],
+                           num_remaining_moves=3)
+        self.assertEqual([n.value for n in iter_prefix_nodes(root, 2)],
+                         [3, 4, 3, 4])
+        root = solver.Node(value=1, current_op=None,
+                           available_ops=[op.SumX(1), op.MultiplyX(2)],
+                           num_remaining_moves=1)
+        self.assertEqual([n.value for n in iter_prefix_nodes(root, 2)],
+                         [2, 2])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,266 @@
+"""Rules to discard nodes that can't lead to a solution.
+
+A `Pruner` is passed to `solver.iter_solution_nodes` (and the functions using
+it), which calls `Pruner.prune` before expanding each node.
+"""
+
+# pylint: disable=C0111
+# pylint: disable=W0212
+
+import unittest
+import digits as dg
+import operations as op
+import solver
+
+
+class Pruner:
+    """Discard nodes using game specific rules.
+
+    The rules are:
+
+    - "width": values with more digits than the calculator display are
+      invalid, as in the game. This rule changes the problem (a solution
+      going through a larger value is not found) and the other rules never
+      remove a solution.
+    - "digits": the number of digits of the value can't be brought to the
+      number of digits of the target with the remaining moves, given the
+      change each button can cause in the number of digits (see
+      `op.Operation.digit_count_bounds`).
+    - "sign": the value and the target have different signs and no button
+      can change the sign (see `op.Operation.sign_changes`).
+
+    The number of nodes removed by each rule is counted in `removed`.
+
+    Parameters
+    ----------
+    target_value : int
+        The value we want to reach.
+    operations : list[op.Operation]
+        The operations of the nodes (`Node._available_ops`).
+    warp : op.WarpAction
+        The warp action of the nodes, if any.
+    max_digits : int
+        Number of digits of the display. If it is None the "width" rule is
+        disabled.
+    digit_count : bool
+        If the "digits" rule is enabled.
+    sign : bool
+        If the "sign" rule is enabled.
+    """
+    RULES = ("width", "digits", "sign")
+
+    def __init__(self, target_value, operations, warp=None, max_digits=6,
+                 digit_count=True, sign=True):
+        self.target_value = target_value
+        self.max_digits = max_digits
+        self.digit_count = digit_count
+        self.sign = sign
+        self.removed = dict.fromkeys(self.RULES, 0)
+
+        self._target_digits = dg.num_digits(abs(target_value))
+        self._operations = operations
+        self._warp = warp
+        self._modifier_values = sorted(
+            {i._value for i in operations
+             if isinstance(i, op.ModifyButtons_AddValue)})
+        self._offsets = [{0}]
+        self._bounds = {}
+
+    @staticmethod
+    def for_node(node, target_value, **kwargs):
+        """Create a pruner for the tree below `node`"""
+        return Pruner(target_value, node._available_ops, node._warp, **kwargs)
+
+    def _parameter_offsets(self, num_moves):
+        """Values that the modifier buttons can add to the value of a button
+        in `num_moves` moves"""
+        while len(self._offsets) <= num_moves:
+            self._offsets.append(self._offsets[-1] | {
+                i + j for i in self._offsets[-1]
+                for j in self._modifier_values})
+        return self._offsets[num_moves]
+
+    def _move_bounds(self, parameters, num_moves):
+        """Bounds of the change caused by a single move in the next
+        `num_moves` moves.
+
+        Returns the minimum and maximum change in the number of digits (None
+        if it is not bounded) and if the sign can be changed from non
+        negative to negative and vice versa.
+        """
+        key = (parameters, num_moves if self._modifier_values else 0)
+        if key not in self._bounds:
+            offsets = self._parameter_offsets(key[1])
+            low, high = 0, 0
+            to_negative = to_non_negative = False
+            for operation, parameter in zip(self._operations, parameters):
+                for value in ([None] if parameter is None
+                              else [parameter + i for i in offsets]):
+                    op_low, op_high = operation.digit_count_bounds(value)
+                    op_negative, op_non_negative = operation.sign_changes(
+                        value)
+                    low = None if None in (low, op_low) else min(low, op_low)
+                    high = (None if None in (high, op_high)
+                            else max(high, op_high))
+                    to_negative = to_negative or op_negative
+                    to_non_negative = to_non_negative or op_non_negative
+
+            if self._warp is not None:
+                # The warp removes digits after each move
+                low = None
+            if self.max_digits is not None and \
+                    self._target_digits <= self.max_digits:
+                # Every value in the path to the target fits in the display
+                max_change = self.max_digits - 1
+                low = -max_change if low is None else max(low, -max_change)
+                high = max_change if high is None else min(high, max_change)
+            self._bounds[key] = (low, high, to_negative, to_non_negative)
+        return self._bounds[key]
+
+    def prune(self, node, num_moves=None):
+        """Return True if `node` can't lead to a solution.
+
+        Parameters
+        ----------
+        node : solver.Node
+            The node about to be expanded.
+        num_moves : int
+            Number of moves still to be used from `node`. Default is
+            `node.num_remaining_moves`.
+        """
+        if num_moves is None:
+            num_moves = node.num_remaining_moves
+        value = node.value
+        num_digits = dg.num_digits(abs(value))
+        if self.max_digits is not None and num_digits > self.max_digits:
+            self.removed["width"] += 1
+            return True
+
+        if not (self.digit_count or self.sign):
+            return False
+        low, high, to_negative, to_non_negative = self._move_bounds(
+            node._parameters, num_moves)
+
+        if self.digit_count:
+            change = self._target_digits - num_digits
+            if (high is not None and change > high * num_moves) or \
+                    (low is not None and change < low * num_moves):
+                self.removed["digits"] += 1
+                return True
+
+        if self.sign:
+            negative = value < 0
+            if negative != (self.target_value < 0) and \
+                    not (to_non_negative if negative else to_negative):
+                self.removed["sign"] += 1
+                return True
+
+        return False
+
+
+# xxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxx
+
+class TestPrunedSolver(solver.TestSolver):
+    @staticmethod
+    def solve(start_value, target_value, num_moves, operations, warp=None):
+        root = solver.Node(value=start_value, current_op=None,
+                           available_ops=operations,
+                           num_remaining_moves=num_moves, warp=warp)
+        pruner = Pruner.for_node(root, target_value)
+        n = solver.find_solution_node(root, target_value, pruner=pruner)
+        return solver.parse_operations_until_node(n)
+
+    @staticmethod
+    def count_nodes(root, target_value, pruner):
+        num_nodes = 0
+        stack = [root]
+        while stack:
+            node = stack.pop()
+            num_nodes += 1
+            if node.num_remaining_moves > 0 and (
+                    pruner is None or not pruner.prune(node)):
+                stack.extend(node.iter_children())
+        return num_nodes
+
+    def test_width(self):
+        operations = [op.MultiplyX(10), op.SumX(-1)]
+        root = solver.Node(value=5, current_op=None,
+                           available_ops=operations, num_remaining_moves=7)
+        pruner = Pruner.for_node(root, 4, digit_count=False, sign=False)
+        self.assertLess(self.count_nodes(root, 4, pruner),
+                        self.count_nodes(root, 4, None))
+        self.assertGreater(pruner.removed["width"], 0)
+        self.assertEqual(pruner.removed["digits"], 0)
+
+        # 5 -> 50 -> ... -> 5000000 -> 4999999 needs 7 digits
+        n = solver.find_solution_node(root, 4999999)
+        self.assertIsNotNone(n)
+        pruner = Pruner.for_node(root, 4999999, max_digits=6)
+        self.assertIsNone(
+            solver.find_solution_node(root, 4999999, pruner=pruner))
+        pruner = Pruner.for_node(root, 4999999, max_digits=None)
+        self.assertEqual(
+            solver.find_solution_node(root, 4999999, pruner=pruner).value,
+            n.value)
+
+    def test_digit_count(self):
+        operations = [op.SumX(3), op.MultiplyX(2), op.Reverse()]
+        root = solver.Node(value=1, current_op=None,
+                           available_ops=operations, num_remaining_moves=6)
+        pruner = Pruner.for_node(root, 123456, max_digits=None, sign=False)
+        self.assertLess(self.count_nodes(root, 123456, pruner),
+                        self.count_nodes(root, 123456, None) / 10)
+        self.assertGreater(pruner.removed["digits"], 0)
+
+        # The digits rule never removes solutions
+        for target_value in range(200):
+            pruner = Pruner.for_node(root, target_value, max_digits=None)
+            self.assertEqual(
+                [solver.parse_operations_until_node(n)
+                 for n in solver.iter_solution_nodes(root, target_value)],
+                [solver.parse_operations_until_node(n)
+                 for n in solver.iter_solution_nodes(
+                     root, target_value, pruner=pruner)])
+
+    def test_modified_buttons(self):
+        # The modifier increases the number of digits SumX can add
+        operations = [op.SumX(5)]
+        operations.append(op.ModifyButtons_AddValue(operations, 50))
+        root = solver.Node(value=1, current_op=None,
+                           available_ops=operations, num_remaining_moves=3)
+        pruner = Pruner.for_node(root, 106, max_digits=None)
+        n = solver.find_solution_node(root, 106, pruner=pruner)
+        self.assertEqual(solver.parse_operations_until_node(n),
+                         ['[+]50', '[+]50', 'sum with 105'])
+
+    def test_sign(self):
+        operations = [op.SumX(3), op.MultiplyX(2), op.Reverse()]
+        root = solver.Node(value=1, current_op=None,
+                           available_ops=operations, num_remaining_moves=6)
+        pruner = Pruner.for_node(root, -10)
+        self.assertIsNone(
+            solver.find_solution_node(root, -10, pruner=pruner))
+        self.assertEqual(pruner.removed["sign"], 1)
+        self.assertEqual(self.count_nodes(root, -10, pruner), 1)
+
+        root = solver.Node(value=1, current_op=None,
+                           available_ops=operations + [op.InvertSign()],
+                           num_remaining_moves=6)
+        pruner = Pruner.for_node(root, -10)
+        self.assertFalse(pruner.prune(root))
+
+    def test_shortest(self):
+        operations = [op.SumX(1), op.MultiplyX(2)]
+        root = solver.Node(value=1, current_op=None,
+                           available_ops=operations, num_remaining_moves=20)
+        pruner = Pruner.for_node(root, 100)
+        n = solver.find_shortest_solution_node(root, 100, pruner=pruner)
+        self.assertEqual(n.num_remaining_moves, 12)
+        self.assertEqual(solver.parse_operations_until_node(n),
+                         solver.parse_operations_until_node(
+                             solver.find_shortest_solution_node(root, 100)))
+        self.assertGreater(pruner.removed["digits"], 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,224 @@
+"""Count the reachable states of a level without creating its tree.
+
+Many sequences of buttons reach the same state (value, memory and button
+values), so instead of one `solver.Node` per sequence `analyse` keeps, for
+each number of moves used, a map from each distinct state to the number of
+sequences reaching it. The memory used is proportional to the number of
+distinct states and the number of solutions is obtained by adding the counts
+of the states at the target.
+"""
+
+# pylint: disable=C0111
+# pylint: disable=W0212
+
+import collections
+import unittest
+import operations as op
+import solver
+from compiled import CompiledLevel
+
+
+class Reachability:
+    """Result of `analyse`.
+
+    The depth is the number of moves used (the store button is free, so the
+    states it creates are in the same depth as the state where it was
+    pressed).
+
+    Attributes
+    ----------
+    states_per_depth : list[int]
+        Number of distinct states (value, memory and button values) at each
+        depth, starting with the root at depth 0.
+    values_per_depth : list[int]
+        Number of distinct values at each depth.
+    paths_per_depth : list[int]
+        Number of sequences of buttons reaching each depth.
+    solutions_per_depth : list[int]
+        Number of sequences of buttons reaching the target at each depth
+        (all zeros if there is no target).
+    reachable : set[int]
+        The values reachable with any number of moves.
+    final_values : collections.Counter
+        Number of sequences of buttons reaching each value using all the
+        moves.
+    """
+    def __init__(self):
+        self.states_per_depth = []
+        self.values_per_depth = []
+        self.paths_per_depth = []
+        self.solutions_per_depth = []
+        self.reachable = set()
+        self.final_values = collections.Counter()
+
+    @property
+    def num_solutions(self):
+        """Number of sequences of buttons reaching the target using all the
+        moves, as required by the game"""
+        return self.solutions_per_depth[-1]
+
+    def as_dict(self):
+        """JSON serializable description of the analysis"""
+        return {"states_per_depth": self.states_per_depth,
+                "values_per_depth": self.values_per_depth,
+                "paths_per_depth": self.paths_per_depth,
+                "solutions_per_depth": self.solutions_per_depth,
+                "num_solutions": self.num_solutions,
+                "num_reachable": len(self.reachable)}
+
+
+def _add_layer(result, layer, target_value):
+    values = collections.Counter()
+    for (value, _, _), count in layer.items():
+        values[value] += count
+    result.states_per_depth.append(len(layer))
+    result.values_per_depth.append(len(values))
+    result.paths_per_depth.append(sum(values.values()))
+    result.solutions_per_depth.append(values.get(target_value, 0))
+    result.reachable.update(values)
+    return values
+
+
+def analyse(root, target_value=None):
+    """Count the states and sequences of buttons reachable from `root`.
+
+    The children of each state are created with `compiled.CompiledLevel`,
+    so the moves are the same as in `solver.Node.iter_children`.
+
+    Parameters
+    ----------
+    root : solver.Node
+        The node where the sequences start.
+    target_value : int, optional
+        The value we want to reach, used to count the solutions.
+
+    Returns
+    -------
+    Reachability
+        The counts for each number of moves, up to the remaining moves of
+        `root`.
+    """
+    level = CompiledLevel.from_node(root)
+    result = Reachability()
+
+    # Each state is (value, memory, parameters)
+    layer = {(root.value, root._memory, root._parameters): 1}
+    for _ in range(root.num_remaining_moves):
+        # The states created by the free buttons (the store button, followed
+        # by the warp) are added to the current layer, pressing them again
+        # until no new sequence appears
+        if level.store_indices:
+            layer = collections.Counter(layer)
+            frontier = layer
+            while frontier:
+                free = collections.Counter()
+                for state, count in frontier.items():
+                    for value, memory, parameters, _, used in \
+                            level.expand(*state):
+                        if not used:
+                            free[(value, memory, parameters)] += count
+                layer.update(free)
+                frontier = free
+        _add_layer(result, layer, target_value)
+
+        next_layer = collections.Counter()
+        for state, count in layer.items():
+            for value, memory, parameters, _, used in level.expand(*state):
+                if used:
+                    next_layer[(value, memory, parameters)] += count
+        layer = next_layer
+
+    result.final_values = _add_layer(result, layer, target_value)
+    return result
+
+
+# xxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxx
+
+class TestReachability(unittest.TestCase):
+    @staticmethod
+    def count_tree(root, target_value):
+        """States, paths and solutions counted from the whole tree"""
+        states = collections.defaultdict(set)
+        paths = collections.Counter()
+        solutions = collections.Counter()
+        stack = [root]
+        while stack:
+            node = stack.pop()
+            depth = root.num_remaining_moves - node.num_remaining_moves
+            states[depth].add(node.state_key())
+            paths[depth] += 1
+            if node.value == target_value:
+                solutions[depth] += 1
+            stack.extend(node.iter_children())
+        num_depths = root.num_remaining_moves + 1
+        return ([len(states[i]) for i in range(num_depths)],
+                [paths[i] for i in range(num_depths)],
+                [solutions[i] for i in range(num_depths)])
+
+    def check_level(self, root, target_value):
+        result = analyse(root, target_value)
+        states, paths, solutions = self.count_tree(root, target_value)
+        self.assertEqual(result.states_per_depth, states)
+        self.assertEqual(result.paths_per_depth, paths)
+        self.assertEqual(result.solutions_per_depth, solutions)
+        self.assertEqual(result.num_solutions, sum(
+            1 for _ in solver.iter_solution_nodes(root, target_value)))
+        return result
+
+    def test_counts(self):
+        operations = [op.SumX(2), op.MultiplyX(3), op.Reverse(),
+                      op.StorageAction(), op.RetrieveAction()]
+        root = solver.Node(value=1, current_op=None,
+                           available_ops=operations, num_remaining_moves=5)
+        result = self.check_level(root, 33)
+        self.assertGreater(result.num_solutions, 0)
+
+        operations = [op.MultiplyX(3), op.SumX(4), op.SumX(8)]
+        operations.append(op.ModifyButtons_AddValue(operations, 2))
+        root = solver.Node(value=5, current_op=None,
+                           available_ops=operations, num_remaining_moves=4)
+        self.check_level(root, 41)
+
+        root = solver.Node(value=0, current_op=None,
+                           available_ops=[op.SumX(9), op.MultiplyX(2)],
+                           num_remaining_moves=4, warp=op.WarpAction(2, 0))
+        self.check_level(root, 36)
+
+    def test_store_with_warp(self):
+        # The warp changes the stored value, so the store button can be
+        # pressed again
+        root = solver.Node(value=991, current_op=None,
+                           available_ops=[op.SumX(1), op.StorageAction(),
+                                          op.RetrieveAction()],
+                           num_remaining_moves=2, warp=op.WarpAction(2, 0))
+        result = self.check_level(root, 3)
+        self.assertEqual(result.states_per_depth, [3, 6, 9])
+        self.assertEqual(result.paths_per_depth, [3, 10, 19])
+        self.assertEqual(result.solutions_per_depth, [0, 0, 10])
+
+    def test_merged_states(self):
+        # Adding 1 and 2 in any order only reaches 7 distinct values with 6
+        # moves, out of 2^6 sequences
+        root = solver.Node(value=0, current_op=None,
+                           available_ops=[op.SumX(1), op.SumX(2)],
+                           num_remaining_moves=6)
+        result = analyse(root, 9)
+        self.assertEqual(result.states_per_depth, [1, 2, 3, 4, 5, 6, 7])
+        self.assertEqual(result.paths_per_depth[-1], 2**6)
+        # Choose the 3 moves adding 2
+        self.assertEqual(result.num_solutions, 20)
+        self.assertEqual(result.final_values[12], 1)
+        self.assertEqual(result.reachable, set(range(13)))
+        self.assertEqual(result.as_dict()["num_reachable"], 13)
+
+    def test_no_target(self):
+        root = solver.Node(value=3, current_op=None,
+                           available_ops=[op.SumX(1)], num_remaining_moves=0)
+        result = analyse(root)
+        self.assertEqual(result.states_per_depth, [1])
+        self.assertEqual(result.num_solutions, 0)
+        self.assertEqual(result.final_values, {3: 1})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,345 @@
+"""Solve variations of a level reusing the work done for the previous ones.
+
+When a level is being designed it is solved again after small changes: one
+more move, another target or another value for a button. A `SolverSession`
+keeps the states reachable with each number of moves and the children of
+each state for each button, so that
+
+- using more moves only expands the states of the last depth computed,
+- changing the target only needs the stored states,
+- changing a button only applies that button again to the stored states
+  (the other children are reused), and new states are only expanded if the
+  change reaches them.
+
+The solution returned is the same `solver.find_solution_node` would find.
+"""
+
+# pylint: disable=C0111
+# pylint: disable=W0212
+
+import unittest
+import operations as op
+import solver
+from compiled import CompiledLevel
+
+
+class SolverSession:
+    """Incremental solver of a level with a fixed start value.
+
+    Each state is a tuple `(value, memory, parameters)`. If the level has no
+    button modifiers the values of the buttons can't change, so the
+    parameters of the states are None and the values of the buttons are
+    those of the session.
+
+    Parameters
+    ----------
+    start_value : int
+        The initial value.
+    operations : list[op.Operation]
+        The buttons of the level.
+    warp : op.WarpAction
+        The warp action of the level, if any.
+    memory : int, optional
+        The initial memory.
+
+    Attributes
+    ----------
+    num_applied : int
+        Number of times a button was applied to a state, which measures the
+        work done by the session.
+    """
+    def __init__(self, start_value, operations, warp=None, memory=None):
+        self.start_value = start_value
+        self.warp = warp
+        self.memory = memory
+        self.num_applied = 0
+        self._set_operations(list(operations))
+
+    @staticmethod
+    def from_node(node):
+        return SolverSession(node.value, node._available_ops, node._warp,
+                             node._memory)
+
+    @property
+    def operations(self):
+        return list(self._operations)
+
+    def _set_operations(self, operations):
+        """Set the buttons and forget every stored state"""
+        self._operations = operations
+        self._compiled = CompiledLevel(operations, self.warp)
+        self._parameters = op.parameters_of(operations)
+        self._has_modifiers = bool(self._compiled.modifier_indices)
+        # The children of each state, as a list with a tuple
+        # `(op_index, child, num_used_moves)` for each valid button
+        self._edges = {}
+        # For some of the states in `_edges`, the indices of the buttons that
+        # changed since their children were computed
+        self._stale = {}
+        # The states reached with each number of moves, without and with the
+        # states created by the store button
+        self._arrivals = []
+        self._layers = []
+        root = (self.start_value, self.memory,
+                self._parameters if self._has_modifiers else None)
+        self._add_layer({root})
+
+    def _state_parameters(self, state):
+        return self._parameters if state[2] is None else state[2]
+
+    def _expand(self, state):
+        """Children of `state`, computed if they are not stored"""
+        edges = self._edges.get(state)
+        if edges is not None and state in self._stale:
+            self._update(state, edges, self._stale.pop(state))
+        elif edges is None:
+            children = self._compiled.expand(
+                state[0], state[1], self._state_parameters(state))
+            self.num_applied += len(self._operations)
+            keep_parameters = self._has_modifiers
+            edges = self._edges[state] = [
+                (i, (value, memory, parameters if keep_parameters else None),
+                 used) for value, memory, parameters, i, used in children]
+        return edges
+
+    def _update(self, state, edges, op_indices):
+        """Apply again the buttons in `op_indices` to `state`"""
+        for i in op_indices:
+            self.num_applied += 1
+            try:
+                value, memory, _, used = solver.Node.apply_operation(
+                    state[0], state[1], self._parameters, self._operations,
+                    i, self.warp)
+            except ValueError:
+                continue
+            edges.append((i, (value, memory, None), used))
+        edges.sort(key=lambda i: i[0])
+
+    def _add_layer(self, arrivals):
+        """Add the states reached with one more move (`arrivals`) and the
+        ones created from them by the free buttons"""
+        layer = set(arrivals)
+        pending = list(arrivals)
+        while pending:
+            for _, child, used in self._expand(pending.pop()):
+                if not used and child not in layer:
+                    layer.add(child)
+                    pending.append(child)
+        self._arrivals.append(arrivals)
+        self._layers.append(layer)
+
+    def _extend(self, num_moves):
+        """Compute the states reachable with up to `num_moves` moves"""
+        while len(self._layers) <= num_moves:
+            arrivals = set()
+            for state in self._layers[-1]:
+                for _, child, used in self._expand(state):
+                    if used:
+                        arrivals.add(child)
+            self._add_layer(arrivals)
+
+    @property
+    def states_per_depth(self):
+        """Number of distinct states reached with each number of moves"""
+        return [len(i) for i in self._layers]
+
+    def set_operation(self, op_index, operation):
+        """Replace the button `op_index` by `operation`.
+
+        Only that button is applied again to the stored states, when they
+        are reached again. If the level has button modifiers, or the button
+        is a memory button or a modifier, all the states are computed again
+        instead.
+        """
+        operations = list(self._operations)
+        old_operation = operations[op_index]
+        operations[op_index] = operation
+        special = (op.StorageAction, op.RetrieveAction,
+                   op.ModifyButtons_AddValue)
+        if self._has_modifiers or isinstance(operation, special) or \
+                isinstance(old_operation, special):
+            self._set_operations(operations)
+            return
+
+        num_moves = len(self._layers) - 1
+        self._operations = operations
+        self._compiled = CompiledLevel(operations, self.warp)
+        self._parameters = op.parameters_of(operations)
+        for state, edges in self._edges.items():
+            edges[:] = [i for i in edges if i[0] != op_index]
+            self._stale.setdefault(state, set()).add(op_index)
+
+        # Build the layers again from the stored children and forget the
+        # states that can't be reached anymore
+        root = next(iter(self._arrivals[0]))
+        self._arrivals = []
+        self._layers = []
+        self._add_layer({root})
+        self._extend(num_moves)
+        reachable = set().union(*self._layers)
+        self._edges = {state: edges for state, edges in self._edges.items()
+                       if state in reachable}
+        self._stale = {state: op_indices for state, op_indices
+                       in self._stale.items() if state in reachable}
+
+    def _solution_states(self, target_value, num_moves):
+        """For each number of moves, the states from which the target can be
+        reached using exactly the remaining moves"""
+        good = [None] * (num_moves + 1)
+        good[num_moves] = {i for i in self._arrivals[num_moves]
+                           if i[0] == target_value}
+        for depth in range(num_moves - 1, -1, -1):
+            layer = self._layers[depth]
+            good_children = good[depth + 1]
+            current = {i for i in layer if any(
+                used and child in good_children
+                for _, child, used in self._expand(i))}
+            # The free buttons can be pressed before another one
+            changed = True
+            while changed:
+                changed = False
+                for state in layer - current:
+                    if any(not used and child in current
+                           for _, child, used in self._expand(state)):
+                        current.add(state)
+                        changed = True
+            good[depth] = current
+        return good
+
+    def find_solution_indices(self, target_value, num_moves):
+        """Operation indices of the solution `solver.find_solution_node`
+        would find with `num_moves` moves, or None.
+
+        The depth first search finds the sequence of buttons that comes
+        first in the order of the buttons, so the solution is built taking,
+        at each step, the first button leading to a state from which the
+        target can still be reached. The order of the buttons only depends
+        on the buttons already pressed (see
+        `solver.Node.order_after_operation`), so it is followed along the
+        way.
+        """
+        self._extend(num_moves)
+        good = self._solution_states(target_value, num_moves)
+        state = next(iter(self._arrivals[0]))
+        if state not in good[0]:
+            return None
+
+        indices = []
+        depth = 0
+        order = None
+        while depth < num_moves:
+            edges = self._expand(state)
+            if order is not None:
+                position = {j: k for k, j in enumerate(order)}
+                edges = sorted(edges, key=lambda edge: position[edge[0]])
+            for i, child, used in edges:
+                if child in good[depth + used]:
+                    indices.append(i)
+                    state = child
+                    depth += used
+                    order = solver.Node.order_after_operation(
+                        order, self._operations, i)
+                    break
+        return indices
+
+    def find_solution_node(self, target_value, num_moves):
+        """Same as `find_solution_indices`, but returning the solution node
+        (created from a new root node)"""
+        indices = self.find_solution_indices(target_value, num_moves)
+        if indices is None:
+            return None
+        root = solver.Node(value=self.start_value, current_op=None,
+                           available_ops=self._operations,
+                           num_remaining_moves=num_moves, memory=self.memory,
+                           warp=self.warp)
+        return solver.replay_operation_indices(root, indices)
+
+
+# xxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxx
+
+class TestSessionSolver(solver.TestSolver):
+    @staticmethod
+    def solve(start_value, target_value, num_moves, operations, warp=None):
+        session = SolverSession(start_value, operations, warp)
+        n = session.find_solution_node(target_value, num_moves)
+        return solver.parse_operations_until_node(n)
+
+
+class TestSolverSession(unittest.TestCase):
+    def check_solutions(self, session, targets, num_moves):
+        root = solver.Node(value=session.start_value, current_op=None,
+                           available_ops=session.operations,
+                           num_remaining_moves=num_moves,
+                           memory=session.memory, warp=session.warp)
+        for target_value in targets:
+            expected = solver.find_solution_node(root, target_value)
+            n = session.find_solution_node(target_value, num_moves)
+            self.assertEqual(solver.parse_operations_until_node(n),
+                             solver.parse_operations_until_node(expected),
+                             (target_value, num_moves))
+
+    def test_more_moves(self):
+        operations = [op.SumX(2), op.MultiplyX(3), op.Reverse(),
+                      op.StorageAction(), op.RetrieveAction()]
+        session = SolverSession(1, operations)
+        for num_moves in range(5):
+            self.check_solutions(session, range(-5, 120), num_moves)
+        num_applied = session.num_applied
+        self.assertEqual(len(session.states_per_depth), 5)
+
+        # Fewer moves or another target reuse the states
+        self.check_solutions(session, range(200, 300), 3)
+        self.assertEqual(session.num_applied, num_applied)
+
+    def test_change_button(self):
+        operations = [op.SumX(2), op.MultiplyX(3), op.Reverse(),
+                      op.Mirror(), op.SumX(5)]
+        session = SolverSession(1, operations)
+        self.check_solutions(session, range(100), 7)
+        num_applied = session.num_applied
+
+        session.set_operation(3, op.SumX(-1))
+        self.check_solutions(session, range(100), 7)
+        cold_session = SolverSession(1, session.operations)
+        cold_session.find_solution_indices(0, 7)
+        self.assertEqual(cold_session.states_per_depth,
+                         session.states_per_depth)
+        self.assertLess(session.num_applied - num_applied,
+                        cold_session.num_applied / 2)
+
+        session = SolverSession(3, [op.SumX(6), op.MultiplyX(2),
+                                    op.Reverse(), op.CircularShiftLeft()],
+                                op.WarpAction(3, 0))
+        self.check_solutions(session, range(100), 6)
+        session.set_operation(0, op.SumX(7))
+        self.check_solutions(session, range(100), 6)
+
+        # The memory is part of the state
+        session = SolverSession(2, [op.SumX(4), op.StorageAction(),
+                                    op.RetrieveAction(), op.MultiplyX(2)])
+        self.check_solutions(session, range(300), 4)
+        session.set_operation(0, op.SumX(5))
+        self.check_solutions(session, range(300), 4)
+
+    def test_change_special_button(self):
+        operations = [op.MultiplyX(3), op.SumX(4), op.SumX(8)]
+        operations.append(op.ModifyButtons_AddValue(operations, 2))
+        session = SolverSession(5, operations)
+        self.check_solutions(session, [41, 42], 4)
+
+        operations = [op.MultiplyX(3), op.SumX(4), op.SumX(8),
+                      op.StorageAction()]
+        session = SolverSession(5, operations)
+        self.check_solutions(session, range(50), 4)
+        session.set_operation(3, op.RetrieveAction())
+        self.check_solutions(session, range(50), 4)
+
+    def test_no_solution(self):
+        session = SolverSession(1, [op.MultiplyX(2)])
+        self.assertIsNone(session.find_solution_indices(3, 4))
+        self.assertEqual(session.find_solution_indices(16, 4), [0] * 4)
+        self.assertEqual(session.find_solution_indices(1, 0), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -4,14 +4,26 @@
 # pylint: disable=W0212
 # pylint: disable=R0913
 
-import copy
+import time
 import unittest
+import digits as dg
 import operations as op
 
 
 class Node:
+    __slots__ = ("_value", "_current_op", "_available_ops",
+                 "_num_remaining_moves", "_children", "_parent", "_memory",
+                 "_warp", "_parameters", "_op_index", "_order")
+
+    # Optional function with the arguments of `apply_operation`, returning
+    # None instead of raising a ValueError for the invalid and useless
+    # moves. `iter_children` uses it instead of `apply_operation` when it is
+    # set (see `memo.MemoLayer`).
+    try_apply_operation = None
+
     def __init__(self, value, current_op, available_ops, num_remaining_moves,
-                 parent=None, memory=None, warp=None):
+                 parent=None, memory=None, warp=None, parameters=None,
+                 op_index=None, order=None):
         """
         data : tuple[int, list, list]
         value : int
@@ -31,6 +43,19 @@ class Node:
         warp : op.WarpAction
             Warp action to be called after every action. Note that the warp
             action does not decrement the number of remaining moves.
+        parameters : tuple
+            Current value of each operation in `available_ops` (see
+            `op.parameters_of`). If not provided it is taken from parent, or
+            from the operations if there is no parent. The operations are
+            shared by every node and are never modified: pressing a
+            `op.ModifyButtons_AddValue` only changes this tuple.
+        op_index : int
+            Index of `current_op` in the operations of the parent. If not
+            provided it is searched for when needed.
+        order : tuple[int]
+            Indices of the operations in the order the children are created
+            (see `order_after_operation`). None is the order of
+            `available_ops`. If not provided it is taken from parent.
         """
         self._value = value
         self._current_op = current_op
@@ -49,6 +74,17 @@ class Node:
         if parent is not None and memory is None:
             self._memory = parent._memory
 
+        if parameters is None:
+            if parent is not None:
+                parameters = parent._parameters
+            else:
+                parameters = op.parameters_of(available_ops)
+        self._parameters = parameters
+        self._op_index = op_index
+        if order is None and parent is not None:
+            order = parent._order
+        self._order = order
+
     def __repr__(self):
         return (f"Node(value={self._value},"
                 f"current_op={self._current_op},"
@@ -72,66 +108,406 @@ class Node:
     def current_op(self):
         return self._current_op
 
+    @property
+    def current_op_index(self):
+        """Index of `current_op` in the operations of the parent"""
+        if self._op_index is None and self._parent is not None:
+            self._op_index = next(
+                i for i, o in enumerate(self._parent._available_ops)
+                if o is self._current_op)
+        return self._op_index
+
+    @property
+    def current_op_name(self):
+        """Name of `current_op` with the value it had when it was applied"""
+        if self._parent is None:
+            return self._current_op.name
+        return self._current_op.name_with(
+            self._parent._parameters[self.current_op_index])
+
+    def state_key(self):
+        """Return a hashable key describing the effective state of the node.
+
+        Two nodes with the same key have identical subtrees (up to the
+        identity of the operation objects), no matter which sequence of
+        operations was used to reach them. The key includes the value, the
+        memory, the warp portals, the current value of every button that can
+        be modified by `op.ModifyButtons_AddValue` and the number of
+        remaining moves. The order of the buttons is not included: it
+        changes which solution comes first, but not which sequences reach a
+        value.
+        """
+        if self._warp is None:
+            warp = None
+        else:
+            warp = (self._warp._enter_idx, self._warp._exit_idx)
+        return (self._value, self._memory, warp, self._parameters,
+                self._num_remaining_moves)
+
     @staticmethod
-    def apply_operation_and_create_child(node, operation):
-        """Apply a Operation to the node and create a new node as the result
+    def apply_operation(value, memory, parameters, operations, op_index,
+                        warp=None):
+        """Apply a Operation to a state without creating a Node
 
         Parameters
         ----------
-        node : Node
-            The Node object to apply the operation to
-        operation : op.Operation
-            The operation to apply to the Node object
+        value : int
+            The current value
+        memory : int
+            The current memory (None if nothing was stored)
+        parameters : tuple
+            The current value of each operation (see `op.parameters_of`)
+        operations : list[op.Operation]
+            The available operations
+        op_index : int
+            Index in `operations` of the operation to apply
+        warp : op.WarpAction
+            Warp action to be called after the operation
 
         Returns
         -------
-        Node
-            The node resulting from applying `operation` to `node`
+        tuple[int, int, tuple, int]
+            The new value, memory and parameters, and the number of moves used
+            by the operation (the StorageAction is free).
+
+        Raises
+        ------
+        ValueError
+            If the operation can't be applied or is useless.
         """
-        # __init__(self, value, current_op, available_ops, num_remaining_moves,
-        # parent=None)
-        parent = node
-        memory = None
-        num_remaining_moves = node.num_remaining_moves - 1
-        available_ops = node._available_ops
-        warp = node._warp
+        operation = operations[op_index]
+        num_used_moves = 1
 
         if isinstance(operation, op.ModifyButtons_AddValue):
-            available_ops = [copy.copy(i) for i in node._available_ops
-                             if i is not operation]
-            mb = op.ModifyButtons_AddValue(available_ops, operation._value)
-            available_ops.append(mb)
-            value = mb.apply(node.value)
+            parameters = operation.modify(parameters, operations)
         elif isinstance(operation, op.StorageAction):
-            if node.value == node._memory:
+            if value == memory:
                 raise ValueError("Can't store the same value")
-            value = node.value
-            num_remaining_moves = node.num_remaining_moves
+            num_used_moves = 0
             memory = value
 
         elif isinstance(operation, op.RetrieveAction):
-            value = op.add_digits(node.value, node._memory)
+            value = dg.add_digits(value, memory)
         else:
-            value = operation.apply(node.value)
+            value = operation.apply_with(value, parameters[op_index])
 
         if warp is not None:
             value = warp.apply(value)
 
-        return Node(value, operation, available_ops, num_remaining_moves,
-                    parent, memory, warp=warp)
+        return value, memory, parameters, num_used_moves
 
-    def create_children(self):
+    @staticmethod
+    def order_after_operation(order, operations, op_index):
+        """Order of the buttons after pressing `operations[op_index]`.
+
+        As in the game, a `op.ModifyButtons_AddValue` moves after the other
+        buttons when it is pressed. The order is a tuple of indices in
+        `operations`, or None for the order of `operations`.
+        """
+        if not isinstance(operations[op_index], op.ModifyButtons_AddValue):
+            return order
+        if order is None:
+            order = range(len(operations))
+        return tuple(i for i in order if i != op_index) + (op_index,)
+
+    @staticmethod
+    def ordered_indices(order, num_operations, op_indices=None):
+        """Indices of the operations to try, following `order` (see
+        `order_after_operation`).
+
+        If `op_indices` is given only those operations are tried.
+        """
+        if order is None:
+            return range(num_operations) if op_indices is None else op_indices
+        if op_indices is None:
+            return order
+        allowed = set(op_indices)
+        return [i for i in order if i in allowed]
+
+    @staticmethod
+    def apply_operation_and_create_child(node, operation, op_index=None):
+        """Apply a Operation to the node and create a new node as the result
+
+        Parameters
+        ----------
+        node : Node
+            The Node object to apply the operation to
+        operation : op.Operation
+            The operation to apply to the Node object
+        op_index : int
+            Index of `operation` in the operations of `node`. If not provided
+            it is searched for.
+
+        Returns
+        -------
+        Node
+            The node resulting from applying `operation` to `node`
+        """
+        if op_index is None:
+            op_index = next(i for i, o in enumerate(node._available_ops)
+                            if o is operation)
+        return node._child(op_index, Node.apply_operation(
+            node.value, node._memory, node._parameters, node._available_ops,
+            op_index, node._warp))
+
+    def _child(self, op_index, state):
+        """Child of this node given the `(value, memory, parameters,
+        num_used_moves)` returned by `apply_operation`"""
+        value, memory, parameters, num_used_moves = state
+        operations = self._available_ops
+        return Node(value, operations[op_index], operations,
+                    self._num_remaining_moves - num_used_moves, self, memory,
+                    warp=self._warp, parameters=parameters,
+                    op_index=op_index,
+                    order=Node.order_after_operation(
+                        self._order, operations, op_index))
+
+    def iter_children(self, op_indices=None):
+        """Lazily create the children of this node.
+
+        The children are created in the same order as in `create_children`,
+        but they are not stored in the node.
+
+        Parameters
+        ----------
+        op_indices : list[int], optional
+            Only the operations with these indices are tried (default is
+            all of them, see `commutation_table`).
+
+        Yields
+        ------
+        Node
+            Each valid child of this node, in the order of the buttons (see
+            `order_after_operation`).
+        """
         if self._num_remaining_moves > 0:
-            for current_op in self._available_ops:
-                try:
-                    child = Node.apply_operation_and_create_child(
-                        self, current_op)
-                    self._children.append(child)
-                except ValueError:
-                    pass
+            operations = self._available_ops
+            try_apply = Node.try_apply_operation
+            for i in Node.ordered_indices(self._order, len(operations),
+                                          op_indices):
+                if try_apply is None:
+                    try:
+                        yield Node.apply_operation_and_create_child(
+                            self, operations[i], i)
+                    except ValueError:
+                        pass
+                    continue
+                state = try_apply(self._value, self._memory, self._parameters,
+                                  operations, i, self._warp)
+                if state is not None:
+                    yield self._child(i, state)
+
+    def create_children(self, budget=None):
+        """Create the whole tree below this node.
+
+        If a `SearchBudget` is provided, each node is charged to it and
+        `SearchTimeout` is raised when it expires (see `solve_with_budget`).
+        """
+        self._children.extend(self.iter_children())
 
         for child in self._children:
-            child.create_children()
+            if budget is not None and budget.charge(child):
+                raise SearchTimeout()
+            child.create_children(budget)
+
+
+class SearchTimeout(Exception):
+    """Raised by `Node.create_children` when its budget expires"""
+
+
+class SearchBudget:
+    """Limit of time and nodes of a search.
+
+    The searches call `charge` for each node and stop when it returns True.
+    The node closest to the target is also remembered, so that a search that
+    runs out of budget can return its best effort.
+
+    Parameters
+    ----------
+    timeout : float, optional
+        Maximum time, in seconds from now.
+    max_nodes : int, optional
+        Maximum number of nodes.
+    target_value : int, optional
+        The value we want to reach, used to find the closest node.
+    deadline : float, optional
+        Absolute deadline, as a `time.monotonic` value. If both `timeout`
+        and `deadline` are provided the earliest one is used.
+    """
+    # Number of nodes between checks of the clock
+    CHECK_INTERVAL = 256
+
+    def __init__(self, timeout=None, max_nodes=None, target_value=None,
+                 deadline=None):
+        if timeout is not None:
+            timeout_deadline = time.monotonic() + timeout
+            deadline = timeout_deadline if deadline is None \
+                else min(deadline, timeout_deadline)
+        self.deadline = deadline
+        self.max_nodes = max_nodes
+        self.target_value = target_value
+        self.num_nodes = 0
+        self.expired = False
+        self.closest_node = None
+        self._closest_distance = None
+
+    def charge(self, node):
+        """Account for a new node and return True if the budget expired"""
+        self.num_nodes += 1
+        if self.target_value is not None:
+            distance = abs(node.value - self.target_value)
+            if self._closest_distance is None or \
+                    distance < self._closest_distance:
+                self._closest_distance = distance
+                self.closest_node = node
+        if self.max_nodes is not None and self.num_nodes > self.max_nodes:
+            self.expired = True
+        elif self.deadline is not None and \
+                self.num_nodes % self.CHECK_INTERVAL == 0 and \
+                time.monotonic() >= self.deadline:
+            self.expired = True
+        return self.expired
+
+
+class SearchResult:
+    """Outcome of `solve_with_budget`.
+
+    Attributes
+    ----------
+    status : str
+        `SOLVED`, `UNSOLVABLE` (the whole search space was explored) or
+        `TIMED_OUT`.
+    node : Node
+        The solution node, or None.
+    closest_node : Node
+        The node with the value closest to the target among the nodes
+        searched.
+    num_nodes : int
+        Number of nodes searched.
+    elapsed : float
+        Time spent, in seconds.
+    stats : stats.SearchStats
+        The statistics of the search, if they were requested.
+    """
+    SOLVED = "solved"
+    UNSOLVABLE = "unsolvable"
+    TIMED_OUT = "timed out"
+
+    def __init__(self, status, node, closest_node, num_nodes, elapsed,
+                 stats=None):
+        self.status = status
+        self.node = node
+        self.closest_node = closest_node
+        self.num_nodes = num_nodes
+        self.elapsed = elapsed
+        self.stats = stats
+
+    @property
+    def solution(self):
+        """Names of the operations of the solution, or None"""
+        if self.node is None:
+            return None
+        return parse_operations_until_node(self.node)
+
+    @property
+    def closest_value(self):
+        return None if self.closest_node is None else self.closest_node.value
+
+    @property
+    def closest_solution(self):
+        """Names of the operations reaching `closest_value`"""
+        if self.closest_node is None:
+            return None
+        return parse_operations_until_node(self.closest_node)
+
+    def __repr__(self):
+        return (f"SearchResult({self.status}, solution={self.solution}, "
+                f"closest_value={self.closest_value}, "
+                f"num_nodes={self.num_nodes})")
+
+
+def _clear_tree(root):
+    """Remove the children of every node below `root`, breaking the
+    references between parents and children so the tree is freed"""
+    stack = [root]
+    while stack:
+        node = stack.pop()
+        stack.extend(node._children)
+        node._children = []
+
+
+def _operation_indices(node, root):
+    """Indices of the operations used to go from `root` to `node`"""
+    indices = []
+    while node is not root:
+        indices.append(node.current_op_index)
+        node = node.parent
+    return list(reversed(indices))
+
+
+def solve_with_budget(root, target_value, timeout=None, max_nodes=None,
+                      deadline=None, build_tree=False, stats=None,
+                      **kwargs):
+    """Search a solution within a time or node budget.
+
+    Parameters
+    ----------
+    root : Node
+        The node where the search starts.
+    target_value : int
+        The value we want to reach.
+    timeout, max_nodes, deadline
+        The budget (see `SearchBudget`). If all are None the search is not
+        limited.
+    build_tree : bool
+        If True, the tree is created with `Node.create_children` and
+        searched with `find_solution_node_in_tree`. Otherwise the lazy
+        search of `iter_solution_nodes` is used.
+    stats : stats.SearchStats, optional
+        Passed to the lazy search and included in the result.
+    kwargs
+        Other arguments of `find_solution_node` (such as `deduplicate`, or
+        `pruner`), only used by the lazy search.
+
+    The budget can also be passed to `iter_solution_nodes`,
+    `find_solution_node`, `iter_shortest_solution_nodes`,
+    `find_shortest_solution_node` and `iter_all_solutions`. The other
+    solvers (`compiled.CompiledLevel`, `heuristic`, `bidirectional`,
+    `vectorized`, `parallel` and `find_solution_nodes`) don't support a
+    budget yet.
+
+    Returns
+    -------
+    SearchResult
+        If the budget expires, the result has the node closest to the
+        target. When the tree was being built, it is removed from `root`
+        (the closest node is created again from `root`), so no partial tree
+        is kept in memory.
+    """
+    start = time.perf_counter()
+    budget = SearchBudget(timeout, max_nodes, target_value, deadline)
+    n = None
+    if build_tree:
+        try:
+            budget.charge(root)
+            root.create_children(budget)
+            n = find_solution_node_in_tree(root, target_value)
+        except SearchTimeout:
+            indices = _operation_indices(budget.closest_node, root)
+            _clear_tree(root)
+            budget.closest_node = replay_operation_indices(root, indices)
+    else:
+        n = find_solution_node(root, target_value, stats=stats,
+                               budget=budget, **kwargs)
+
+    if n is not None:
+        status = SearchResult.SOLVED
+    elif budget.expired:
+        status = SearchResult.TIMED_OUT
+    else:
+        status = SearchResult.UNSOLVABLE
+    return SearchResult(status, n, budget.closest_node, budget.num_nodes,
+                        time.perf_counter() - start, stats)
 
 
 def find_solution_node_in_tree(current_node, target_value):
@@ -147,16 +523,448 @@ def find_solution_node_in_tree(current_node, target_value):
     return None
 
 
+# Pairs of buttons whose consecutive presses can be swapped without changing
+# the result or the validity of the moves
+_COMMUTING_TYPES = {(op.SumX, op.SumX), (op.MultiplyX, op.MultiplyX),
+                    (op.DivideX, op.DivideX)}
+
+# Buttons `f` with `f(-x) == -f(x)`, which commute with `op.InvertSign`. None
+# of them turns a non zero value into zero, so the validity of the moves
+# (an inversion of zero is useless) does not depend on the order.
+_ODD_TYPES = {op.InvertSign, op.MultiplyX, op.DivideX, op.Reverse, op.Mirror,
+              op.CircularShiftRight, op.CircularShiftLeft, op.ShiftLeft,
+              op.SumDigits, op.Inv10EachDigit, op.AddDigits}
+
+
+def _commute(a, b, modifiable):
+    """True if pressing `a` and `b` in any order is equivalent"""
+    for operation in (a, b):
+        # Multiplying by zero turns the next move into a useless one, and
+        # a modifier can make the value zero
+        if isinstance(operation, op.MultiplyX) and (
+                modifiable or operation._value == 0):
+            return False
+    pair = (type(a), type(b))
+    if pair in _COMMUTING_TYPES:
+        return True
+    if op.InvertSign in pair:
+        return pair[0] in _ODD_TYPES and pair[1] in _ODD_TYPES
+    return False
+
+
+def commutation_table(operations, warp=None):
+    """Operations worth pressing after each operation.
+
+    Two consecutive presses of buttons that commute (such as two `op.SumX`)
+    give the same state in either order, so only the order with
+    non-decreasing operation indices needs to be searched. The first
+    solution in the depth first order is never removed, since swapping a
+    decreasing pair gives an equivalent solution that comes before it.
+
+    Buttons that commute but are involutions (such as two presses of
+    `op.InvertSign`) are kept, since the game requires using all the moves
+    and such a pair is a way to spend two of them. With warp portals
+    nothing commutes, since the warp is applied after each move.
+
+    Returns
+    -------
+    list[tuple[int]]
+        For each operation index `i`, the indices of the operations that
+        are tried after pressing operation `i`.
+    """
+    all_indices = tuple(range(len(operations)))
+    if warp is not None:
+        return [all_indices] * len(operations)
+    modifiable = any(isinstance(i, op.ModifyButtons_AddValue)
+                     for i in operations)
+    return [tuple(j for j in all_indices
+                  if j >= i or not _commute(a, operations[j], modifiable))
+            for i, a in enumerate(operations)]
+
+
+def iter_solution_nodes(root, target_value, dead_states=None,
+                        min_remaining_moves=0, pruner=None, stats=None,
+                        canonical_order=False, budget=None):
+    """Search the tree below `root` depth first, expanding it on demand.
+
+    The nodes are visited in the same order as in
+    `find_solution_node_in_tree`, but only the nodes in the path from `root`
+    to the current node are kept alive. The tree is never stored in the
+    nodes, so `root.create_children` does not need to be called.
+
+    Parameters
+    ----------
+    root : Node
+        The node where the search starts.
+    target_value : int
+        The value we want to reach.
+    dead_states : set, optional
+        If provided, it is used as a transposition table. The `state_key` of
+        every node whose subtree was fully explored without finding a
+        solution is added to it and nodes with a state already in it are not
+        expanded again. Since a solution must use exactly the remaining
+        moves, the number of remaining moves is part of the key. The set is
+        only valid for the same `target_value` and can be reused between
+        searches for it (and the same `min_remaining_moves`).
+    min_remaining_moves : int
+        Nodes with this number of remaining moves are the leaves of the
+        search, so solutions use `root.num_remaining_moves -
+        min_remaining_moves` moves.
+    pruner : pruning.Pruner, optional
+        If provided, its `prune` method is called before expanding each node
+        and the node is skipped if it returns True.
+    stats : stats.SearchStats, optional
+        If provided, the children of each node are created with its
+        `iter_children` method, which collects statistics of the search.
+    canonical_order : bool
+        If True, consecutive presses of buttons that commute are only
+        searched in one order (see `commutation_table`). This does not
+        change the first solution found.
+    budget : SearchBudget, optional
+        If provided, each node is charged to it and the search stops when it
+        expires (check `budget.expired` to know if the search is complete).
+
+    Yields
+    ------
+    Node
+        Each solution node (`min_remaining_moves` remaining moves and value
+        equal to `target_value`) as soon as it is found.
+    """
+    table = None
+    if canonical_order:
+        table = commutation_table(root._available_ops, root._warp)
+    # Each frame holds the node being expanded, its children iterator, its
+    # state key and whether a solution was found below it
+    stack = [[None, iter([root]), None, False]]
+    if stats is not None:
+        stats.nodes_per_depth[0] += 1
+    while stack:
+        frame = stack[-1]
+        node = next(frame[1], None)
+        if node is None:
+            stack.pop()
+            if dead_states is not None and frame[2] is not None \
+                    and not frame[3]:
+                dead_states.add(frame[2])
+            continue
+
+        if budget is not None and budget.charge(node):
+            return
+
+        if node.num_remaining_moves == min_remaining_moves:
+            if node.value == target_value:
+                for i in stack:
+                    i[3] = True
+                yield node
+            continue
+
+        if pruner is not None and pruner.prune(
+                node, node.num_remaining_moves - min_remaining_moves):
+            if stats is not None:
+                stats.pruned += 1
+            continue
+
+        op_indices = None
+        if table is not None and node._parent is not None:
+            op_indices = table[node.current_op_index]
+
+        key = None
+        if dead_states is not None:
+            # The operations tried are part of the state, since a state
+            # can be dead only because of the operations that were skipped
+            key = node.state_key() if table is None else \
+                (node.state_key(), op_indices)
+            if key in dead_states:
+                if stats is not None:
+                    stats.dedup_hits += 1
+                continue
+
+        if stats is None:
+            children = node.iter_children(op_indices)
+        else:
+            # The node is in the last frame and its depth is the number of
+            # frames below it (the first frame only holds the root)
+            children = stats.iter_children(node, len(stack) - 1, op_indices)
+        stack.append([node, children, key, False])
+
+
+def find_solution_node(root, target_value, deduplicate=False, pruner=None,
+                       stats=None, canonical_order=False, budget=None,
+                       atlas=None):
+    """Return the first solution node found by `iter_solution_nodes`.
+
+    This is the same node `find_solution_node_in_tree` would return after
+    `root.create_children()`, but the search stops at the first solution and
+    memory usage is bounded by the number of moves instead of the tree size.
+
+    If `deduplicate` is True, states already proven to not reach the target
+    are not expanded again (see `iter_solution_nodes`). The `pruner`,
+    `stats`, `canonical_order` and `budget` are also passed to
+    `iter_solution_nodes`.
+
+    `atlas` is an optional callable `atlas(root, target_value)` returning
+    `(answered, node)`, like `atlas.find_solution_node_in_atlas` with its
+    directory given. It is only asked when no `pruner`, `stats` or `budget`
+    are given and `canonical_order` is False, since it can't apply them, and
+    the search only runs when it does not answer.
+    """
+    if atlas is not None and pruner is None and stats is None and \
+            budget is None and not canonical_order:
+        answered, n = atlas(root, target_value)
+        if answered:
+            return n
+    dead_states = set() if deduplicate else None
+    return next(iter_solution_nodes(root, target_value, dead_states,
+                                    pruner=pruner, stats=stats,
+                                    canonical_order=canonical_order,
+                                    budget=budget), None)
+
+
+def iter_shortest_solution_nodes(root, target_value, max_moves=None,
+                                 deduplicate=False, pruner=None, stats=None,
+                                 canonical_order=False, budget=None):
+    """Search solutions using iterative deepening.
+
+    Unlike `find_solution_node`, a solution does not need to use all the
+    moves. The solutions using 0 moves are searched first, then the ones
+    using 1 move and so on, until `max_moves`. Each depth is searched with
+    `iter_solution_nodes`, so memory usage is bounded by the number of moves
+    and the deeper levels of the tree are never expanded when the target is
+    reached earlier.
+
+    Parameters
+    ----------
+    root : Node
+        The node where the search starts.
+    target_value : int
+        The value we want to reach.
+    max_moves : int, optional
+        Maximum number of moves. Default is `root.num_remaining_moves`.
+    deduplicate : bool
+        If True, states already proven to not reach the target with the
+        moves of the current depth are not expanded again.
+    pruner : pruning.Pruner, optional
+        Passed to `iter_solution_nodes`.
+    stats : stats.SearchStats, optional
+        Passed to `iter_solution_nodes`. The statistics of every depth are
+        added to it.
+    canonical_order : bool
+        Passed to `iter_solution_nodes`.
+    budget : SearchBudget, optional
+        Shared by the searches of every depth, which stop when it expires.
+
+    Yields
+    ------
+    Node
+        Each solution node, with the ones using fewer moves first.
+    """
+    if max_moves is None:
+        max_moves = root.num_remaining_moves
+    max_moves = min(max_moves, root.num_remaining_moves)
+    for num_moves in range(max_moves + 1):
+        if budget is not None and budget.expired:
+            return
+        dead_states = set() if deduplicate else None
+        yield from iter_solution_nodes(
+            root, target_value, dead_states,
+            min_remaining_moves=root.num_remaining_moves - num_moves,
+            pruner=pruner, stats=stats, canonical_order=canonical_order,
+            budget=budget)
+
+
+def find_shortest_solution_node(root, target_value, max_moves=None,
+                                deduplicate=False, pruner=None, stats=None,
+                                canonical_order=False, budget=None):
+    """Return a solution node using the fewest moves, or None.
+
+    Among the solutions with the fewest moves, this is the first one in the
+    order of `find_solution_node`. See `iter_shortest_solution_nodes`.
+    """
+    return next(iter_shortest_solution_nodes(root, target_value, max_moves,
+                                             deduplicate, pruner, stats,
+                                             canonical_order, budget), None)
+
+
+def iter_all_solutions(root, target_value, max_moves=None, budget=None):
+    """Every distinct sequence of buttons reaching `target_value`.
+
+    The sequences use at most `max_moves` moves (default is
+    `root.num_remaining_moves`) and are yielded as soon as they are found,
+    with the shorter ones first. Different buttons with the same name (for
+    instance two "sum with 2" buttons) give the same sequence, which is only
+    yielded once. The search stops when the `budget` (a `SearchBudget`),
+    if any, expires.
+
+    Yields
+    ------
+    list[str]
+        The names of the operations of each solution (see
+        `parse_operations_until_node`).
+    """
+    seen = set()
+    for node in iter_shortest_solution_nodes(root, target_value, max_moves,
+                                             budget=budget):
+        solution = parse_operations_until_node(node)
+        key = tuple(solution)
+        if key not in seen:
+            seen.add(key)
+            yield solution
+
+
+def find_solution_nodes(root, target_values, deduplicate=False):
+    """First solution node of each value in `target_values`, from a single
+    search.
+
+    The tree is searched depth first (as in `iter_solution_nodes`) until
+    every target is found, and the node returned for each target is the one
+    `find_solution_node` would return.
+
+    If `deduplicate` is True, nodes whose state was already fully explored
+    are not expanded again: every target reachable from that state was found
+    the first time.
+
+    Returns
+    -------
+    dict[int, Node]
+        The solution node of each target value (None if there is no
+        solution).
+    """
+    solutions = dict.fromkeys(target_values)
+    missing = set(solutions)
+    explored = set() if deduplicate else None
+    # Each frame holds the children iterator of a node and its state key
+    stack = [(iter([root]), None)]
+    while stack and missing:
+        children, key = stack[-1]
+        node = next(children, None)
+        if node is None:
+            stack.pop()
+            if key is not None:
+                explored.add(key)
+            continue
+
+        if node.num_remaining_moves == 0:
+            if node.value in missing:
+                missing.remove(node.value)
+                solutions[node.value] = node
+            continue
+
+        key = None
+        if explored is not None:
+            key = node.state_key()
+            if key in explored:
+                continue
+        stack.append((node.iter_children(), key))
+    return solutions
+
+
+def find_solution_nodes_for_starts(root, start_values, target_value):
+    """First solution node from each value in `start_values`.
+
+    Each start value is searched as `find_solution_node` would, using the
+    buttons, moves, memory and warp of `root`, but the searches share what
+    they learn: the states proven to not reach the target are not expanded
+    again and, for the states known to reach it, the first solution below
+    them is remembered, so another search reaching one of them is finished.
+
+    Returns
+    -------
+    dict[int, Node]
+        The solution node of each start value (None if there is no
+        solution). The root of each solution is a new node with the start
+        value.
+    """
+    dead_states = set()
+    # Operation indices from each state known to reach the target to the
+    # first solution below it. The order of the buttons is part of the key,
+    # since it decides which solution is the first one.
+    solved_states = {}
+    solutions = {}
+    for start_value in start_values:
+        if start_value in solutions:
+            continue
+        start = Node(value=start_value, current_op=None,
+                     available_ops=root._available_ops,
+                     num_remaining_moves=root.num_remaining_moves,
+                     memory=root._memory, warp=root._warp,
+                     parameters=root._parameters, order=root._order)
+        solutions[start_value] = _find_solution_node_shared(
+            start, target_value, dead_states, solved_states)
+    return solutions
+
+
+def _find_solution_node_shared(root, target_value, dead_states,
+                               solved_states):
+    """Search of `find_solution_nodes_for_starts` from one start"""
+    # Each frame holds the node being expanded, its children iterator and
+    # its state key
+    stack = [(None, iter([root]), None)]
+    while stack:
+        node = next(stack[-1][1], None)
+        if node is None:
+            frame = stack.pop()
+            if frame[2] is not None:
+                dead_states.add(frame[2])
+            continue
+
+        solution = None
+        if node.num_remaining_moves == 0:
+            if node.value == target_value:
+                solution = node
+        else:
+            key = node.state_key()
+            if key in dead_states:
+                continue
+            solved_key = (key, node._order)
+            if solved_key in solved_states:
+                solution = replay_operation_indices(node,
+                                                    solved_states[solved_key])
+            else:
+                stack.append((node, node.iter_children(), key))
+                continue
+
+        if solution is not None:
+            indices = _operation_indices(solution, root)
+            for depth, frame in enumerate(stack[1:]):
+                solved_states[(frame[2], frame[0]._order)] = indices[depth:]
+            return solution
+    return None
+
+
 def parse_operations_until_node(node):
     operations = []
 
     while node is not None and node.current_op is not None:
-        operations.append(node.current_op.name)
+        operations.append(node.current_op_name)
         node = node.parent
 
     return list(reversed(operations))
 
 
+def replay_operation_indices(root, indices):
+    """Apply a sequence of operations starting at `root`.
+
+    Parameters
+    ----------
+    root : Node
+        The node where the sequence starts.
+    indices : list[int]
+        For each move, the index of the operation in the `_available_ops` of
+        the current node.
+
+    Returns
+    -------
+    Node
+        The node obtained after the last operation. Its parents are the
+        intermediate nodes, so `parse_operations_until_node` can be used.
+    """
+    node = root
+    for i in indices:
+        node = Node.apply_operation_and_create_child(
+            node, node._available_ops[i], i)
+    return node
+
+
 def apply_operations(value_and_ops, operations):
     """
     Apply each opeation to the value in the first element in value_and_ops and
@@ -278,6 +1086,363 @@ class TestSolver(unittest.TestCase):
                               warp)
         self.assertEqual(solution, ['Add digit 1', 'Add digit 1', 'sum with -1'])
 
+    def test_modifier_first(self):
+        # A modifier moves after the other buttons when it is pressed, so
+        # the solutions pressing it once come first
+        start_value = 27
+        target_value = 27
+        num_moves = 3
+
+        operations = [op.InvertSign(), op.DivideX(-2), op.MultiplyX(-2)]
+        operations.insert(0, op.ModifyButtons_AddValue(operations, -1))
+        solution = self.solve(start_value, target_value, num_moves, operations)
+        self.assertEqual(solution, ['[+]-1', '+-', '+-'])
+
+    def test_divide_by_zero(self):
+        # Dividing by zero is an invalid move, like any other
+        start_value = 2
+        target_value = 3
+        num_moves = 1
+
+        operations = [op.DivideX(0), op.SumX(1)]
+        solution = self.solve(start_value, target_value, num_moves, operations)
+        self.assertEqual(solution, ['sum with 1'])
+
+
+class TestLazySolver(TestSolver):
+    @staticmethod
+    def solve(start_value, target_value, num_moves, operations, warp=None):
+        root = Node(value=start_value, current_op=None,
+                    available_ops=operations, num_remaining_moves=num_moves,
+                    warp=warp)
+        n = find_solution_node(root, target_value)
+        solution = parse_operations_until_node(n)
+        return solution
+
+    def test_tree_is_not_built(self):
+        root = Node(value=1, current_op=None,
+                    available_ops=[op.SumX(1), op.MultiplyX(2)],
+                    num_remaining_moves=4)
+        n = find_solution_node(root, 6)
+        self.assertEqual(parse_operations_until_node(n),
+                         ['sum with 1', 'multiply by 2', 'sum with 1',
+                          'sum with 1'])
+        self.assertEqual(root._children, [])
+
+    def test_all_solutions(self):
+        root = Node(value=1, current_op=None,
+                    available_ops=[op.SumX(1), op.MultiplyX(2)],
+                    num_remaining_moves=2)
+        solutions = [parse_operations_until_node(n)
+                     for n in iter_solution_nodes(root, 4)]
+        self.assertEqual(solutions,
+                         [['sum with 1', 'multiply by 2'],
+                          ['multiply by 2', 'multiply by 2']])
+
+
+class TestDeduplicatedSolver(TestSolver):
+    @staticmethod
+    def solve(start_value, target_value, num_moves, operations, warp=None):
+        root = Node(value=start_value, current_op=None,
+                    available_ops=operations, num_remaining_moves=num_moves,
+                    warp=warp)
+        n = find_solution_node(root, target_value, deduplicate=True)
+        solution = parse_operations_until_node(n)
+        return solution
+
+    def test_state_key(self):
+        operations = [op.SumX(2), op.SumX(8)]
+        root = Node(value=1, current_op=None, available_ops=operations,
+                    num_remaining_moves=3)
+        a = Node.apply_operation_and_create_child(root, operations[0])
+        a = Node.apply_operation_and_create_child(a, operations[1])
+        b = Node.apply_operation_and_create_child(root, operations[1])
+        b = Node.apply_operation_and_create_child(b, operations[0])
+        self.assertEqual(a.state_key(), b.state_key())
+
+        # Modified buttons are part of the state
+        mb = op.ModifyButtons_AddValue(operations, 1)
+        root = Node(value=1, current_op=None,
+                    available_ops=operations + [mb], num_remaining_moves=3)
+        c = Node.apply_operation_and_create_child(root, mb)
+        self.assertEqual(c.state_key()[3], (3, 9, None))
+        self.assertNotEqual(c.state_key()[3], root.state_key()[3])
+
+    def test_same_solutions(self):
+        operations = [op.SumX(2), op.SumX(8), op.Reverse(), op.MultiplyX(3)]
+        root = Node(value=1, current_op=None, available_ops=operations,
+                    num_remaining_moves=5)
+        expected = [parse_operations_until_node(n)
+                    for n in iter_solution_nodes(root, 93)]
+        dead_states = set()
+        solutions = [parse_operations_until_node(n)
+                     for n in iter_solution_nodes(root, 93, dead_states)]
+        self.assertEqual(solutions, expected)
+        self.assertNotEqual(dead_states, set())
+
+
+class TestCanonicalOrderSolver(TestSolver):
+    @staticmethod
+    def solve(start_value, target_value, num_moves, operations, warp=None):
+        root = Node(value=start_value, current_op=None,
+                    available_ops=operations, num_remaining_moves=num_moves,
+                    warp=warp)
+        n = find_solution_node(root, target_value, canonical_order=True)
+        return parse_operations_until_node(n)
+
+    def test_commutation_table(self):
+        operations = [op.SumX(2), op.MultiplyX(3), op.SumX(-1),
+                      op.InvertSign(), op.Reverse(), op.MultiplyX(2)]
+        self.assertEqual(commutation_table(operations),
+                         [(0, 1, 2, 3, 4, 5),
+                          (0, 1, 2, 3, 4, 5),
+                          (1, 2, 3, 4, 5),
+                          (0, 2, 3, 4, 5),
+                          (0, 1, 2, 4, 5),
+                          (0, 2, 4, 5)])
+        self.assertEqual(commutation_table(operations, op.WarpAction(3, 0)),
+                         [(0, 1, 2, 3, 4, 5)] * 6)
+
+        # Multiplying by zero (which a modifier can cause) does not commute
+        operations = [op.MultiplyX(0), op.MultiplyX(2), op.InvertSign()]
+        self.assertEqual(commutation_table(operations)[1], (0, 1, 2))
+        self.assertEqual(commutation_table(operations)[2], (0, 2))
+        operations = [op.MultiplyX(3), op.MultiplyX(2), op.SumX(1),
+                      op.SumX(2)]
+        operations.append(op.ModifyButtons_AddValue(operations, -1))
+        self.assertEqual(commutation_table(operations)[1], (0, 1, 2, 3, 4))
+        self.assertEqual(commutation_table(operations)[3], (0, 1, 3, 4))
+
+    def test_same_first_solution(self):
+        levels = [
+            [op.SumX(2), op.SumX(-3), op.MultiplyX(2), op.MultiplyX(-1),
+             op.InvertSign()],
+            [op.MultiplyX(0), op.MultiplyX(3), op.InvertSign(),
+             op.DivideX(2), op.DivideX(3), op.Reverse()],
+            [op.SumX(3), op.SumX(1), op.InvertSign(), op.InvertSign(),
+             op.StorageAction(), op.RetrieveAction()],
+        ]
+        levels.append([op.MultiplyX(2), op.SumX(1), op.DivideX(2)])
+        levels[-1].append(op.ModifyButtons_AddValue(levels[-1], 1))
+        for operations in levels:
+            root = Node(value=3, current_op=None, available_ops=operations,
+                        num_remaining_moves=4)
+            for target_value in range(-60, 60):
+                expected = find_solution_node(root, target_value)
+                for deduplicate in (False, True):
+                    n = find_solution_node(root, target_value, deduplicate,
+                                           canonical_order=True)
+                    self.assertEqual(parse_operations_until_node(n),
+                                     parse_operations_until_node(expected))
+
+    def test_fewer_nodes(self):
+        operations = [op.SumX(1), op.SumX(2), op.SumX(3), op.InvertSign(),
+                      op.MultiplyX(2)]
+        root = Node(value=1, current_op=None, available_ops=operations,
+                    num_remaining_moves=7)
+
+        class Counter:
+            # Pruner that only counts the expanded nodes
+            def __init__(self):
+                self.num_nodes = 0
+
+            def prune(self, node, num_moves):  # pylint: disable=W0613
+                self.num_nodes += 1
+                return False
+
+        def count_nodes(canonical_order):
+            counter = Counter()
+            find_solution_node(root, 10**9, pruner=counter,
+                               canonical_order=canonical_order)
+            return counter.num_nodes
+        self.assertLess(count_nodes(True), count_nodes(False) / 2)
+
+
+class TestShortestSolver(unittest.TestCase):
+    def test_shortest(self):
+        operations = [op.SumX(1), op.MultiplyX(2)]
+        root = Node(value=1, current_op=None, available_ops=operations,
+                    num_remaining_moves=20)
+        n = find_shortest_solution_node(root, 8)
+        self.assertEqual(parse_operations_until_node(n),
+                         ['sum with 1', 'multiply by 2', 'multiply by 2'])
+        n = find_shortest_solution_node(root, 8, deduplicate=True)
+        self.assertEqual(n.num_remaining_moves, 17)
+        self.assertIs(find_shortest_solution_node(root, 1), root)
+        self.assertIsNone(find_shortest_solution_node(root, 8, max_moves=2))
+        # The other searches need exactly 20 moves
+        self.assertIsNone(find_solution_node(Node(
+            value=1, current_op=None, available_ops=[op.MultiplyX(2)],
+            num_remaining_moves=20), 8))
+
+    def test_free_storage(self):
+        # The store button does not use a move
+        operations = [op.StorageAction(), op.RetrieveAction()]
+        root = Node(value=1, current_op=None, available_ops=operations,
+                    num_remaining_moves=5)
+        n = find_shortest_solution_node(root, 11)
+        self.assertEqual(parse_operations_until_node(n),
+                         ['Store', 'Retrieve'])
+        self.assertEqual(n.num_remaining_moves, 4)
+
+    def test_all_solutions(self):
+        operations = [op.SumX(2), op.SumX(2), op.MultiplyX(2)]
+        root = Node(value=1, current_op=None, available_ops=operations,
+                    num_remaining_moves=3)
+        solutions = list(iter_all_solutions(root, 6))
+        self.assertEqual(solutions, [
+            ['sum with 2', 'multiply by 2'],
+            ['multiply by 2', 'sum with 2', 'sum with 2'],
+            ['multiply by 2', 'multiply by 2', 'sum with 2']])
+        self.assertEqual(list(iter_all_solutions(root, 6, max_moves=2)),
+                         solutions[:1])
+
+
+class TestBudgetSolver(TestSolver):
+    @staticmethod
+    def solve(start_value, target_value, num_moves, operations, warp=None):
+        root = Node(value=start_value, current_op=None,
+                    available_ops=operations, num_remaining_moves=num_moves,
+                    warp=warp)
+        result = solve_with_budget(root, target_value, timeout=60)
+        return result.solution
+
+
+class TestBudget(unittest.TestCase):
+    @staticmethod
+    def create_root(num_moves):
+        operations = [op.SumX(2), op.SumX(8), op.MultiplyX(10)]
+        return Node(value=1, current_op=None, available_ops=operations,
+                    num_remaining_moves=num_moves)
+
+    def test_solved_and_unsolvable(self):
+        for build_tree in (False, True):
+            root = self.create_root(3)
+            result = solve_with_budget(root, 7, max_nodes=1000,
+                                       build_tree=build_tree)
+            self.assertEqual(result.status, SearchResult.SOLVED)
+            self.assertEqual(result.solution, parse_operations_until_node(
+                find_solution_node(self.create_root(3), 7)))
+            self.assertEqual(result.closest_value, 7)
+
+            result = solve_with_budget(self.create_root(3), 4, max_nodes=1000,
+                                       build_tree=build_tree)
+            self.assertEqual(result.status, SearchResult.UNSOLVABLE)
+            self.assertIsNone(result.solution)
+            self.assertEqual(result.closest_value, 3)
+            self.assertEqual(result.closest_solution, ["sum with 2"])
+
+    def test_timed_out(self):
+        for build_tree in (False, True):
+            root = self.create_root(12)
+            result = solve_with_budget(root, 5555, max_nodes=500,
+                                       build_tree=build_tree)
+            self.assertEqual(result.status, SearchResult.TIMED_OUT)
+            self.assertIsNone(result.solution)
+            self.assertEqual(result.num_nodes, 501)
+            self.assertEqual(result.closest_value, 3900)
+            self.assertEqual(result.closest_solution[-2:],
+                             ["multiply by 10", "multiply by 10"])
+            # The partial tree is not kept
+            self.assertEqual(root._children, [])
+
+            result = solve_with_budget(self.create_root(12), 5555,
+                                       timeout=0, build_tree=build_tree)
+            self.assertEqual(result.status, SearchResult.TIMED_OUT)
+            self.assertLessEqual(result.num_nodes, SearchBudget.CHECK_INTERVAL)
+
+    def test_shortest_budget(self):
+        root = Node(value=1, current_op=None,
+                    available_ops=[op.SumX(1), op.MultiplyX(2)],
+                    num_remaining_moves=12)
+        budget = SearchBudget(max_nodes=100)
+        self.assertIsNone(find_shortest_solution_node(root, -1,
+                                                      budget=budget))
+        self.assertTrue(budget.expired)
+        self.assertEqual(budget.num_nodes, 101)
+
+        expected = list(iter_all_solutions(root, 4, max_moves=3))
+        self.assertEqual(len(expected), 4)
+        budget = SearchBudget(max_nodes=10**4)
+        self.assertEqual(list(iter_all_solutions(root, 4, 3, budget)),
+                         expected)
+        self.assertFalse(budget.expired)
+        # The depths with up to 2 moves use 11 nodes, so the solutions using
+        # 2 moves are found before the budget expires
+        budget = SearchBudget(max_nodes=14)
+        self.assertEqual(list(iter_all_solutions(root, 4, 3, budget)),
+                         expected[:2])
+        self.assertTrue(budget.expired)
+
+    def test_budget(self):
+        budget = SearchBudget(max_nodes=2, target_value=10)
+        root = self.create_root(2)
+        children = list(root.iter_children())
+        self.assertFalse(budget.charge(children[0]))
+        self.assertFalse(budget.charge(children[1]))
+        self.assertIs(budget.closest_node, children[1])
+        self.assertTrue(budget.charge(children[2]))
+        self.assertTrue(budget.expired)
+        self.assertIs(budget.closest_node, children[2])
+
+        budget = SearchBudget(timeout=60, deadline=0)
+        self.assertEqual(budget.deadline, 0)
+
+
+class TestMultipleQueries(unittest.TestCase):
+    LEVELS = [
+        (1, 4, [op.SumX(2), op.MultiplyX(3), op.Reverse(),
+                op.StorageAction(), op.RetrieveAction()], None),
+        (5, 4, [op.MultiplyX(3), op.SumX(4), op.SumX(8)], "modifier"),
+        (99, 3, [op.AddDigits(1), op.SumX(-1)], op.WarpAction(2, 0)),
+    ]
+
+    def iter_roots(self):
+        for start_value, num_moves, operations, warp in self.LEVELS:
+            if warp == "modifier":
+                operations = operations + [
+                    op.ModifyButtons_AddValue(operations, 2)]
+                warp = None
+            yield Node(value=start_value, current_op=None,
+                       available_ops=operations,
+                       num_remaining_moves=num_moves, warp=warp)
+
+    def test_targets(self):
+        targets = list(range(-10, 200)) + [1111]
+        for root in self.iter_roots():
+            expected = {i: parse_operations_until_node(
+                find_solution_node(root, i)) for i in targets}
+            for deduplicate in (False, True):
+                solutions = find_solution_nodes(root, targets, deduplicate)
+                self.assertEqual(list(solutions), targets)
+                self.assertEqual({i: parse_operations_until_node(n)
+                                  for i, n in solutions.items()}, expected)
+                for target_value, n in solutions.items():
+                    if n is not None:
+                        self.assertEqual(n.value, target_value)
+
+    def test_starts(self):
+        starts = list(range(-20, 120)) + [5, 5]
+        for root in self.iter_roots():
+            for target_value in (41, 100, 3):
+                solutions = find_solution_nodes_for_starts(
+                    root, starts, target_value)
+                self.assertEqual(set(solutions), set(starts))
+                for start_value in starts:
+                    start = Node(value=start_value, current_op=None,
+                                 available_ops=root._available_ops,
+                                 num_remaining_moves=root.num_remaining_moves,
+                                 warp=root._warp)
+                    n = solutions[start_value]
+                    self.assertEqual(
+                        parse_operations_until_node(n),
+                        parse_operations_until_node(
+                            find_solution_node(start, target_value)),
+                        (start_value, target_value))
+                    if n is not None:
+                        self.assertEqual(n.value, target_value)
+                        self.assertEqual(n.num_remaining_moves, 0)
+
 
 if __name__ == '__main__1':
     unittest.main()
@@ -335,8 +1500,7 @@ if __name__ == '__main__':
     # There is no need to change anything below
     root = Node(value=start_value, current_op=None, available_ops=operations,
                 num_remaining_moves=num_moves, warp=warp)
-    root.create_children()
 
-    n = find_solution_node_in_tree(root, target_value)
+    n = find_solution_node(root, target_value)
     operations = parse_operations_until_node(n)
     print(operations)
@@ -0,0 +1,178 @@
+"""Statistics collected during a search.
+
+A `SearchStats` object is passed to `solver.iter_solution_nodes` (and the
+functions using it). When it is given the children of each node are created
+by `SearchStats.iter_children`, which counts and times every button; when it
+is not given the search uses `solver.Node.iter_children` directly, so the
+statistics cost nothing.
+"""
+
+# pylint: disable=C0111
+# pylint: disable=W0212
+
+import collections
+import time
+import unittest
+import operations as op
+import solver
+
+
+class SearchStats:
+    """Counters of a search.
+
+    Attributes
+    ----------
+    nodes_per_depth : collections.Counter
+        Number of nodes created at each depth (number of buttons pressed
+        from the root of the search).
+    expanded : int
+        Number of nodes whose children were created.
+    rejections : collections.Counter
+        Number of children that were not created, keyed by the class name
+        of the button and the error message (for instance
+        `("Mirror", "Too large")`).
+    time_per_operation : collections.Counter
+        Time (in seconds) spent applying each class of button.
+    dedup_hits : int
+        Number of nodes skipped because their state was already proven dead.
+    pruned : int
+        Number of nodes removed by the pruner.
+
+    Parameters
+    ----------
+    callback : callable, optional
+        Called as `callback(node, depth)` before the children of each node
+        are created, so that profilers can attach to the search.
+    """
+    def __init__(self, callback=None):
+        self.callback = callback
+        self.nodes_per_depth = collections.Counter()
+        self.expanded = 0
+        self.rejections = collections.Counter()
+        self.time_per_operation = collections.Counter()
+        self.dedup_hits = 0
+        self.pruned = 0
+
+    @property
+    def num_nodes(self):
+        """Total number of nodes created"""
+        return sum(self.nodes_per_depth.values())
+
+    def iter_children(self, node, depth, op_indices=None):
+        """Same as `node.iter_children(op_indices)`, but counting and timing
+        each button.
+
+        Parameters
+        ----------
+        node : solver.Node
+            The node being expanded.
+        depth : int
+            The depth of the node.
+        op_indices : list[int], optional
+            The indices of the operations to try (default is all of them).
+        """
+        self.expanded += 1
+        if self.callback is not None:
+            self.callback(node, depth)
+        if node.num_remaining_moves <= 0:
+            return
+
+        operations = node._available_ops
+        for i in solver.Node.ordered_indices(node._order, len(operations),
+                                             op_indices):
+            operation = operations[i]
+            name = type(operation).__name__
+            start = time.perf_counter()
+            try:
+                child = solver.Node.apply_operation_and_create_child(
+                    node, operation, i)
+            except ValueError as e:
+                self.time_per_operation[name] += time.perf_counter() - start
+                # Messages of conversion errors include the value
+                self.rejections[(name, str(e).split(":")[0])] += 1
+                continue
+            self.time_per_operation[name] += time.perf_counter() - start
+            self.nodes_per_depth[depth + 1] += 1
+            yield child
+
+    def as_dict(self):
+        """JSON serializable description of the statistics"""
+        return {"nodes_per_depth": dict(sorted(self.nodes_per_depth.items())),
+                "expanded": self.expanded,
+                "rejections": {f"{name}: {message}": count for
+                               (name, message), count in
+                               self.rejections.most_common()},
+                "time_per_operation": dict(
+                    self.time_per_operation.most_common()),
+                "dedup_hits": self.dedup_hits,
+                "pruned": self.pruned}
+
+
+# xxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxx
+
+class TestSearchStats(solver.TestSolver):
+    @staticmethod
+    def solve(start_value, target_value, num_moves, operations, warp=None):
+        root = solver.Node(value=start_value, current_op=None,
+                           available_ops=operations,
+                           num_remaining_moves=num_moves, warp=warp)
+        stats = SearchStats()
+        n = solver.find_solution_node(root, target_value, stats=stats)
+        return solver.parse_operations_until_node(n)
+
+    def test_counters(self):
+        operations = [op.Mirror(), op.DivideX(2), op.SumX(0)]
+        root = solver.Node(value=1234, current_op=None,
+                           available_ops=operations, num_remaining_moves=2)
+        expanded = []
+        stats = SearchStats(lambda node, depth: expanded.append(
+            (node.value, depth)))
+        self.assertIsNone(solver.find_solution_node(root, -1, stats=stats))
+
+        # 1234 -> 617 -> 617716
+        self.assertEqual(stats.nodes_per_depth, {0: 1, 1: 1, 2: 1})
+        self.assertEqual(stats.num_nodes, 3)
+        self.assertEqual(expanded, [(1234, 0), (617, 1)])
+        self.assertEqual(stats.expanded, 2)
+        self.assertEqual(stats.rejections,
+                         {("Mirror", "Too large"): 1,
+                          ("DivideX", "Invalid int division"): 1,
+                          ("SumX", "Useless operation"): 2})
+        self.assertEqual(set(stats.time_per_operation),
+                         {"Mirror", "DivideX", "SumX"})
+        self.assertEqual(stats.as_dict()["rejections"]["SumX: Useless "
+                                                       "operation"], 2)
+
+        # The store button is free, so it is pressed at depth 1 with all the
+        # moves remaining
+        root = solver.Node(value=5, current_op=None,
+                           available_ops=[op.StorageAction(),
+                                          op.RetrieveAction()],
+                           num_remaining_moves=1)
+        stats = SearchStats()
+        solver.find_solution_node(root, -1, stats=stats)
+        self.assertEqual(stats.rejections, {
+            ("RetrieveAction", "invalid literal for int() with base 10"): 1,
+            ("StorageAction", "Can't store the same value"): 1})
+
+    def test_dedup_and_pruned(self):
+        operations = [op.SumX(2), op.SumX(8), op.MultiplyX(10)]
+        root = solver.Node(value=1, current_op=None, available_ops=operations,
+                           num_remaining_moves=5)
+        stats = SearchStats()
+        self.assertIsNone(solver.find_solution_node(
+            root, 1, deduplicate=True, stats=stats))
+        self.assertGreater(stats.dedup_hits, 0)
+
+        class Pruner:
+            @staticmethod
+            def prune(node, num_moves):
+                return node.value > 100
+
+        stats = SearchStats()
+        solver.find_solution_node(root, 1, pruner=Pruner(), stats=stats)
+        self.assertGreater(stats.pruned, 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
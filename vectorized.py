@@ -0,0 +1,591 @@
+"""Breadth first search keeping each depth of the search as NumPy arrays.
+
+Instead of applying one operation to one value at a time, every button is
+applied at once to all the distinct states reached with the same number of
+moves. A state is given by the value, the memory (for the storage buttons)
+and how many times each `op.ModifyButtons_AddValue` button was pressed.
+Invalid and useless moves are masked out instead of raising `ValueError`.
+"""
+
+# pylint: disable=C0111
+# pylint: disable=W0212
+
+import unittest
+import digits as dg
+import operations as op
+import solver
+from extbfs import IncompleteSearch
+
+try:
+    import numpy as np
+except ImportError:  # pragma: no cover
+    np = None
+
+# States whose value is larger than this (in absolute value) are discarded
+# (see `VectorizedSearch.num_overflows`). This keeps every intermediate
+# computation inside int64.
+MAX_ABS_VALUE = 10**15
+
+# Value given by the kernels to the moves whose result does not fit in int64
+_OVERFLOW = 2**63 - 1
+
+# Value used in the memory column when nothing was stored yet
+NO_MEMORY = -2**63
+
+if np is not None:
+    _POWERS_OF_TEN = np.array([10**i for i in range(19)], dtype=np.int64)
+
+
+def _num_digits(a):
+    """Number of digits of each (non negative) element of `a`"""
+    return np.searchsorted(_POWERS_OF_TEN[1:], a, side="right") + 1
+
+
+def _reverse_abs(a):
+    out = np.zeros_like(a)
+    a = a.copy()
+    while np.any(a):
+        nonzero = a > 0
+        out = np.where(nonzero, out * 10 + a % 10, out)
+        a //= 10
+    return out
+
+
+def _sum_digits_abs(a):
+    out = np.zeros_like(a)
+    a = a.copy()
+    while np.any(a):
+        out += a % 10
+        a //= 10
+    return out
+
+
+def _inv10_abs(a):
+    out = np.zeros_like(a)
+    factor = 1
+    a = a.copy()
+    while np.any(a):
+        digit = a % 10
+        out += np.where(digit == 0, 0, 10 - digit) * factor
+        factor *= 10
+        a //= 10
+    return out
+
+
+def _all_valid(a):
+    return np.ones(len(a), dtype=bool)
+
+
+def _np_negative_decorator(function):
+    """Vectorised version of `op.negative_decorator`.
+
+    `function` receives the absolute values and returns the new values and a
+    mask with the valid elements.
+    """
+    def wrapper(x, parameter):
+        out, valid = function(np.abs(x), parameter)
+        return np.where(x < 0, -out, out), valid
+    return wrapper
+
+
+@_np_negative_decorator
+def _reverse(a, _):
+    return _reverse_abs(a), _all_valid(a)
+
+
+@_np_negative_decorator
+def _mirror(a, _):
+    valid = a <= 999
+    a = np.where(valid, a, 0)
+    return a * _POWERS_OF_TEN[_num_digits(a)] + _reverse_abs(a), valid
+
+
+@_np_negative_decorator
+def _shift_left(a, _):
+    return a // 10, a >= 10
+
+
+@_np_negative_decorator
+def _circular_shift_right(a, _):
+    rest, last = np.divmod(a, 10)
+    return last * _POWERS_OF_TEN[_num_digits(a) - 1] + rest, _all_valid(a)
+
+
+@_np_negative_decorator
+def _circular_shift_left(a, _):
+    first, rest = np.divmod(a, _POWERS_OF_TEN[_num_digits(a) - 1])
+    return rest * 10 + first, _all_valid(a)
+
+
+@_np_negative_decorator
+def _sum_digits(a, _):
+    return _sum_digits_abs(a), _all_valid(a)
+
+
+@_np_negative_decorator
+def _inv10_each_digit(a, _):
+    return _inv10_abs(a), _all_valid(a)
+
+
+def _sum_x(x, parameter):
+    return x + parameter, _all_valid(x)
+
+
+def _multiply_x(x, parameter):
+    fits = np.abs(x) <= MAX_ABS_VALUE // np.maximum(np.abs(parameter), 1)
+    return np.where(fits, x * parameter, _OVERFLOW), _all_valid(x)
+
+
+def _divide_x(x, parameter):
+    valid = parameter != 0
+    parameter = np.where(valid, parameter, 1)
+    valid &= x % parameter == 0
+    return x // parameter, valid
+
+
+def _invert_sign(x, _):
+    return -x, _all_valid(x)
+
+
+def _add_digits(x, parameter):
+    """Add the digits in `parameter` (negative values are invalid)"""
+    valid = parameter >= 0
+    parameter = np.where(valid, parameter, 0)
+    factor = _POWERS_OF_TEN[_num_digits(parameter)]
+    fits = np.abs(x) <= MAX_ABS_VALUE // factor
+    x = np.where(fits, x, 0)
+    out = np.where(x < 0, x * factor - parameter, x * factor + parameter)
+    return np.where(fits, out, _OVERFLOW), valid
+
+
+def _python_kernel(operation):
+    """Kernel applying `operation` to each element in Python"""
+    def kernel(x, _):
+        out = np.zeros_like(x)
+        valid = np.zeros(len(x), dtype=bool)
+        for i, value in enumerate(x.tolist()):
+            try:
+                new_value = operation._apply_imp(value)
+            except ValueError:
+                continue
+            out[i] = new_value if abs(new_value) < _OVERFLOW else _OVERFLOW
+            valid[i] = True
+        return out, valid
+    return kernel
+
+
+_KERNELS = {
+    op.MultiplyX: _multiply_x,
+    op.DivideX: _divide_x,
+    op.SumX: _sum_x,
+    op.Reverse: _reverse,
+    op.Mirror: _mirror,
+    op.CircularShiftRight: _circular_shift_right,
+    op.CircularShiftLeft: _circular_shift_left,
+    op.ShiftLeft: _shift_left,
+    op.SumDigits: _sum_digits,
+    op.InvertSign: _invert_sign,
+    op.AddDigits: _add_digits,
+    op.Inv10EachDigit: _inv10_each_digit,
+}
+
+
+def _np_warp(x, enter_idx, exit_idx=0):
+    """Vectorised version of `dg.warp`.
+
+    Returns the warped values and a mask with the valid elements (negative
+    numbers with digits after the enter portal can't be warped).
+    """
+    if enter_idx == 0:
+        return x, _all_valid(x)
+    valid = (x >= 0) | (_num_digits(np.abs(x)) + 1 <= enter_idx)
+    enter_factor = 10**enter_idx
+    exit_factor = 10**exit_idx
+
+    out = x.copy()
+    active = np.flatnonzero(out >= enter_factor)
+    while len(active) > 0:
+        warped, non_warped = np.divmod(out[active], enter_factor)
+        new = non_warped + exit_factor * _sum_digits_abs(warped)
+        changed = new != out[active]
+        out[active] = new
+        active = active[changed & (new >= enter_factor)]
+    return out, valid
+
+
+class _Layer:
+    """States reached with the same number of moves.
+
+    Each state has a value, a memory and the number of times each modifier
+    button was pressed. `parent` is the global index of the state it came
+    from and `op_idx` the index (in the root operations) of the button used.
+    """
+    def __init__(self, values, memory, presses, parent, op_idx):
+        self.values = values
+        self.memory = memory
+        self.presses = presses
+        self.parent = parent
+        self.op_idx = op_idx
+
+    def __len__(self):
+        return len(self.values)
+
+    @staticmethod
+    def concatenate(layers):
+        return _Layer(*[np.concatenate([getattr(i, name) for i in layers])
+                        for name in ("values", "memory", "presses", "parent",
+                                     "op_idx")])
+
+    def take(self, indices):
+        return _Layer(self.values[indices], self.memory[indices],
+                      self.presses[indices], self.parent[indices],
+                      self.op_idx[indices])
+
+    def unique(self):
+        """Remove repeated states keeping the first occurrence of each"""
+        if self.presses.shape[1] == 0 and np.all(self.memory == NO_MEMORY):
+            # Without memory and modifiers the value is the whole state
+            _, first = np.unique(self.values, return_index=True)
+        else:
+            keys = np.column_stack([self.values, self.memory, self.presses])
+            _, first = np.unique(keys, axis=0, return_index=True)
+        return self.take(np.sort(first))
+
+
+class VectorizedSearch:
+    """Breadth first search of the level starting at `root`.
+
+    Parameters
+    ----------
+    root : solver.Node
+        The root node. Its tree does not need to be created.
+    max_abs_value : int
+        States with a larger value (in absolute value) are discarded.
+
+    Attributes
+    ----------
+    num_overflows : int
+        Number of moves discarded by `run` because their value is larger
+        than `max_abs_value`.
+    """
+    def __init__(self, root, max_abs_value=MAX_ABS_VALUE):
+        if np is None:
+            raise ImportError("The vectorized search requires numpy")
+        self._root = root
+        self._operations = list(root._available_ops)
+        self._max_abs_value = max_abs_value
+        self._warp = root._warp
+
+        self._modifiers = [
+            i for i, o in enumerate(self._operations)
+            if isinstance(o, op.ModifyButtons_AddValue)]
+        self._store = [i for i, o in enumerate(self._operations)
+                       if isinstance(o, op.StorageAction)]
+        # Value added to each button by one press of each modifier
+        self._modifier_values = np.zeros(
+            (len(self._modifiers), len(self._operations)), dtype=np.int64)
+        for k, i in enumerate(self._modifiers):
+            modifier = self._operations[i]
+            self._modifier_values[
+                k, modifier.modified_indices(self._operations)] = \
+                modifier._value
+
+        self._kernels = {}
+        for i, o in enumerate(self._operations):
+            if isinstance(o, op.RetrieveAction):
+                self._kernels[i] = _add_digits
+            elif type(o) in _KERNELS:
+                self._kernels[i] = _KERNELS[type(o)]
+            elif not isinstance(o, (op.StorageAction,
+                                    op.ModifyButtons_AddValue)):
+                self._kernels[i] = _python_kernel(o)
+
+        self._layers = []
+        self._offsets = []
+        self.num_overflows = 0
+
+    def _parameter(self, layer, i):
+        """Current value of button `i` in each state of `layer`"""
+        operation = self._operations[i]
+        if isinstance(operation, op.RetrieveAction):
+            return layer.memory
+        if not hasattr(operation, "increment_value_by"):
+            return None
+        return operation._value + layer.presses @ self._modifier_values[:, i]
+
+    def _finish_move(self, new_values, valid):
+        """Mask values out of range and apply the warp"""
+        in_range = np.abs(new_values) <= self._max_abs_value
+        self.num_overflows += int(np.count_nonzero(valid & ~in_range))
+        valid &= in_range
+        if self._warp is not None:
+            new_values, warp_valid = _np_warp(
+                np.where(valid, new_values, 0), self._warp._enter_idx,
+                self._warp._exit_idx)
+            valid &= warp_valid
+        return new_values, valid
+
+    def _expand(self, layer, offset):
+        """Apply every button (except the storage ones) to `layer`"""
+        children = []
+        global_idx = offset + np.arange(len(layer), dtype=np.int64)
+        for i in range(len(self._operations)):
+            x = layer.values
+            presses = layer.presses
+            if i in self._kernels:
+                new_values, valid = self._kernels[i](
+                    x, self._parameter(layer, i))
+                if not isinstance(self._operations[i], op.RetrieveAction):
+                    valid &= new_values != x
+            elif i in self._modifiers:
+                new_values, valid = x, _all_valid(x)
+                presses = presses.copy()
+                presses[:, self._modifiers.index(i)] += 1
+            else:
+                continue
+            new_values, valid = self._finish_move(new_values, valid)
+            children.append(_Layer(
+                new_values[valid], layer.memory[valid], presses[valid],
+                global_idx[valid],
+                np.full(np.count_nonzero(valid), i, dtype=np.int64)))
+        if not children:
+            return layer.take(np.arange(0))
+        return _Layer.concatenate(children).unique()
+
+    def _store_closure(self, layer, offset):
+        """Add the states obtained with the storage buttons (which don't
+        use a move) to `layer`"""
+        new = layer
+        new_offset = offset
+        while self._store and len(new) > 0:
+            global_idx = new_offset + np.arange(len(new), dtype=np.int64)
+            stored = []
+            for i in self._store:
+                new_values, valid = self._finish_move(
+                    new.values.copy(), new.values != new.memory)
+                stored.append(_Layer(
+                    new_values[valid], new.values[valid], new.presses[valid],
+                    global_idx[valid],
+                    np.full(np.count_nonzero(valid), i, dtype=np.int64)))
+            num_states = len(layer)
+            layer = _Layer.concatenate([layer] + stored).unique()
+            new_offset = offset + num_states
+            new = layer.take(np.arange(num_states, len(layer)))
+        return layer
+
+    def run(self, num_moves):
+        """Compute the states for each number of moves up to `num_moves`"""
+        root = self._root
+        memory = NO_MEMORY if root._memory is None else root._memory
+        layer = _Layer(
+            np.array([root.value], dtype=np.int64),
+            np.array([memory], dtype=np.int64),
+            np.zeros((1, len(self._modifiers)), dtype=np.int64),
+            np.array([-1], dtype=np.int64), np.array([-1], dtype=np.int64))
+
+        self._layers = []
+        self._offsets = []
+        self.num_overflows = 0
+        offset = 0
+        for depth in range(num_moves + 1):
+            if depth > 0:
+                layer = self._expand(layer, self._offsets[-1])
+            if depth < num_moves:
+                layer = self._store_closure(layer, offset)
+            self._layers.append(layer)
+            self._offsets.append(offset)
+            offset += len(layer)
+
+    @property
+    def num_states(self):
+        """Number of distinct states for each number of moves"""
+        return [len(i) for i in self._layers]
+
+    def _path(self, layer_idx, idx):
+        """Indices of the root operations used to reach a state"""
+        indices = []
+        while True:
+            layer = self._layers[layer_idx]
+            parent = int(layer.parent[idx])
+            if parent < 0:
+                break
+            indices.append(int(layer.op_idx[idx]))
+            while parent < self._offsets[layer_idx]:
+                layer_idx -= 1
+            idx = parent - self._offsets[layer_idx]
+        return list(reversed(indices))
+
+    def find_solution_node(self, target_value):
+        """Return a node reaching `target_value` with all moves or None.
+
+        Raises
+        ------
+        IncompleteSearch
+            If no solution was found but some moves were discarded (see
+            `num_overflows`).
+        """
+        self.run(self._root.num_remaining_moves)
+        matches = np.flatnonzero(self._layers[-1].values == target_value)
+        if len(matches) == 0:
+            if self.num_overflows:
+                raise IncompleteSearch(
+                    f"{self.num_overflows} moves are larger than "
+                    f"{self._max_abs_value}")
+            return None
+        indices = self._path(len(self._layers) - 1, int(matches[0]))
+        return solver.replay_operation_indices(self._root, indices)
+
+
+def find_solution_node_vectorized(root, target_value,
+                                  max_abs_value=MAX_ABS_VALUE):
+    """Find a solution with a breadth first search over NumPy arrays.
+
+    The returned node is a valid solution, but not necessarily the first one
+    found by `solver.find_solution_node`.
+    """
+    return VectorizedSearch(root, max_abs_value).find_solution_node(
+        target_value)
+
+
+# xxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxxx
+
+@unittest.skipIf(np is None, "numpy is not installed")
+class TestVectorizedSolver(unittest.TestCase):
+    def assertSolves(self, start_value, target_value, num_moves, operations,
+                     warp=None):
+        root = solver.Node(value=start_value, current_op=None,
+                           available_ops=operations,
+                           num_remaining_moves=num_moves, warp=warp)
+        n = find_solution_node_vectorized(root, target_value)
+        self.assertIsNotNone(n)
+        self.assertEqual(n.value, target_value)
+        self.assertEqual(n.num_remaining_moves, 0)
+        return solver.parse_operations_until_node(n)
+
+    def test_kernels(self):
+        x = np.arange(-99999, 100000, dtype=np.int64)
+        functions = [
+            (_reverse, dg.reverse), (_mirror, dg.mirror),
+            (_shift_left, dg.shift_left),
+            (_circular_shift_right, dg.circular_shift_right),
+            (_circular_shift_left, dg.circular_shift_left),
+            (_sum_digits, dg.sum_digits),
+            (_inv10_each_digit, dg.inv10_each_digit)]
+        for kernel, function in functions:
+            out, valid = kernel(x, None)
+            for value, new_value, is_valid in zip(x.tolist(), out.tolist(),
+                                                  valid.tolist()):
+                try:
+                    expected = function(value)
+                except ValueError:
+                    self.assertFalse(is_valid)
+                    continue
+                self.assertTrue(is_valid)
+                self.assertEqual(new_value, expected)
+
+        for enter_idx, exit_idx in [(2, 0), (3, 0), (3, 1), (4, 0)]:
+            out, valid = _np_warp(x, enter_idx, exit_idx)
+            for value, new_value, is_valid in zip(x.tolist(), out.tolist(),
+                                                  valid.tolist()):
+                try:
+                    expected = dg.warp(value, enter_idx, exit_idx)
+                except ValueError:
+                    self.assertFalse(is_valid)
+                    continue
+                self.assertTrue(is_valid)
+                self.assertEqual(new_value, expected)
+
+    def test_levels(self):
+        self.assertSolves(-1, 2020, 8, [op.MultiplyX(3), op.SumX(2),
+                                        op.SumX(8), op.Mirror(),
+                                        op.Reverse()])
+        operations = [op.MultiplyX(3), op.SumX(4), op.SumX(8)]
+        operations.append(op.ModifyButtons_AddValue(operations, 2))
+        self.assertSolves(5, 41, 4, operations)
+        self.assertSolves(1, 1111, 2, [op.StorageAction(),
+                                       op.RetrieveAction()])
+        self.assertSolves(15, 16, 4, [op.SumDigits(), op.Replace(11, "33"),
+                                      op.Reverse(), op.StorageAction(),
+                                      op.RetrieveAction()])
+        self.assertSolves(21, 12, 3, [op.SumX(-7), op.MultiplyX(5),
+                                      op.Inv10EachDigit()])
+        self.assertSolves(99, 10, 3, [op.AddDigits(1), op.SumX(-1)],
+                          op.WarpAction(2, 0))
+
+    def test_modifier_not_last(self):
+        operations = [op.SumX(1), op.MultiplyX(2)]
+        operations.insert(1, op.ModifyButtons_AddValue(operations, 3))
+        solution = self.assertSolves(1, 50, 4, operations)
+        self.assertIn("multiply by 5", solution)
+        for target_value in range(200):
+            root = solver.Node(value=1, current_op=None,
+                               available_ops=operations,
+                               num_remaining_moves=4)
+            self.assertEqual(
+                find_solution_node_vectorized(root, target_value) is None,
+                solver.find_solution_node(root, target_value) is None)
+
+        # The modifier only changes the buttons given to it
+        operations = [op.SumX(1), op.MultiplyX(2)]
+        operations.append(op.ModifyButtons_AddValue(operations[:1], 3))
+        root = solver.Node(value=1, current_op=None,
+                           available_ops=operations, num_remaining_moves=4)
+        for target_value in range(100):
+            self.assertEqual(
+                find_solution_node_vectorized(root, target_value) is None,
+                solver.find_solution_node(root, target_value) is None,
+                target_value)
+
+    def test_same_states_as_lazy_search(self):
+        operations = [op.SumX(3), op.MultiplyX(-2), op.Reverse(),
+                      op.ShiftLeft(), op.AddDigits(5), op.StorageAction(),
+                      op.RetrieveAction()]
+        root = solver.Node(value=4, current_op=None,
+                           available_ops=operations, num_remaining_moves=3)
+        search = VectorizedSearch(root)
+        search.run(3)
+        self.assertEqual(set(search._layers[-1].values.tolist()),
+                         {n.value for n in _iter_leaves(root)})
+
+    def test_unsolvable(self):
+        root = solver.Node(value=1, current_op=None,
+                           available_ops=[op.MultiplyX(2)],
+                           num_remaining_moves=4)
+        self.assertIsNone(find_solution_node_vectorized(root, 15))
+
+    def test_overflows(self):
+        root = solver.Node(value=5, current_op=None,
+                           available_ops=[op.MultiplyX(30), op.SumX(-1),
+                                          op.AddDigits(12)],
+                           num_remaining_moves=2)
+        self.assertEqual(solver.parse_operations_until_node(
+            find_solution_node_vectorized(root, 149)),
+                         ["multiply by 30", "sum with -1"])
+        self.assertEqual(solver.parse_operations_until_node(
+            find_solution_node_vectorized(root, 3, max_abs_value=100)),
+                         ["sum with -1", "sum with -1"])
+        search = VectorizedSearch(root, max_abs_value=100)
+        with self.assertRaises(IncompleteSearch):
+            search.find_solution_node(149)
+        # 150 and 512, then 120 and 412
+        self.assertEqual(search.num_overflows, 4)
+
+        # The kernels mark the results that don't fit in int64
+        root = solver.Node(value=10**14, current_op=None,
+                           available_ops=[op.MultiplyX(10**3),
+                                          op.AddDigits(1234)],
+                           num_remaining_moves=1)
+        with self.assertRaises(IncompleteSearch):
+            find_solution_node_vectorized(root, 1)
+
+
+def _iter_leaves(node):
+    """All nodes without remaining moves below `node`"""
+    if node.num_remaining_moves == 0:
+        yield node
+    for child in node.iter_children():
+        yield from _iter_leaves(child)
+
+
+if __name__ == '__main__':
+    unittest.main()